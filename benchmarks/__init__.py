@@ -0,0 +1,14 @@
+"""Performance benchmarks for busbook.
+
+Run a benchmark as a module from the repository root, e.g.
+
+    python -m benchmarks.feed_index --routes 400 --trips 375
+
+benchmarks.suite runs every scenario against one synthetic feed and writes
+the timings as JSON, for tracking between releases:
+
+    python -m benchmarks.suite --branches 0.2 --loops 0.1 --missing 0.1 \
+        -o results.json
+
+benchmarks.synthetic writes the synthetic feeds as GTFS zips.
+"""
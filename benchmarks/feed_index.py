@@ -0,0 +1,66 @@
+"""Compare per-route trip lookups by list scan against FeedIndex."""
+import argparse
+import os
+import tempfile
+import time
+from zipfile import ZipFile
+
+from transitfeed import problems
+from transitfeed.loader import Loader
+
+from benchmarks.synthetic import generate, write_zip
+from busbook.render import FeedIndex
+
+
+def load(path):
+    accumulator = problems.SimpleProblemAccumulator()
+    accumulator._Report = lambda *args, **kwargs: None
+    return Loader(zip=ZipFile(path),
+                  problems=problems.ProblemReporter(accumulator)).Load()
+
+
+def scan(gtfs):
+    for route in gtfs.GetRouteList():
+        [trip for trip in gtfs.GetTripList() if trip.route_id == route.route_id]
+    for agency in gtfs.GetAgencyList():
+        [route for route in gtfs.GetRouteList()
+         if route.agency_id == agency.agency_id]
+
+
+def indexed(gtfs):
+    index = FeedIndex.from_schedule(gtfs)
+    for route in index.routes:
+        index.trips_by_route.get(route.route_id, [])
+    for agency in index.agencies:
+        index.agency_routes(agency.agency_id)
+
+
+def main():
+    argp = argparse.ArgumentParser(description=__doc__)
+    argp.add_argument('--routes', type=int, default=400)
+    argp.add_argument('--trips', type=int, default=40,
+                      help='trips per route')
+    argp.add_argument('--stops', type=int, default=6,
+                      help='stops per pattern')
+    args = argp.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix='.zip')
+    os.close(fd)
+    try:
+        write_zip(generate(routes=args.routes, trips=args.trips,
+                           stops=args.stops),
+                  path)
+        gtfs = load(path)
+    finally:
+        os.remove(path)
+
+    print('%d routes, %d trips'
+          % (len(gtfs.GetRouteList()), len(gtfs.GetTripList())))
+    for name, fn in (('scan', scan), ('FeedIndex', indexed)):
+        start = time.time()
+        fn(gtfs)
+        print('%-10s %8.3f s' % (name, time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Time a full render of a synthetic feed with different numbers of worker
+processes.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from pathlib2 import Path
+
+from benchmarks.feed_index import load
+from benchmarks.synthetic import generate, write_zip
+from busbook.render import FeedIndex, render
+
+
+def main():
+    argp = argparse.ArgumentParser(description=__doc__)
+    argp.add_argument('--routes', type=int, default=40)
+    argp.add_argument('--trips', type=int, default=200,
+                      help='trips per route')
+    argp.add_argument('--stops', type=int, default=30,
+                      help='stops per pattern')
+    argp.add_argument('--jobs', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = argp.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'feed.zip')
+        write_zip(generate(routes=args.routes, trips=args.trips,
+                           stops=args.stops),
+                  path)
+        gtfs = load(path)
+        index = FeedIndex.from_schedule(gtfs).materialize()
+
+        results = []
+        for jobs in args.jobs:
+            outdir = Path(tmpdir)/('out-%d' % jobs)
+            stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+            try:
+                start = time.time()
+                render(index, outdir=outdir, jobs=jobs)
+                results.append((jobs, time.time() - start))
+            finally:
+                sys.stdout = stdout
+    finally:
+        shutil.rmtree(tmpdir)
+
+    print('%d CPUs' % os.sysconf('SC_NPROCESSORS_ONLN'))
+    print('%4s %10s %8s' % ('jobs', 'time', 'speedup'))
+    for jobs, elapsed in results:
+        print('%4d %8.2f s %7.2fx' % (jobs, elapsed, results[0][1]/elapsed))
+
+
+if __name__ == '__main__':
+    main()
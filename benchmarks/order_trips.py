@@ -0,0 +1,83 @@
+"""Time order_trips() against the networkx trip sort it replaced."""
+import argparse
+import random
+import time
+
+import networkx
+
+from busbook.render import order_trips
+
+
+def trip_graph(trip_cells):
+    """Return the graph of the trips that the original Timetable._sort()
+    sorted, with an edge from each trip to the trips that follow it.
+    """
+    graph = networkx.DiGraph()
+    graph.add_nodes_from(range(len(trip_cells)))
+    for this_node, cells in enumerate(trip_cells):
+        other_nodes = set(range(len(trip_cells)))
+        for column in sorted(cells):
+            for other_node in [node for node in other_nodes
+                               if column in trip_cells[node]]:
+                if (cells[column] < trip_cells[other_node][column]
+                        and not networkx.has_path(graph, other_node, this_node)
+                        and not graph.has_edge(this_node, other_node)):
+                    graph.add_edge(this_node, other_node)
+                other_nodes.remove(other_node)
+            if len(other_nodes) == 0:
+                break
+    return graph
+
+
+def graph_order(trip_cells):
+    """The original networkx implementation of Timetable._sort()."""
+    return list(networkx.topological_sort(trip_graph(trip_cells)))
+
+
+def timetable(trips, columns=12, seed=0):
+    """Return the cells of a day of trips with short turns, skipped
+    timepoints and an occasional overtaking express.
+    """
+    rand = random.Random(seed)
+    res = []
+    for t in range(trips):
+        begin = rand.randrange(columns//3) if rand.random() < 0.3 else 0
+        end = (columns - 1 - rand.randrange(columns//3)
+               if rand.random() < 0.3 else columns - 1)
+        express = rand.random() < 0.05
+        secs = 5*3600 + t*(19*3600//trips)
+        cells = {}
+        for column in range(begin, end + 1):
+            if not express or column in (begin, end) or column % 3 == 0:
+                cells[column] = secs
+            secs += (4 if express else 6)*60
+        res.append(cells)
+    rand.shuffle(res)
+    return res
+
+
+def main():
+    argp = argparse.ArgumentParser(description=__doc__)
+    argp.add_argument('--trips', type=int, nargs='+',
+                      default=[10, 50, 100, 300, 1000, 5000])
+    argp.add_argument('--reference-limit', type=int, default=300,
+                      help='skip the networkx version above this many trips')
+    args = argp.parse_args()
+
+    print('%6s %12s %12s' % ('trips', 'order_trips', 'networkx'))
+    for count in args.trips:
+        trip_cells = timetable(count)
+        start = time.time()
+        order_trips(trip_cells)
+        new = time.time() - start
+        if count <= args.reference_limit:
+            start = time.time()
+            graph_order(trip_cells)
+            old = '%10.3f s' % (time.time() - start)
+        else:
+            old = '%12s' % '-'
+        print('%6d %10.3f s %s' % (count, new, old))
+
+
+if __name__ == '__main__':
+    main()
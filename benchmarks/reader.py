@@ -0,0 +1,69 @@
+"""Compare load time and peak memory of the transitfeed and fast readers.
+
+Each reader loads the feed in a fresh subprocess so that peak RSS is measured
+in isolation.
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from zipfile import ZipFile
+
+from benchmarks.synthetic import generate, write_zip
+
+
+def load(reader, path):
+    start = time.time()
+    if reader == 'fast':
+        from busbook import feed
+        index = feed.load(ZipFile(path))
+    else:
+        from benchmarks.feed_index import load
+        from busbook.render import FeedIndex
+        index = FeedIndex.from_schedule(load(path))
+    # Touch every trip's stop times, as a render would.
+    for trips in index.trips_by_route.itervalues():
+        for trip in trips:
+            index.stop_times.timepoints(trip)
+    elapsed = time.time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print('%s %.3f %d' % (reader, elapsed, peak))
+
+
+def main():
+    argp = argparse.ArgumentParser(description=__doc__)
+    argp.add_argument('--routes', type=int, default=100)
+    argp.add_argument('--trips', type=int, default=100,
+                      help='trips per route')
+    argp.add_argument('--stops', type=int, default=20,
+                      help='stops per pattern')
+    argp.add_argument('--load', nargs=2, metavar=('READER', 'PATH'),
+                      help=argparse.SUPPRESS)
+    args = argp.parse_args()
+    if args.load:
+        load(*args.load)
+        return
+
+    fd, path = tempfile.mkstemp(suffix='.zip')
+    os.close(fd)
+    try:
+        write_zip(generate(routes=args.routes, trips=args.trips,
+                           stops=args.stops),
+                  path)
+        print('%d stop times' % (args.routes*args.trips*args.stops))
+        for reader in ('transitfeed', 'fast'):
+            out = subprocess.check_output(
+                [sys.executable, '-m', 'benchmarks.reader', '--load', reader,
+                 path])
+            name, elapsed, peak = out.split()[-3:]
+            print('%-12s %8.3f s %8.1f MB peak RSS'
+                  % (name, float(elapsed), int(peak)/1024.0))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""Run timed scenarios for busbook's hot paths and a full CLI run, and write
+the results as JSON so that they can be compared between releases.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from zipfile import ZipFile
+
+from pathlib2 import Path
+
+from benchmarks.order_trips import timetable
+from benchmarks.synthetic import add_variant_arguments, generate, write_zip
+from benchmarks.unite import patterns
+from busbook import feed
+from busbook.render import (ServicePeriod, Timetable, order_trips, render,
+                            unite)
+
+
+DATE = datetime(2020, 1, 6)
+
+
+@contextmanager
+def quiet():
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        yield
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def scenarios(path, tmpdir):
+    """Return (name, setup) pairs; setup() returns the function to time."""
+    def load():
+        return feed.load(ZipFile(path))
+
+    def route_trips(index):
+        return index.trips_by_route.values()
+
+    def unite_patterns():
+        sequences = patterns(120, 200)
+        return lambda: unite(*sequences)
+
+    def sort_trips():
+        cells = timetable(1000, columns=40)
+        return lambda: order_trips(cells)
+
+    def separate():
+        index = load()
+        period = ServicePeriod.__new__(ServicePeriod)
+        trips = route_trips(index)
+        return lambda: [period._separate(index, route) for route in trips]
+
+    def timetables():
+        index = load()
+        directions = []
+        for trips in route_trips(index):
+            period = ServicePeriod.__new__(ServicePeriod)
+            directions += period._separate(index, trips)
+        return lambda: [Timetable(index, trips) for trips in directions]
+
+    def render_all():
+        index = load()
+
+        def run():
+            with quiet():
+                render(index, date=DATE, outdir=Path(tmpdir)/'render')
+        return run
+
+    def cli(reader):
+        def setup():
+            command = [sys.executable, '-c',
+                       'from busbook.cli import main; main()',
+                       path, '--no-cache', '--reader', reader,
+                       '--date', DATE.strftime('%Y-%m-%d'),
+                       '--output', os.path.join(tmpdir, 'cli-' + reader)]
+
+            def run():
+                with open(os.devnull, 'w') as devnull:
+                    subprocess.check_call(command, stdout=devnull,
+                                          stderr=devnull)
+            return run
+        return setup
+
+    return [('unite', unite_patterns),
+            ('order_trips', sort_trips),
+            ('separate', separate),
+            ('timetable', timetables),
+            ('render', render_all),
+            ('cli-transitfeed', cli('transitfeed')),
+            ('cli-fast', cli('fast'))]
+
+
+def git_revision():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], stderr=devnull,
+                cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    argp = argparse.ArgumentParser(description=__doc__)
+    argp.add_argument('--routes', type=int, default=20)
+    argp.add_argument('--trips', type=int, default=100,
+                      help='trips per route')
+    argp.add_argument('--stops', type=int, default=30,
+                      help='stops per pattern')
+    argp.add_argument('--seed', type=int, default=0)
+    add_variant_arguments(argp)
+    argp.add_argument('--repeat', type=int, default=3,
+                      help='runs of each scenario (default: 3)')
+    argp.add_argument('--scenario', action='append',
+                      help='run only this scenario (may be repeated)')
+    argp.add_argument('--output', '-o',
+                      help='write the JSON results to this file '
+                           '(default: standard output)')
+    args = argp.parse_args()
+
+    feed_args = {'routes': args.routes, 'trips': args.trips,
+                 'stops': args.stops, 'seed': args.seed,
+                 'branches': args.branches, 'loops': args.loops,
+                 'missing': args.missing}
+    results = {}
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'feed.zip')
+        write_zip(generate(**feed_args), path)
+        for name, setup in scenarios(path, tmpdir):
+            if args.scenario and name not in args.scenario:
+                continue
+            fn = setup()
+            runs = []
+            for _ in range(args.repeat):
+                start = time.time()
+                fn()
+                runs.append(time.time() - start)
+            runs.sort()
+            results[name] = {'runs': runs, 'min': runs[0],
+                             'median': runs[len(runs)//2]}
+            sys.stderr.write('%-16s %10.3f s\n' % (name, runs[0]))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'feed': feed_args,
+        'repeat': args.repeat,
+        'results': results,
+        }
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2, separators=(',', ': '),
+                  sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as fd:
+            json.dump(report, fd, indent=2, separators=(',', ': '),
+                      sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""Deterministic generator for synthetic GTFS feeds."""
+import argparse
+import csv
+import random
+from io import BytesIO
+from zipfile import ZipFile, ZIP_DEFLATED
+
+
+def generate(routes=10, trips=50, stops=20, seed=0, branches=0.0, loops=0.0,
+             missing=0.0):
+    """Return a dict of GTFS file names to lists of rows (header first).
+
+    The fractions branches and loops of trips take a branch off the middle
+    of their route and run back to their first stop, respectively, and the
+    fraction missing of timepoints have no time.
+    """
+    rand = random.Random(seed)
+    # Draw variations from their own generator, so that feeds without them
+    # are the same as before they were added.
+    variant = random.Random(seed + 1)
+    tables = {
+        'agency.txt': [['agency_id', 'agency_name', 'agency_url',
+                        'agency_timezone', 'agency_phone'],
+                       ['SYN', 'Synthetic Transit', 'http://example.com',
+                        'America/Los_Angeles', '555-0100']],
+        'calendar.txt': [['service_id', 'monday', 'tuesday', 'wednesday',
+                          'thursday', 'friday', 'saturday', 'sunday',
+                          'start_date', 'end_date'],
+                         ['WKDY', 1, 1, 1, 1, 1, 0, 0, '20190101', '20291231'],
+                         ['SAT', 0, 0, 0, 0, 0, 1, 0, '20190101', '20291231'],
+                         ['SUN', 0, 0, 0, 0, 0, 0, 1, '20190101', '20291231']],
+        'routes.txt': [['route_id', 'agency_id', 'route_short_name',
+                        'route_long_name', 'route_type', 'route_color',
+                        'route_text_color']],
+        'stops.txt': [['stop_id', 'stop_name', 'stop_lat', 'stop_lon']],
+        'trips.txt': [['route_id', 'service_id', 'trip_id', 'trip_headsign',
+                       'direction_id', 'shape_id']],
+        'stop_times.txt': [['trip_id', 'arrival_time', 'departure_time',
+                            'stop_id', 'stop_sequence', 'timepoint']],
+        'shapes.txt': [['shape_id', 'shape_pt_lat', 'shape_pt_lon',
+                        'shape_pt_sequence']],
+        }
+    services = ['WKDY', 'WKDY', 'WKDY', 'SAT', 'SUN']
+    for r in range(routes):
+        route_id = 'R%d' % r
+        tables['routes.txt'].append(
+            [route_id, 'SYN', str(r + 1), 'Synthetic Line %d' % (r + 1), 3,
+             '%06X' % rand.randrange(0x1000000), 'FFFFFF'])
+
+        # Lay the route out as a straight line of stops.
+        lat, lon = 34.0 + rand.random(), -118.0 - rand.random()
+        stop_ids = []
+        for s in range(stops):
+            stop_id = '%s-S%d' % (route_id, s)
+            stop_ids.append(stop_id)
+            tables['stops.txt'].append(
+                [stop_id, 'Stop %d on Line %d' % (s, r + 1),
+                 '%.6f' % (lat + s*0.005), '%.6f' % (lon + s*0.005)])
+        branch_ids = []
+        if branches > 0:
+            for s in range(stops//4):
+                stop_id = '%s-B%d' % (route_id, s)
+                branch_ids.append(stop_id)
+                tables['stops.txt'].append(
+                    [stop_id, 'Branch Stop %d on Line %d' % (s, r + 1),
+                     '%.6f' % (lat - 0.005), '%.6f' % (lon + s*0.005)])
+        for d, pattern in enumerate((stop_ids, stop_ids[::-1])):
+            shape_id = '%s-D%d' % (route_id, d)
+            for seq, stop_id in enumerate(pattern):
+                s = int(stop_id.rsplit('S', 1)[1])
+                tables['shapes.txt'].append(
+                    [shape_id, '%.6f' % (lat + s*0.005),
+                     '%.6f' % (lon + s*0.005), seq])
+
+        for t in range(trips):
+            trip_id = '%s-T%d' % (route_id, t)
+            direction = t % 2
+            pattern = stop_ids if direction == 0 else stop_ids[::-1]
+            if branch_ids and variant.random() < branches:
+                # Leave the line halfway, for the rest of the trip.
+                at = len(pattern)//2
+                pattern = pattern[:at] + (branch_ids if direction == 0
+                                          else branch_ids[::-1])
+            if variant.random() < loops:
+                pattern = pattern + pattern[-2::-1]
+            tables['trips.txt'].append(
+                [route_id, services[t % len(services)], trip_id,
+                 'To Stop %s' % pattern[-1], direction,
+                 '%s-D%d' % (route_id, direction)])
+            secs = 5*3600 + (t // 2)*(19*3600 // max(trips // 2, 1))
+            for seq, stop_id in enumerate(pattern):
+                timepoint = int(seq % 4 == 0 or seq == len(pattern) - 1)
+                time = '%02d:%02d:%02d' % (secs // 3600, secs // 60 % 60,
+                                           0 if timepoint else secs % 60)
+                if (timepoint and 0 < seq < len(pattern) - 1
+                        and missing > 0 and variant.random() < missing):
+                    timepoint, time = 0, ''
+                tables['stop_times.txt'].append(
+                    [trip_id, time, time, stop_id, seq, timepoint])
+                secs += 60 + rand.randrange(120)
+    return tables
+
+
+def write_zip(tables, path):
+    with ZipFile(path, 'w', ZIP_DEFLATED) as zipf:
+        for name, rows in sorted(tables.items()):
+            buf = BytesIO()
+            csv.writer(buf).writerows(rows)
+            zipf.writestr(name, buf.getvalue())
+
+
+def main():
+    argp = argparse.ArgumentParser(
+        description='Write a synthetic GTFS feed for benchmarking.')
+    argp.add_argument('output', help='path of the zip file to write')
+    argp.add_argument('--routes', type=int, default=10)
+    argp.add_argument('--trips', type=int, default=50,
+                      help='trips per route')
+    argp.add_argument('--stops', type=int, default=20,
+                      help='stops per pattern')
+    argp.add_argument('--seed', type=int, default=0)
+    add_variant_arguments(argp)
+    args = argp.parse_args()
+    write_zip(generate(routes=args.routes, trips=args.trips, stops=args.stops,
+                       seed=args.seed, branches=args.branches, loops=args.loops,
+                       missing=args.missing),
+              args.output)
+
+
+def add_variant_arguments(argp):
+    argp.add_argument('--branches', type=float, default=0.0,
+                      help='fraction of trips that take a branch')
+    argp.add_argument('--loops', type=float, default=0.0,
+                      help='fraction of trips that loop back to their start')
+    argp.add_argument('--missing', type=float, default=0.0,
+                      help='fraction of timepoints without a time')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""Compare rendering timetable bodies through Jinja against timetable_body."""
+import argparse
+import time
+from array import array
+
+from benchmarks.order_trips import timetable
+from busbook.render import Timetable, make_env, timetable_body
+
+
+TEMPLATE = """\
+{% for row in timetable.rows %}
+                                        <tr>
+{% for time in row %}
+{% if time == Timetable.NO_SERVICE %}
+                                                <td class="timetable-no"></td>
+{% elif time == Timetable.SKIP %}
+                                                <td class="timetable-skip"></td>
+{% else %}
+                                                <td>{{ time|time }}</td>
+{% endif %}
+{% endfor %}
+                                        </tr>
+{% endfor %}
+"""
+
+
+def make_timetable(trips, columns):
+    res = Timetable.__new__(Timetable)
+    res.height, res.width = trips, columns
+    res.grid = array('i')
+    for cells in timetable(trips, columns=columns):
+        first, last = min(cells), max(cells)
+        res.grid.extend(cells.get(column, Timetable.SKIP)
+                        if first <= column <= last else Timetable.NO_SERVICE
+                        for column in range(columns))
+    return res
+
+
+def main():
+    argp = argparse.ArgumentParser(description=__doc__)
+    argp.add_argument('--trips', type=int, default=300)
+    argp.add_argument('--columns', type=int, default=40)
+    argp.add_argument('--repeat', type=int, default=10)
+    args = argp.parse_args()
+
+    table = make_timetable(args.trips, args.columns)
+    template = make_env().from_string(TEMPLATE)
+    print('%d x %d timetable' % (args.trips, args.columns))
+    for name, fn in (
+            ('jinja', lambda: template.render(timetable=table,
+                                              Timetable=Timetable)),
+            ('timetable_body', lambda: timetable_body(table))):
+        start = time.time()
+        for _ in range(args.repeat):
+            fn()
+        print('%-16s %8.2f ms' % (name, (time.time() - start)/args.repeat*1000))
+
+
+if __name__ == '__main__':
+    main()
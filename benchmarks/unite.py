@@ -0,0 +1,88 @@
+"""Time unite() against the networkx implementation it replaced."""
+import argparse
+import random
+import time
+
+import networkx
+
+from busbook.render import unite
+
+
+def graph_unite(*sequences):
+    """The original networkx implementation of unite()."""
+    graph = networkx.DiGraph()
+    all_items = reduce(lambda s1, s2: s1.union(s2),
+                       (set(sequence) for sequence in sequences))
+    node_item = {n: item for n, item in enumerate(all_items)}
+    for node in node_item.keys():
+        graph.add_node(node)
+    next_node = len(all_items)
+    for sequence in sequences:
+        items = iter(sequence)
+        try:
+            first_item = next(items)
+        except StopIteration:
+            break
+        last_node = min(node for node, item in node_item.iteritems()
+                        if item == first_item)
+        for this_item in items:
+            try:
+                new_node = min(node for node, item in node_item.iteritems()
+                               if item == this_item
+                                  and not networkx.has_path(graph, node, last_node))
+            except ValueError: # No node found.
+                new_node = next_node
+                node_item[next_node] = this_item
+                next_node += 1
+            if not graph.has_edge(last_node, new_node):
+                graph.add_edge(last_node, new_node)
+            last_node = new_node
+    topo_sort = networkx.topological_sort(graph)
+    return [node_item[node] for node in topo_sort]
+
+
+def patterns(stops, count, seed=0):
+    """Return count stop patterns that each skip, branch or short-turn part
+    of a line of stops.
+    """
+    rand = random.Random(seed)
+    line = range(stops)
+    branch = range(stops, stops + stops//4)
+    res = []
+    for _ in range(count):
+        begin = rand.randrange(stops//4)
+        end = stops - rand.randrange(stops//4)
+        pattern = [stop for stop in line[begin:end] if rand.random() > 0.1]
+        if rand.random() < 0.3:
+            at = len(pattern)//2
+            pattern = pattern[:at] + branch + pattern[at:]
+        res.append(pattern)
+    return res
+
+
+def main():
+    argp = argparse.ArgumentParser(description=__doc__)
+    argp.add_argument('--stops', type=int, default=120)
+    argp.add_argument('--patterns', type=int, nargs='+',
+                      default=[10, 50, 100, 200, 500])
+    argp.add_argument('--reference-limit', type=int, default=200,
+                      help='skip the networkx version above this many patterns')
+    args = argp.parse_args()
+
+    print('%9s %12s %12s' % ('patterns', 'unite', 'networkx'))
+    for count in args.patterns:
+        sequences = patterns(args.stops, count)
+        start = time.time()
+        unite(*sequences)
+        new = time.time() - start
+        if count <= args.reference_limit:
+            start = time.time()
+            graph_unite(*sequences)
+            old = '%10.3f s' % (time.time() - start)
+        else:
+            old = '%12s' % '-'
+        print('%9d %10.3f s %s' % (count, new, old))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""Building the bus books of many feeds in one run, for busbook batch.
+
+A batch manifest is a JSON list of feeds, each an object with the path of
+its GTFS file ("feed"), its output directory ("output"), and optionally the
+date ("date") or range of dates ("date_range", as "START:END"), but not
+both, to show service for. Paths are relative to the manifest.
+"""
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from datetime import datetime
+
+from busbook.render import Record
+
+
+class BatchError(Exception):
+    pass
+
+
+def parse_date_range(value):
+    """Return the start and end dates of a range given as START:END. Raise
+    ValueError if it is malformed or ends before it starts.
+    """
+    try:
+        start, end = [datetime.strptime(datestr, '%Y-%m-%d')
+                      for datestr in value.split(':')]
+    except ValueError:
+        raise ValueError(
+            "expected START:END (format: '2019-01-02:2019-01-15')")
+    if end < start:
+        raise ValueError('the range ends before it starts')
+    return start, end
+
+
+def read_batch(path):
+    """Return the entries of the batch manifest at path as Records."""
+    with open(path, 'rb') as fd:
+        try:
+            entries = json.load(fd)
+        except ValueError as err:
+            raise BatchError('%s: %s' % (path, err))
+    if not isinstance(entries, list):
+        raise BatchError('%s: expected a list of feeds' % path)
+
+    base = os.path.dirname(os.path.abspath(path))
+    res = []
+    for n, entry in enumerate(entries):
+        if (not isinstance(entry, dict) or 'feed' not in entry
+                or 'output' not in entry):
+            raise BatchError('%s: feed %d needs a "feed" and an "output"'
+                             % (path, n + 1))
+        if (entry.get('date') is not None
+                and entry.get('date_range') is not None):
+            raise BatchError('%s: feed %d has both a "date" and a '
+                             '"date_range"' % (path, n + 1))
+        try:
+            date = (None if entry.get('date') is None
+                    else datetime.strptime(entry['date'], '%Y-%m-%d'))
+            date_range = (None if entry.get('date_range') is None
+                          else parse_date_range(entry['date_range']))
+        except ValueError as err:
+            raise BatchError('%s: feed %d: %s' % (path, n + 1, err))
+        res.append(Record(feed=os.path.join(base, entry['feed']),
+                          output=os.path.join(base, entry['output']),
+                          date=date, date_range=date_range))
+    return res
+
+
+def feed_size(entry):
+    try:
+        return os.path.getsize(entry.feed)
+    except OSError:
+        return 0
+
+
+def run_batch(entries, build, jobs=1, initializer=None, initargs=()):
+    """Call build on each entry, largest feed first, using up to jobs
+    processes, each set up by calling initializer with initargs. Return the
+    results of build in the order they finished.
+
+    build returns a dict that describes the result, and exceptions it raises
+    are recorded in a result rather than stopping the batch.
+    """
+    entries = sorted(entries, key=feed_size, reverse=True)
+    if jobs == 1:
+        if initializer is not None:
+            initializer(*initargs)
+        return [_run_entry((build, entry)) for entry in entries]
+    else:
+        pool = multiprocessing.Pool(jobs, initializer=initializer,
+                                    initargs=initargs)
+        try:
+            return list(pool.imap_unordered(
+                _run_entry, [(build, entry) for entry in entries]))
+        finally:
+            pool.close()
+            pool.join()
+
+
+def _run_entry(job):
+    build, entry = job
+    start = time.time()
+    try:
+        result = build(entry)
+    except Exception:
+        result = {'status': 'error', 'error': traceback.format_exc()}
+    result.update(feed=entry.feed, output=entry.output,
+                  seconds=time.time() - start)
+    return result
+
+
+def write_report(path, results):
+    with open(path, 'w') as fd:
+        json.dump({'feeds': results}, fd, indent=2, separators=(',', ': '),
+                  sort_keys=True)
+
+
+def summary(results):
+    lines = ['%-32s %-8s %10s %8s' % ('Feed', 'Status', 'Time', 'Failed')]
+    for result in sorted(results, key=lambda result: result['feed']):
+        lines.append('%-32s %-8s %8.2f s %8d'
+                     % (os.path.basename(result['feed'])[:32],
+                        result['status'], result['seconds'],
+                        len(result.get('failed_routes', []))))
+    failed = [result for result in results if result['status'] != 'ok']
+    lines.append('%d of %d feeds built without errors.'
+                 % (len(results) - len(failed), len(results)))
+    return '\n'.join(lines)
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""An on-disk cache of loaded feeds, keyed by the contents of the GTFS zip
+file and by the code that loaded them, so that later runs on the same file
+skip parsing and validation.
+"""
+import cPickle as pickle
+import errno
+import hashlib
+import os
+import tempfile
+import traceback
+
+from pathlib2 import Path
+
+
+# Bump when the layout of a cached FeedIndex changes. Snapshots are also
+# keyed by a digest of the package's code, so that those written by other
+# code are never loaded, even if a change to the layout was not bumped for.
+CACHE_VERSION = 4
+PACKAGE_DIR = Path(__file__).parent
+_code_version = None
+
+
+def default_cache_dir():
+    return (Path(os.environ.get('XDG_CACHE_HOME')
+                 or Path(os.path.expanduser('~'))/'.cache')
+            /'busbook')
+
+
+def feed_digest(fd):
+    """Return a digest of the contents of the open file fd."""
+    digest = hashlib.sha1()
+    fd.seek(0)
+    for chunk in iter(lambda: fd.read(1 << 20), b''):
+        digest.update(chunk)
+    fd.seek(0)
+    return digest.hexdigest()
+
+
+def code_version():
+    """Return a digest of the package's modules, which define the classes of
+    a cached FeedIndex.
+    """
+    global _code_version
+    if _code_version is None:
+        digest = hashlib.sha1()
+        for path in sorted(PACKAGE_DIR.glob('*.py')):
+            digest.update(path.name)
+            with path.open('rb') as fd:
+                digest.update(fd.read())
+        _code_version = digest.hexdigest()[:12]
+    return _code_version
+
+
+def snapshot_path(cache_dir, digest):
+    return cache_dir/('%s-v%d-%s.pickle'
+                      % (digest, CACHE_VERSION, code_version()))
+
+
+def read_snapshot(cache_dir, digest):
+    """Return the cached FeedIndex for the feed with digest, or None. A
+    snapshot that cannot be loaded, such as a truncated one, is deleted.
+    """
+    path = snapshot_path(cache_dir, digest)
+    try:
+        with path.open('rb') as fd:
+            index = pickle.load(fd)
+    except IOError as err:
+        if err.errno != errno.ENOENT:
+            remove_snapshot(path, err)
+        return None
+    except Exception as err:
+        remove_snapshot(path, err)
+        return None
+    # Mark the snapshot as recently used.
+    try:
+        os.utime(str(path), None)
+    except OSError as err:
+        if err.errno != errno.ENOENT:
+            raise
+    return index
+
+
+def remove_snapshot(path, error):
+    print('WARNING: Ignoring unreadable cached feed %s: %s'
+          % (path.name,
+             traceback.format_exception_only(type(error), error)[-1].strip()))
+    try:
+        path.unlink()
+    except OSError as err:
+        if err.errno != errno.ENOENT:
+            raise
+
+
+def write_snapshot(cache_dir, digest, index):
+    """Store a materialized FeedIndex for the feed with digest."""
+    try:
+        cache_dir.mkdir(parents=True)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+    # Write to a temporary file first so that readers never see a partial
+    # snapshot.
+    fd, tmp_path = tempfile.mkstemp(dir=str(cache_dir), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_fd:
+            pickle.dump(index, tmp_fd, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, str(snapshot_path(cache_dir, digest)))
+    except:
+        os.remove(tmp_path)
+        raise
+
+
+def evict(cache_dir, max_bytes):
+    """Delete the least recently used snapshots until the cache holds at
+    most max_bytes. Other processes may be evicting at the same time.
+    """
+    snapshots = []
+    for path in cache_dir.glob('*.pickle'):
+        try:
+            snapshots.append((path.stat(), path))
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+    snapshots.sort(key=lambda (stat, path): stat.st_mtime)
+    total = sum(stat.st_size for stat, path in snapshots)
+    for stat, path in snapshots:
+        if total <= max_bytes:
+            break
+        total -= stat.st_size
+        try:
+            path.unlink()
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
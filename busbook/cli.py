@@ -1,37 +1,381 @@
 import argparse
+import cProfile
+import sys
 from datetime import datetime
+from functools import partial
 from pathlib2 import Path
 from zipfile import ZipFile
 
-from busbook.render import render
+from busbook.cache import (default_cache_dir, evict, feed_digest,
+                           read_snapshot, write_snapshot)
+from busbook import batch, feed
+from busbook.compress import SUFFIXES, brotli
+from busbook.render import FeedIndex, make_env, render, render_range
+from busbook.serve import serve
+from busbook.timing import NULL_PROFILER, Profiler
 
 from transitfeed.loader import Loader
 
 
 def main():
+    if sys.argv[1:2] == ['serve']:
+        return serve_main(sys.argv[2:])
+    elif sys.argv[1:2] == ['batch']:
+        return batch_main(sys.argv[2:])
+
     argp = argparse.ArgumentParser(
-        description='Generate an HTML bus book from a GTFS feed.')
+        description='Generate an HTML bus book from a GTFS feed.',
+        epilog="Run 'busbook serve -h' for the options to serve pages "
+               "rendered on demand instead, and 'busbook batch -h' for the "
+               "options to build the books of many feeds.")
     argp.add_argument('file', metavar='GTFS file', type=argparse.FileType('rb', 0))
-    argp.add_argument(
+    dates = argp.add_mutually_exclusive_group()
+    dates.add_argument(
         '--date', '-d',
-        help="view service for a specific date (format: '2019-01-02', default: today)")
+        help="view service for the week from a specific date (format: "
+             "'2019-01-02', default: today)")
+    dates.add_argument(
+        '--date-range',
+        metavar='START:END',
+        type=date_range,
+        help="write a bus book for each date from START to END into a "
+             "directory of the output directory named for the date (format: "
+             "'2019-01-02:2019-01-15')")
     argp.add_argument(
         '--output', '-o',
         default='./out',
         help='output directory (default: ./out)')
+    argp.add_argument(
+        '--jobs', '-j',
+        type=int,
+        default=1,
+        help='number of processes to render routes with (default: 1)')
+    argp.add_argument(
+        '--incremental', '-i',
+        action='store_true',
+        help='only rewrite the pages of routes that changed since the last '
+             'incremental build into the output directory')
+    add_feed_arguments(argp)
+    argp.add_argument(
+        '--precompress',
+        metavar='FORMATS',
+        type=compress_formats,
+        default=(),
+        help='also write each output file compressed, as comma-separated '
+             'gzip and brotli, for a web server to serve')
+    argp.add_argument(
+        '--profile',
+        metavar='FILE',
+        help='write the time of each phase and route, and the peak memory '
+             'so far after each, to FILE as JSON, and print the slowest '
+             'routes')
+    argp.add_argument(
+        '--cprofile',
+        metavar='FILE',
+        help='run under cProfile and write the statistics to FILE')
     args = argp.parse_args()
+    if args.max_memory is not None and args.jobs > 1:
+        argp.error('--max-memory renders one route at a time, so it cannot '
+                   'be used with --jobs')
+
+    profiler = NULL_PROFILER if args.profile is None else Profiler()
+    if args.cprofile is None:
+        failures = build(args, profiler)
+    else:
+        stats = cProfile.Profile()
+        try:
+            failures = stats.runcall(build, args, profiler)
+        finally:
+            stats.dump_stats(args.cprofile)
+    if args.profile is not None:
+        profiler.write(args.profile)
+        # Route names may not be encodable in stdout's encoding.
+        print profiler.summary().encode('utf-8')
+    if len(failures) > 0:
+        sys.exit(1)
+
+
+def serve_main(argv):
+    argp = argparse.ArgumentParser(
+        prog='busbook serve',
+        description='Serve an HTML bus book from a GTFS feed, rendering each '
+                    'page when it is first requested. Pages take the date '
+                    "to show service for as a query parameter, such as "
+                    "'routes/A-1.html?date=2019-01-02'.")
+    argp.add_argument('file', metavar='GTFS file', type=argparse.FileType('rb', 0))
+    argp.add_argument(
+        '--host',
+        default='127.0.0.1',
+        help='address to listen on (default: %(default)s)')
+    argp.add_argument(
+        '--port', '-p',
+        type=int,
+        default=8000,
+        help='port to listen on (default: %(default)s)')
+    argp.add_argument(
+        '--max-pages',
+        type=int,
+        default=128,
+        help='number of rendered route pages to keep in memory '
+             '(default: %(default)s)')
+    add_feed_arguments(argp)
+    args = argp.parse_args(argv)
+
+    index = load(args)
+    print 'Loading complete.'
+    if (args.max_memory is None and args.no_cache
+            and args.reader == 'transitfeed'):
+        # Pages are rendered on many threads, and the Schedule can only be
+        # read from the thread that loaded it.
+        index = index.materialize()
+    try:
+        serve(index, host=args.host, port=args.port,
+              cache_dir=None if args.no_cache else Path(args.cache_dir),
+              simplify=args.simplify, timetables=args.timetables,
+              max_pages=args.max_pages)
+    finally:
+        index.stop_times.close()
+
+
+def batch_main(argv):
+    argp = argparse.ArgumentParser(
+        prog='busbook batch',
+        description='Generate the HTML bus books of many GTFS feeds, listed '
+                    'in a JSON manifest of objects with the keys "feed", '
+                    '"output", and optionally "date" or "date_range".')
+    argp.add_argument('manifest', help='path of the batch manifest')
+    argp.add_argument(
+        '--jobs', '-j',
+        type=int,
+        default=1,
+        help='number of feeds to build at once (default: 1)')
+    argp.add_argument(
+        '--incremental', '-i',
+        action='store_true',
+        help='only rewrite the pages of routes that changed since the last '
+             'incremental build into each output directory')
+    argp.add_argument(
+        '--precompress',
+        metavar='FORMATS',
+        type=compress_formats,
+        default=(),
+        help='also write each output file compressed, as comma-separated '
+             'gzip and brotli, for a web server to serve')
+    argp.add_argument(
+        '--report',
+        metavar='FILE',
+        help='write the result and timings of each feed to FILE as JSON')
+    add_feed_arguments(argp)
+    args = argp.parse_args(argv)
+    try:
+        entries = batch.read_batch(args.manifest)
+    except (IOError, batch.BatchError) as err:
+        argp.error(str(err))
+
+    # Build feeds in parallel, and the routes of each feed in one process.
+    jobs = args.jobs
+    args.jobs = 1
+    results = batch.run_batch(
+        entries, partial(build_entry, args), jobs=jobs,
+        initializer=init_batch_worker,
+        initargs=(None if args.no_cache else Path(args.cache_dir),))
+    for result in results:
+        if result['status'] == 'error':
+            print('ERROR: Failed to build %s:\n%s'
+                  % (result['feed'], result['error']))
+    if args.report is not None:
+        batch.write_report(args.report, results)
+    print batch.summary(results)
+    if any(result['status'] != 'ok' for result in results):
+        sys.exit(1)
+
+
+_batch_env = None
+
 
-    gtfs = load_gtfs(args.file)
+def init_batch_worker(cache_dir):
+    global _batch_env
+    _batch_env = make_env(cache_dir)
+
+
+def build_entry(args, entry):
+    """Build the bus book of a batch entry with the options in args, and
+    return its result for the batch report.
+    """
+    feed_args = argparse.Namespace(**vars(args))
+    feed_args.output = entry.output
+    feed_args.date = (None if entry.date is None
+                      else entry.date.strftime('%Y-%m-%d'))
+    feed_args.date_range = entry.date_range
+    profiler = Profiler()
+    with open(entry.feed, 'rb', 0) as feed_args.file:
+        with profiler.phase('load'):
+            index = load(feed_args)
+    try:
+        failures = render_book(index, feed_args, profiler, env=_batch_env)
+    finally:
+        index.stop_times.close()
+    return {'status': 'ok' if len(failures) == 0 else 'failed',
+            'routes': len(index.routes),
+            'failed_routes': [route.route_id for route in failures],
+            'phases': profiler.phases}
+
+
+def add_feed_arguments(argp):
+    argp.add_argument(
+        '--cache-dir',
+        default=str(default_cache_dir()),
+        help='directory for cached feeds (default: %(default)s)')
+    argp.add_argument(
+        '--cache-size',
+        type=int,
+        default=1024,
+        help='maximum size of the feed cache in MB (default: 1024)')
+    argp.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='always load the feed from the GTFS file and compile the '
+             'templates')
+    argp.add_argument(
+        '--reader',
+        choices=['transitfeed', 'fast'],
+        default='transitfeed',
+        help='GTFS reader: transitfeed validates the feed, fast streams only '
+             'the tables busbook needs into compact arrays '
+             '(default: transitfeed)')
+    argp.add_argument(
+        '--route',
+        metavar='GLOB',
+        action='append',
+        default=[],
+        help='only build the routes whose route_id or short name matches '
+             'GLOB, leaving the rest of the output directory as it is; may '
+             'be given more than once')
+    argp.add_argument(
+        '--agency',
+        metavar='GLOB',
+        action='append',
+        default=[],
+        help='only build the routes of agencies whose agency_id or name '
+             'matches GLOB, as --route does')
+    argp.add_argument(
+        '--max-memory',
+        metavar='MB',
+        type=int,
+        help='partition the stop times by route into temporary files, '
+             'buffering about MB of them in memory, and read one route at a '
+             'time, so that memory use is set by the largest route rather '
+             'than the whole feed; implies --reader fast and skips the feed '
+             'cache')
+    argp.add_argument(
+        '--simplify',
+        metavar='METRES',
+        type=float,
+        default=0,
+        help='simplify route shapes so that they stay within METRES of the '
+             'original points (default: 0, no simplification)')
+    argp.add_argument(
+        '--timetables',
+        choices=['html', 'json'],
+        default='html',
+        help='write timetables as HTML tables, or as compact JSON that the '
+             'page renders as it is scrolled, for routes with many trips '
+             '(default: html)')
+
+
+def compress_formats(value):
+    formats = tuple(value.split(','))
+    for format in formats:
+        if format not in SUFFIXES:
+            raise argparse.ArgumentTypeError('unknown format: %s' % format)
+    if 'brotli' in formats and brotli is None:
+        raise argparse.ArgumentTypeError(
+            "brotli is not installed (pip install 'busbook[brotli]')")
+    return formats
+
+
+def date_range(value):
+    try:
+        return batch.parse_date_range(value)
+    except ValueError as err:
+        raise argparse.ArgumentTypeError(str(err))
+
+
+def build(args, profiler=NULL_PROFILER):
+    with profiler.phase('load'):
+        index = load(args)
     print 'Loading complete.'
+    try:
+        return render_book(index, args, profiler)
+    finally:
+        index.stop_times.close()
 
-    if args.date is None:
+
+def render_book(index, args, profiler=NULL_PROFILER, env=None):
+    partial = len(args.route) > 0 or len(args.agency) > 0
+    options = dict(outdir=Path(args.output), jobs=args.jobs,
+                   incremental=args.incremental,
+                   cache_dir=None if args.no_cache else Path(args.cache_dir),
+                   simplify=args.simplify, precompress=args.precompress,
+                   timetables=args.timetables, env=env, partial=partial,
+                   profiler=profiler)
+    if args.date_range is not None:
+        start, end = args.date_range
+        return render_range(index, start, end, **options)
+    elif args.date is None:
         date = datetime.today()
     else:
         date = datetime.strptime(args.date, '%Y-%m-%d')
-    render(gtfs, date=date, outdir=Path(args.output))
+    return render(index, date=date, **options)
+
+
+def load(args):
+    selected = len(args.route) > 0 or len(args.agency) > 0
+    if args.max_memory is not None or (selected and args.reader == 'fast'):
+        # Read only what the selected routes need.
+        index = feed.load(ZipFile(args.file),
+                          max_memory=(None if args.max_memory is None
+                                      else args.max_memory*1024*1024),
+                          route_globs=args.route, agency_globs=args.agency)
+    else:
+        if args.no_cache:
+            index = load_index(args.file, args.reader)
+        else:
+            index = load_cached(args.file, Path(args.cache_dir),
+                                max_bytes=args.cache_size*1024*1024,
+                                reader=args.reader)
+        if selected:
+            index = index.materialize(index.select(args.route, args.agency))
+    if selected:
+        print 'Selected %d routes.' % len(index.routes)
+    return index
 
 
 def load_gtfs(fd):
     l = Loader(zip=ZipFile(fd))
     return l.Load()
 
+
+def load_index(fd, reader='transitfeed'):
+    if reader == 'fast':
+        return feed.load(ZipFile(fd))
+    else:
+        return FeedIndex.from_schedule(load_gtfs(fd))
+
+
+def load_cached(fd, cache_dir, max_bytes, reader='transitfeed'):
+    """Return the FeedIndex of the GTFS file fd from the cache, loading and
+    caching it first if needed.
+    """
+    digest = '%s-%s' % (feed_digest(fd), reader)
+    index = read_snapshot(cache_dir, digest)
+    if index is None:
+        index = load_index(fd, reader)
+        if reader == 'transitfeed':
+            index = index.materialize()
+        write_snapshot(cache_dir, digest, index)
+        evict(cache_dir, max_bytes)
+    else:
+        print 'Loaded cached feed %s.' % digest
+    return index
+
@@ -0,0 +1,136 @@
+"""Compressed copies of output files, for web servers that can serve a
+pre-compressed sibling of a file (such as nginx's gzip_static).
+
+Files are compressed by a pool of threads, which overlaps with rendering
+because zlib and brotli release the GIL while they compress.
+"""
+import errno
+import gzip
+import io
+import os
+from multiprocessing.pool import ThreadPool
+
+from pathlib2 import Path
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+SUFFIXES = {'gzip': '.gz', 'brotli': '.br'}
+TEXT_SUFFIXES = {'.css', '.html', '.js', '.json', '.svg'}
+
+
+def is_compressed(name):
+    return os.path.splitext(name)[1] in SUFFIXES.values()
+
+
+def gzip_bytes(contents):
+    buf = io.BytesIO()
+    # A fixed mtime keeps the output the same for the same input.
+    with gzip.GzipFile(filename='', mode='wb', fileobj=buf, mtime=0) as fd:
+        fd.write(contents)
+    return buf.getvalue()
+
+
+def gunzip_bytes(contents):
+    with gzip.GzipFile(mode='rb', fileobj=io.BytesIO(contents)) as fd:
+        return fd.read()
+
+
+def brotli_bytes(contents):
+    return brotli.compress(contents, mode=brotli.MODE_TEXT)
+
+
+def unbrotli_bytes(contents):
+    return brotli.decompress(contents)
+
+
+COMPRESSORS = {'gzip': gzip_bytes, 'brotli': brotli_bytes}
+DECOMPRESSORS = {'gzip': gunzip_bytes, 'brotli': unbrotli_bytes}
+
+
+def holds(sibling, format, contents):
+    """Return whether sibling, compressed in format, holds contents."""
+    with open(sibling, 'rb') as fd:
+        compressed = fd.read()
+    try:
+        return DECOMPRESSORS[format](compressed) == contents
+    except Exception:
+        return False
+
+
+def compress_file(path, formats):
+    """Write a compressed sibling of path in each format, unless it is newer
+    than path, or as new and holds the same contents, since path may have
+    been rewritten within the same tick of a coarse clock. Return the number
+    of siblings written.
+    """
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError as err:
+        if err.errno == errno.ENOENT:
+            return 0
+        raise
+    contents = None
+    count = 0
+    for format in formats:
+        sibling = path + SUFFIXES[format]
+        try:
+            sibling_mtime = os.stat(sibling).st_mtime
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            sibling_mtime = None
+        if sibling_mtime is not None and sibling_mtime > mtime:
+            continue
+        if contents is None:
+            with open(path, 'rb') as fd:
+                contents = fd.read()
+        if sibling_mtime == mtime and holds(sibling, format, contents):
+            continue
+        tmp_path = '%s.tmp' % sibling
+        with open(tmp_path, 'wb') as fd:
+            fd.write(COMPRESSORS[format](contents))
+        os.rename(tmp_path, sibling)
+        count += 1
+    return count
+
+
+class Compressor(object):
+    """Compresses output files in the background in each of formats, which
+    are keys of SUFFIXES. Files are skipped if their compressed siblings are
+    newer than they are, since unchanged files keep their modification times.
+    With no formats, nothing is compressed.
+    """
+
+    def __init__(self, formats=(), threads=None):
+        if 'brotli' in formats and brotli is None:
+            raise ValueError('brotli is not installed')
+        self.formats = formats
+        self.pool = ThreadPool(threads) if formats else None
+        self.results = []
+
+    def add(self, path):
+        """Compress path, if it is a text file."""
+        if self.formats and path.suffix in TEXT_SUFFIXES:
+            self.results.append(
+                self.pool.apply_async(compress_file,
+                                      (str(path), self.formats)))
+
+    def add_tree(self, path):
+        for root, dirs, files in os.walk(str(path)):
+            for name in files:
+                if not is_compressed(name):
+                    self.add(Path(root)/name)
+
+    def close(self):
+        """Wait for all files to be compressed, and return the numbers of
+        files compressed and skipped.
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+        written = sum(result.get() for result in self.results)
+        return written, len(self.results)*len(self.formats) - written
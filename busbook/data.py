@@ -0,0 +1,201 @@
+"""Data files shared by pages: the shards of a table of every stop, a file
+for each distinct shape, and the shards of the index page's stop search
+index with a script listing them. Files are named by a digest of their
+contents, so that browsers can cache them across pages and builds.
+
+The stops table is sorted by stop_id and split after the stops whose
+stop_ids hash to a multiple of STOPS_SHARD_SIZE, so that a change to a stop
+changes only the shard that holds it, and only the pages of the routes that
+use that shard.
+
+The files are scripts rather than JSON, so that pages still work when they
+are opened from the file system.
+"""
+import errno
+import hashlib
+import json
+import os
+import zlib
+
+from pathlib2 import Path
+
+from busbook.compress import is_compressed
+from busbook.geometry import encode, simplify
+from busbook.search import search_shards
+
+
+DATA_DIR = Path('static')/'data'
+STOPS_SHARD_SIZE = 128
+
+
+class DataFiles(object):
+    """The names of the data files of a build: the stops table's shard
+    holding each stop by stop_id, the file of each shape by shape_id, and
+    the script listing the stop search index's shards, if one was written.
+    shape_stats maps shape_ids to the number of points and bytes of each
+    shape before and after it was simplified and encoded.
+    """
+
+    def __init__(self, stop_files, shape_files, shape_stats=None,
+                 search_file=None):
+        self.stop_files = stop_files
+        self.shape_files = shape_files
+        self.shape_stats = shape_stats or {}
+        self.search_file = search_file
+
+    def for_route(self, index, route):
+        """Return the data files of only route's stops and shapes."""
+        shape_ids = route_shape_ids(index, route)
+        return DataFiles({stop_id: self.stop_files[stop_id]
+                          for stop_id in route_stop_ids(index, route)
+                          if stop_id in self.stop_files},
+                         {shape_id: self.shape_files[shape_id]
+                          for shape_id in shape_ids
+                          if shape_id in self.shape_files},
+                         {shape_id: self.shape_stats[shape_id]
+                          for shape_id in shape_ids
+                          if shape_id in self.shape_stats})
+
+    def stop_shard_files(self, stop_ids):
+        """Return the names of the stops table's shards that hold stop_ids."""
+        return sorted(set(self.stop_files[stop_id] for stop_id in stop_ids
+                          if stop_id in self.stop_files))
+
+    def route_files(self, index, route):
+        """Return the names of the files the page for route links to."""
+        return self.stop_shard_files(route_stop_ids(index, route)) + sorted(
+            self.shape_files[shape_id]
+            for shape_id in route_shape_ids(index, route)
+            if shape_id in self.shape_files)
+
+    def reduction(self):
+        """Return the total points and bytes of the shapes before and after
+        they were simplified and encoded.
+        """
+        return tuple(sum(stats[n] for stats in self.shape_stats.itervalues())
+                     for n in range(4))
+
+
+def route_stop_ids(index, route):
+    return set(stop_id
+               for trip in index.trips_by_route.get(route.route_id, [])
+               for stop_id in index.stop_times.stop_sequence(trip))
+
+
+def route_shape_ids(index, route):
+    return sorted(set(trip.shape_id
+                      for trip in index.trips_by_route.get(route.route_id, [])
+                      if trip.shape_id))
+
+
+def content_name(prefix, contents):
+    return '%s-%s.js' % (prefix, hashlib.sha1(contents).hexdigest()[:16])
+
+
+def dumps(obj):
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'))
+
+
+def stop_shards(index, shard_size=STOPS_SHARD_SIZE):
+    """Return the stop_ids of index, sorted, as a list of shards that end at
+    the stop_ids that hash to a multiple of shard_size.
+    """
+    shards = [[]]
+    for stop_id in sorted(index.stops):
+        shards[-1].append(stop_id)
+        key = (stop_id.encode('utf-8') if isinstance(stop_id, unicode)
+               else stop_id)
+        if zlib.crc32(key) % shard_size == 0:
+            shards.append([])
+    return [shard for shard in shards if len(shard) > 0]
+
+
+def stops_script(index, stop_ids):
+    """Return the script that adds the stops of stop_ids to the stops table.
+    route.js looks the route's stops up in it.
+    """
+    table = {stop_id: [index.stops[stop_id].stop_lat,
+                       index.stops[stop_id].stop_lon,
+                       index.stops[stop_id].stop_name]
+             for stop_id in stop_ids}
+    return 'Object.assign(StopTable, %s);\n' % dumps(table)
+
+
+def shape_script(points):
+    """Return the script for a shape's points, which are (lat, lon) pairs.
+    route.js decodes the polyline.
+    """
+    return 'Shapes.push(%s);\n' % dumps(encode(points))
+
+
+def shard_script(entries):
+    # Shards hold no dicts, so they need no sorted keys, without which json
+    # can use its much faster C encoder.
+    return 'StopSearch.addShard(%s);\n' % json.dumps(entries,
+                                                     separators=(',', ':'))
+
+
+def search_script(shards, shard_files):
+    """Return the script that lists the first key and the file of each of
+    the search index's shards.
+    """
+    return 'StopSearch.setIndex(%s, %s);\n' % (
+        dumps([shard[0][0] for shard in shards]), dumps(shard_files))
+
+
+def write_data(index, outdir, tolerance=0, remove_stale=True,
+               stop_routes=None):
+    """Write the shards of the stops table and the shapes of index to
+    outdir, the shapes simplified to within tolerance metres, and the stop
+    search index of stop_routes (see search_shards), if given. Remove the
+    data files of earlier builds unless remove_stale is false, and return
+    their DataFiles.
+    """
+    data_dir = outdir/DATA_DIR
+    try:
+        data_dir.mkdir(parents=True)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+
+    def write(prefix, contents):
+        name = content_name(prefix, contents)
+        # A file with the same name already holds the same contents.
+        if name not in names and not (data_dir/name).exists():
+            tmp_path = data_dir/('.%s.tmp' % name)
+            tmp_path.write_bytes(contents)
+            os.rename(str(tmp_path), str(data_dir/name))
+        names.add(name)
+        return name
+
+    names = set()
+    stop_files = {}
+    for shard in stop_shards(index):
+        stops_file = write('stops', stops_script(index, shard))
+        stop_files.update(dict.fromkeys(shard, stops_file))
+    shape_files = {}
+    shape_stats = {}
+    for shape_id, shape in index.shapes.iteritems():
+        points = [(lat, lon) for lat, lon, dist in shape.points]
+        simplified = simplify(points, tolerance)
+        contents = shape_script(simplified)
+        shape_files[shape_id] = write('shape', contents)
+        shape_stats[shape_id] = (
+            len(points), len('Shapes.push(%s);\n' % dumps(points)),
+            len(simplified), len(contents))
+    if stop_routes is None:
+        search_file = None
+    else:
+        shards = search_shards(index, stop_routes)
+        shard_files = [write('search', shard_script(shard))
+                       for shard in shards]
+        search_file = write('search', search_script(shards, shard_files))
+
+    if remove_stale:
+        for path in data_dir.iterdir():
+            # Keep the compressed siblings of current files.
+            name = path.stem if is_compressed(path.name) else path.name
+            if name not in names:
+                path.unlink()
+    return DataFiles(stop_files, shape_files, shape_stats,
+                     search_file=search_file)
@@ -0,0 +1,415 @@
+# -*- coding: utf-8 -*-
+"""A lightweight GTFS reader that streams the tables busbook needs straight
+from the feed's zip file, as an alternative to loading it with transitfeed.
+
+Stop times, which dominate the size of most feeds, are kept in typed arrays
+rather than as one object per row.
+"""
+import csv
+import tempfile
+from array import array
+from shutil import rmtree
+
+from pathlib2 import Path
+
+from busbook.render import (FeedIndex, Record, StopTime, TripStopTimes,
+                            select_routes)
+
+
+TRIP_FIELDS = ['route_id', 'service_id', 'trip_id', 'trip_headsign',
+               'direction_id', 'shape_id']
+DAYS_OF_WEEK = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday',
+                'saturday', 'sunday']
+NONE = -1
+
+
+class Trip(object):
+    """A trip, with slots for only the fields that busbook reads."""
+
+    __slots__ = TRIP_FIELDS
+
+    def __init__(self, row):
+        for field in TRIP_FIELDS:
+            setattr(self, field, row.get(field))
+
+    def iteritems(self):
+        return ((field, getattr(self, field)) for field in TRIP_FIELDS)
+
+    def __getstate__(self):
+        return [getattr(self, field) for field in TRIP_FIELDS]
+
+    def __setstate__(self, state):
+        for field, value in zip(TRIP_FIELDS, state):
+            setattr(self, field, value)
+
+
+class Shape(object):
+    """The points of a shape, stored as arrays of coordinates."""
+
+    def __init__(self, shape_id):
+        self.shape_id = shape_id
+        self.lats = array('d')
+        self.lons = array('d')
+        self.dists = []
+
+    @property
+    def points(self):
+        return zip(self.lats, self.lons, self.dists)
+
+
+class ArrayStopTimes(TripStopTimes):
+    """Stop times of every trip in parallel arrays, grouped by trip and in
+    stop_sequence order. trip_ranges maps each trip_id to the slice of the
+    arrays that holds its stop times.
+    """
+
+    def __init__(self, stop_ids, trip_ranges, stops, arrivals, departures,
+                 flags, max_trips=10000):
+        super(ArrayStopTimes, self).__init__(max_trips=max_trips)
+        self.stop_ids = stop_ids
+        self.trip_ranges = trip_ranges
+        self.stops = stops
+        self.arrivals = arrivals
+        self.departures = departures
+        self.flags = flags
+
+    def _fetch(self, trip):
+        def value(n):
+            return None if n == NONE else n
+        start, end = self.trip_ranges.get(trip.trip_id, (0, 0))
+        return [StopTime(self.stop_ids[self.stops[i]],
+                         value(self.arrivals[i]), value(self.departures[i]),
+                         value(self.flags[i]))
+                for i in xrange(start, end)]
+
+    def stop_sequence(self, trip):
+        start, end = self.trip_ranges.get(trip.trip_id, (0, 0))
+        return [self.stop_ids[n] for n in self.stops[start:end]]
+
+
+def load(zipf, max_memory=None, route_globs=(), agency_globs=()):
+    """Read a FeedIndex from the GTFS feed in the ZipFile zipf.
+
+    If max_memory is given, stop times are partitioned by route into a
+    temporary directory instead of being held in memory, buffering about
+    max_memory bytes of them at a time. Close the index's stop_times to remove
+    the directory.
+
+    If route_globs or agency_globs are given, only the routes that match them
+    (see select_routes) are read, along with only the trips, stop times and
+    shapes of those routes. Every stop is read, so that the shards of the
+    stops table are those of the whole feed.
+    """
+    agencies = [Record(**row) for row in read_table(zipf, 'agency.txt')]
+    default_agency = agencies[0] if len(agencies) == 1 else None
+    # List routes and trips in the order transitfeed does, that of dicts
+    # keyed by their ids, so that both readers render the same pages.
+    routes = dict((row['route_id'], Record(**row))
+                  for row in read_table(zipf, 'routes.txt')).values()
+    selected = bool(route_globs or agency_globs)
+    if selected:
+        routes = select_routes(routes, agencies, default_agency,
+                               route_globs, agency_globs)
+    route_ids = set(route.route_id for route in routes)
+    # Keep the ids of every trip, so that the selected ones stay in the
+    # same order.
+    trips = [trip for trip in dict(
+                 (row['trip_id'],
+                  Trip(row)
+                  if not selected or row['route_id'] in route_ids else None)
+                 for row in read_table(zipf, 'trips.txt')).values()
+             if trip is not None]
+    services = read_services(zipf)
+    shapes = read_shapes(zipf, set(trip.shape_id for trip in trips)
+                         if selected else None)
+    if max_memory is None:
+        stop_times = read_stop_times(zipf,
+                                     set(trip.trip_id for trip in trips))
+    else:
+        directory = Path(tempfile.mkdtemp(prefix='busbook-'))
+        try:
+            stop_times = partition_stop_times(zipf, trips, directory,
+                                              max_memory)
+        except:
+            rmtree(str(directory), ignore_errors=True)
+            raise
+    stops = [read_stop(row) for row in read_table(zipf, 'stops.txt')]
+    return FeedIndex(agencies, routes, trips, stops, shapes, services,
+                     default_agency=default_agency, stop_times=stop_times)
+
+
+def read_table(zipf, name, optional=False):
+    """Yield the rows of a table as dicts of unicode values. Equal values
+    share a single string.
+    """
+    if optional and name not in zipf.namelist():
+        return
+    values = {}
+    with zipf.open(name) as fd:
+        reader = csv.reader(fd)
+        header = [column.decode('utf-8-sig').strip()
+                  for column in next(reader)]
+        for row in reader:
+            if len(row) == 0:
+                continue
+            res = {}
+            for column, value in zip(header, row):
+                try:
+                    res[column] = values[value]
+                except KeyError:
+                    res[column] = values[value] = value.decode('utf-8',
+                                                               'replace')
+            yield res
+
+
+def read_stop(row):
+    for field in ('stop_lat', 'stop_lon'):
+        if row.get(field):
+            row[field] = float(row[field])
+    try:
+        row['location_type'] = int(row.get('location_type') or 0)
+    except ValueError:
+        del row['location_type']
+    return Record(**row)
+
+
+def read_services(zipf):
+    services = {}
+    for row in read_table(zipf, 'calendar.txt', optional=True):
+        services[row['service_id']] = Record(
+            service_id=row['service_id'],
+            day_of_week=[row[day] == u'1' for day in DAYS_OF_WEEK],
+            start_date=row['start_date'],
+            end_date=row['end_date'],
+            date_exceptions={})
+    for row in read_table(zipf, 'calendar_dates.txt', optional=True):
+        service = services.get(row['service_id'])
+        if service is None:
+            service = services[row['service_id']] = Record(
+                service_id=row['service_id'],
+                day_of_week=[False]*7,
+                start_date=None,
+                end_date=None,
+                date_exceptions={})
+        if row['exception_type'] in (u'1', u'2'):
+            service.date_exceptions[row['date']] = (int(row['exception_type']),
+                                                    None)
+    return services.values()
+
+
+def read_shapes(zipf, shape_ids=None):
+    """Read the shapes in shape_ids (default: all)."""
+    shapes = {}
+    rows = []
+    for row in read_table(zipf, 'shapes.txt', optional=True):
+        if shape_ids is not None and row['shape_id'] not in shape_ids:
+            continue
+        rows.append((row['shape_id'], int(row['shape_pt_sequence']),
+                     float(row['shape_pt_lat']), float(row['shape_pt_lon']),
+                     float(row['shape_dist_traveled'])
+                     if row.get('shape_dist_traveled') else None))
+    rows.sort(key=lambda row: row[:2])
+    for shape_id, sequence, lat, lon, dist in rows:
+        try:
+            shape = shapes[shape_id]
+        except KeyError:
+            shape = shapes[shape_id] = Shape(shape_id)
+        shape.lats.append(lat)
+        shape.lons.append(lon)
+        shape.dists.append(dist)
+    return shapes.values()
+
+
+def read_stop_time_rows(zipf, trip_ids):
+    """Yield the rows of stop_times.txt as (trip_id, stop_sequence, stop_id,
+    arrival, departure, timepoint) tuples, with times in seconds and NONE for
+    missing values, skipping rows of unknown trips.
+    """
+    with zipf.open('stop_times.txt') as fd:
+        reader = csv.reader(fd)
+        header = [column.decode('utf-8-sig').strip()
+                  for column in next(reader)]
+        columns = [header.index(name) if name in header else None
+                   for name in ('trip_id', 'stop_sequence', 'stop_id',
+                                'arrival_time', 'departure_time', 'timepoint')]
+
+        # Skip the rows of other trips before parsing the rest of the row.
+        trip_column = columns[0]
+        encoded_trip_ids = set(trip_id.encode('utf-8') for trip_id in trip_ids)
+        times = {'': NONE}
+        for row in reader:
+            if len(row) == 0 or row[trip_column].strip() not in encoded_trip_ids:
+                continue
+            (trip_id, sequence, stop_id, arrival, departure, timepoint) = [
+                row[i].strip() if i is not None and i < len(row) else ''
+                for i in columns]
+            trip_id = trip_id.decode('utf-8', 'replace')
+            secs = []
+            for time in (arrival, departure):
+                try:
+                    secs.append(times[time])
+                except KeyError:
+                    hours, minutes, seconds = time.split(':')
+                    secs.append(int(hours)*3600 + int(minutes)*60
+                                + int(seconds))
+                    # Most times fall on the minute; memoize only those so
+                    # that the table stays small.
+                    if seconds == '00':
+                        times[time] = secs[-1]
+            yield (trip_id, int(sequence), stop_id.decode('utf-8', 'replace'),
+                   secs[0], secs[1], int(timepoint) if timepoint else NONE)
+
+
+def read_stop_times(zipf, trip_ids):
+    """Read stop_times.txt into an ArrayStopTimes, skipping rows of unknown
+    trips.
+    """
+    trip_codes = {}
+    stop_codes = {}
+    trips, sequences, stops = array('i'), array('i'), array('i')
+    arrivals, departures, timepoints = array('i'), array('i'), array('b')
+    ordered = True
+    prev_trip, prev_sequence = None, None
+    for (trip_id, sequence, stop_id, arrival, departure,
+         timepoint) in read_stop_time_rows(zipf, trip_ids):
+        trip = trip_codes.setdefault(trip_id, len(trip_codes))
+        if ordered and trip == prev_trip:
+            ordered = sequence > prev_sequence
+        elif ordered:
+            ordered = prev_trip is None or trip > prev_trip
+        prev_trip, prev_sequence = trip, sequence
+
+        trips.append(trip)
+        sequences.append(sequence)
+        stops.append(stop_codes.setdefault(stop_id, len(stop_codes)))
+        arrivals.append(arrival)
+        departures.append(departure)
+        timepoints.append(timepoint)
+
+    stop_ids = [None]*len(stop_codes)
+    for stop_id, code in stop_codes.iteritems():
+        stop_ids[code] = stop_id
+    trip_names = {code: trip_id for trip_id, code in trip_codes.iteritems()}
+    return array_stop_times(trip_names, stop_ids, trips, sequences, stops,
+                            arrivals, departures, timepoints, ordered=ordered)
+
+
+def array_stop_times(trip_names, stop_ids, trips, sequences, stops, arrivals,
+                     departures, timepoints, ordered=True, max_trips=10000):
+    """Return an ArrayStopTimes of the columns of stop times, in which trips
+    and stops are codes that trip_names and stop_ids map back to ids. Unless
+    ordered, the rows are sorted by trip and stop_sequence first.
+    """
+    if not ordered:
+        order = sorted(xrange(len(trips)),
+                       key=lambda i: (trips[i], sequences[i]))
+        trips, stops, arrivals, departures, timepoints = [
+            array(column.typecode, (column[i] for i in order))
+            for column in (trips, stops, arrivals, departures, timepoints)]
+
+    trip_ranges = {}
+    start = 0
+    for i in xrange(1, len(trips) + 1):
+        if i == len(trips) or trips[i] != trips[start]:
+            trip_ranges[trip_names[trips[start]]] = (start, i)
+            start = i
+    return ArrayStopTimes(stop_ids, trip_ranges, stops, arrivals, departures,
+                          timepoints, max_trips=max_trips)
+
+
+ROW_FIELDS = 6
+ROW_BYTES = ROW_FIELDS*array('i').itemsize
+
+
+def partition_stop_times(zipf, trips, directory, max_memory):
+    """Partition the stop times of trips by route into files in directory, in
+    a single pass over stop_times.txt, and return a PartitionedStopTimes of
+    them. About max_memory bytes of rows are buffered; each time the buffer
+    fills, every route's rows are sorted and appended to its file as a run.
+    """
+    trip_codes = {trip.trip_id: code for code, trip in enumerate(trips)}
+    trip_routes = [trip.route_id for trip in trips]
+    stop_codes = {}
+    partitions = {}
+    buffers = {}
+
+    def spill():
+        for route_id, rows in buffers.iteritems():
+            order = sorted(xrange(0, len(rows), ROW_FIELDS),
+                           key=lambda i: (rows[i], rows[i + 1]))
+            run = array('i')
+            for i in order:
+                run.extend(rows[i:i + ROW_FIELDS])
+            name, runs = partitions.get(route_id,
+                                        ('%d.bin' % len(partitions), 0))
+            with (directory/name).open('ab') as fd:
+                fd.write(run.tostring())
+            partitions[route_id] = (name, runs + 1)
+        buffers.clear()
+
+    buffered = 0
+    for (trip_id, sequence, stop_id, arrival, departure,
+         timepoint) in read_stop_time_rows(zipf, trip_codes):
+        trip = trip_codes[trip_id]
+        route_id = trip_routes[trip]
+        try:
+            rows = buffers[route_id]
+        except KeyError:
+            rows = buffers[route_id] = array('i')
+        rows.extend((trip, sequence,
+                     stop_codes.setdefault(stop_id, len(stop_codes)),
+                     arrival, departure, timepoint))
+        buffered += ROW_BYTES
+        if buffered >= max_memory:
+            spill()
+            buffered = 0
+    spill()
+
+    stop_ids = [None]*len(stop_codes)
+    for stop_id, code in stop_codes.iteritems():
+        stop_ids[code] = stop_id
+    return PartitionedStopTimes(directory, partitions,
+                                [trip.trip_id for trip in trips], stop_ids)
+
+
+class PartitionedStopTimes(TripStopTimes):
+    """Stop times partitioned by route into files in directory, of which only
+    the partition of the route last asked for is held in memory. partitions
+    maps route_ids to the names of their files and the number of sorted runs
+    in them.
+    """
+
+    def __init__(self, directory, partitions, trip_names, stop_ids,
+                 max_trips=10000):
+        super(PartitionedStopTimes, self).__init__(max_trips=max_trips)
+        self.directory = directory
+        self.partitions = partitions
+        self.trip_names = trip_names
+        self.stop_ids = stop_ids
+        self.route_id = None
+        self._route_stop_times = None
+
+    def _fetch(self, trip):
+        if trip.route_id != self.route_id:
+            # Free the last route's partition, and the patterns of its trips,
+            # before reading the next.
+            self._route_stop_times = None
+            self._trips.clear()
+            self._route_stop_times = self._read(trip.route_id)
+            self.route_id = trip.route_id
+        return self._route_stop_times._fetch(trip)
+
+    def _read(self, route_id):
+        rows = array('i')
+        name, runs = self.partitions.get(route_id, (None, 0))
+        if name is not None:
+            with (self.directory/name).open('rb') as fd:
+                rows.fromstring(fd.read())
+        return array_stop_times(
+            self.trip_names, self.stop_ids,
+            *[rows[n::ROW_FIELDS] for n in range(ROW_FIELDS)],
+            ordered=runs <= 1, max_trips=None)
+
+    def close(self):
+        self._route_stop_times = None
+        rmtree(str(self.directory), ignore_errors=True)
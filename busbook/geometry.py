@@ -0,0 +1,133 @@
+"""Simplification and encoding of shape geometry for route maps.
+
+Shapes are simplified with the Douglas-Peucker algorithm, with a tolerance
+in metres, and encoded as polylines in Google's format. If NumPy is
+installed, the distances to each segment are computed with it, which is
+much faster for shapes with many points.
+"""
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+EARTH_RADIUS = 6371008.8
+
+
+def project(points):
+    """Return the x and y coordinates of points, which are (lat, lon) pairs,
+    in metres on an equirectangular projection centred on them.
+    """
+    scale = math.pi/180*EARTH_RADIUS
+    lat0 = math.radians(sum(lat for lat, lon in points)/len(points))
+    return ([lon*scale*math.cos(lat0) for lat, lon in points],
+            [lat*scale for lat, lon in points])
+
+
+def simplify(points, tolerance):
+    """Return the points, which are (lat, lon) pairs, that a line through
+    them needs to stay within tolerance metres of all of them.
+    """
+    if tolerance <= 0 or len(points) < 3:
+        return list(points)
+    xs, ys = project(points)
+    if numpy is not None:
+        keep = _simplify_numpy(numpy.array(xs), numpy.array(ys), tolerance)
+    else:
+        keep = _simplify_python(xs, ys, tolerance)
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def _simplify_python(xs, ys, tolerance):
+    keep = [False]*len(xs)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(xs) - 1)]
+    while stack:
+        first, last = stack.pop()
+        max_distance, max_i = 0.0, None
+        for i in xrange(first + 1, last):
+            distance = segment_distance(xs[i], ys[i], xs[first], ys[first],
+                                        xs[last], ys[last])
+            if distance > max_distance:
+                max_distance, max_i = distance, i
+        if max_distance > tolerance:
+            keep[max_i] = True
+            stack.append((first, max_i))
+            stack.append((max_i, last))
+    return keep
+
+
+def segment_distance(x, y, x1, y1, x2, y2):
+    """Return the distance of (x, y) from the segment (x1, y1)-(x2, y2)."""
+    dx, dy = x2 - x1, y2 - y1
+    length = dx*dx + dy*dy
+    if length == 0:
+        t = 0.0
+    else:
+        t = max(0.0, min(1.0, ((x - x1)*dx + (y - y1)*dy)/length))
+    return math.hypot(x - x1 - t*dx, y - y1 - t*dy)
+
+
+def _simplify_numpy(xs, ys, tolerance):
+    keep = numpy.zeros(len(xs), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(xs) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        px, py = xs[first + 1:last], ys[first + 1:last]
+        dx, dy = xs[last] - xs[first], ys[last] - ys[first]
+        length = dx*dx + dy*dy
+        if length == 0:
+            t = 0.0
+        else:
+            t = numpy.clip(((px - xs[first])*dx + (py - ys[first])*dy)/length,
+                           0.0, 1.0)
+        distances = numpy.hypot(px - xs[first] - t*dx, py - ys[first] - t*dy)
+        i = int(distances.argmax())
+        if distances[i] > tolerance:
+            keep[first + 1 + i] = True
+            stack.append((first, first + 1 + i))
+            stack.append((first + 1 + i, last))
+    return keep
+
+
+def encode(points, precision=5):
+    """Encode points, which are (lat, lon) pairs, as a polyline."""
+    factor = 10**precision
+    res = []
+    prev_lat = prev_lon = 0
+    for lat, lon in points:
+        lat, lon = int(round(lat*factor)), int(round(lon*factor))
+        for delta in (lat - prev_lat, lon - prev_lon):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                res.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            res.append(chr(value + 63))
+        prev_lat, prev_lon = lat, lon
+    return ''.join(res)
+
+
+def decode(polyline, precision=5):
+    """Decode a polyline into a list of (lat, lon) pairs."""
+    factor = float(10**precision)
+    res = []
+    coords = [0, 0]
+    i = 0
+    while i < len(polyline):
+        for n in (0, 1):
+            shift = value = 0
+            while True:
+                byte = ord(polyline[i]) - 63
+                i += 1
+                value |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            coords[n] += ~(value >> 1) if value & 1 else value >> 1
+        res.append((coords[0]/factor, coords[1]/factor))
+    return res
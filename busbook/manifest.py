@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Content hashes of the inputs to each route page, recorded in the output
+directory so that incremental builds can skip unchanged routes.
+"""
+import errno
+import hashlib
+import json
+
+from pathlib2 import Path
+
+
+MANIFEST_NAME = 'manifest.json'
+PACKAGE_DIR = Path(__file__).parent
+
+
+def read_manifest(outdir):
+    """Return the route digests from the last build into outdir, or None if
+    it was not an incremental build.
+    """
+    try:
+        with (outdir/MANIFEST_NAME).open('rt') as fd:
+            return json.load(fd)
+    except IOError as err:
+        if err.errno != errno.ENOENT:
+            raise
+        return None
+
+
+def write_manifest(outdir, digests):
+    with (outdir/MANIFEST_NAME).open('wb') as fd:
+        json.dump(digests, fd, indent=0, separators=(',', ': '),
+                  sort_keys=True)
+
+
+def renderer_version():
+    """Return a digest of the code, templates and static files of the
+    package, which shape every page.
+    """
+    digest = hashlib.sha1()
+    paths = (sorted(PACKAGE_DIR.glob('*.py'))
+             + sorted(PACKAGE_DIR.glob('templates/**/*'))
+             + sorted(PACKAGE_DIR.glob('static/**/*')))
+    for path in paths:
+        if not path.is_file():
+            continue
+        digest.update(path.relative_to(PACKAGE_DIR).as_posix())
+        with path.open('rb') as fd:
+            digest.update(fd.read())
+    return digest.hexdigest()
+
+
+def route_digest(index, route, services, version, data_files=None):
+    """Return a digest of everything the page for route is built from: its
+    trips and their stop times, stops, shapes, the effective services its
+    trips run on, the renderer version, and the names of the data files it
+    links to.
+    """
+    digest = hashlib.sha1()
+
+    def update(obj):
+        digest.update(json.dumps(obj, sort_keys=True))
+
+    trips = sorted(index.trips_by_route.get(route.route_id, []),
+                   key=lambda trip: trip.trip_id)
+    update(version)
+    update(data_files)
+    update(dict(route.iteritems()))
+    update(dict(index.agency(route).iteritems()))
+    for trip in trips:
+        update(dict(trip.iteritems()))
+        update(index.stop_times.pattern(trip))
+        update(index.stop_times.timepoints(trip))
+    for stop_id in sorted(set(stop_id for trip in trips
+                              for stop_id in index.stop_times.pattern(trip))):
+        update(dict(index.stops[stop_id].iteritems()))
+    for shape_id in sorted(set(trip.shape_id for trip in trips
+                               if trip.shape_id)):
+        update(index.shapes[shape_id].points)
+    service_ids = set(trip.service_id for trip in trips)
+    update(sorted([service.service_id, list(service.day_of_week)]
+                  for service in services
+                  if service.service_id in service_ids))
+    return digest.hexdigest()
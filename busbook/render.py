@@ -1,60 +1,280 @@
 # -*- coding: utf-8 -*-
 import errno
+import filecmp
+import heapq
+import io
+import multiprocessing
+import os
 import re
-from datetime import datetime
+import traceback
+from array import array
+from collections import defaultdict, namedtuple, OrderedDict
+from datetime import datetime, timedelta
+from fnmatch import fnmatchcase
 from itertools import tee
 from shutil import rmtree, copytree
 
-import networkx
 import jinja2
 from pathlib2 import Path
 
+from busbook.compress import SUFFIXES, Compressor
+from busbook.data import dumps, write_data
+from busbook.manifest import (read_manifest, renderer_version, route_digest,
+                              write_manifest)
+from busbook.timing import NULL_PROFILER, Profiler
+
 
 STATIC_DIR = Path(__file__).parent/'static'
 
 
+class Record(object):
+    """A plain, picklable copy of the fields of a transitfeed object. Unset
+    fields read as None, as they do in transitfeed.
+    """
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return None
+
+    def iteritems(self):
+        return self.__dict__.iteritems()
+
+
+def record(obj, fields=None):
+    """Copy the public fields of obj, or only the named ones, to a Record."""
+    if fields is None:
+        return Record(**dict(obj.iteritems()))
+    else:
+        return Record(**{field: getattr(obj, field) for field in fields})
+
+
+class FeedIndex(object):
+    """Lookup tables over the parts of a feed that busbook reads, built in a
+    single pass so that per-route work does not rescan the whole feed.
+    """
+
+    SERVICE_FIELDS = ['service_id', 'day_of_week', 'start_date', 'end_date',
+                      'date_exceptions']
+
+    def __init__(self, agencies, routes, trips, stops, shapes, services,
+                 default_agency=None, stop_times=None):
+        self.agencies = agencies
+        self.default_agency = default_agency
+        self.routes = routes
+        self.services = services
+
+        self.routes_by_agency = defaultdict(list)
+        for route in self.routes:
+            self.routes_by_agency[route.agency_id].append(route)
+        self.trips_by_route = defaultdict(list)
+        for trip in trips:
+            self.trips_by_route[trip.route_id].append(trip)
+        self.stops = {stop.stop_id: stop for stop in stops}
+        self.shapes = {shape.shape_id: shape for shape in shapes}
+        self.stop_times = TripStopTimes() if stop_times is None else stop_times
+
+    @classmethod
+    def from_schedule(cls, gtfs):
+        index = cls(gtfs.GetAgencyList(), gtfs.GetRouteList(),
+                    gtfs.GetTripList(), gtfs.GetStopList(),
+                    gtfs.GetShapeList(), gtfs.GetServicePeriodList(),
+                    default_agency=gtfs.GetDefaultAgency())
+        # Trips only hold a weak reference to the Schedule they query.
+        index._schedule = gtfs
+        return index
+
+    def materialize(self, routes=None, all_stops=True):
+        """Return a picklable copy of the index, made of Records and with
+        every trip's stop times already fetched, holding only the parts of
+        the feed that the pages for routes (default: all) need.
+
+        Every stop is kept unless all_stops is false, since the shards of the
+        stops table written from the copy should be those of the whole feed.
+        """
+        if routes is None:
+            routes = self.routes
+        trips = [trip for route in routes
+                 for trip in self.trips_by_route.get(route.route_id, [])]
+        if all_stops:
+            stop_ids = self.stops.keys()
+        else:
+            stop_ids = set(stop_id for trip in trips
+                           for stop_id in self.stop_times.pattern(trip))
+        shape_ids = set(trip.shape_id for trip in trips if trip.shape_id)
+        return FeedIndex(
+            [record(agency) for agency in self.agencies],
+            [record(route) for route in routes],
+            [record(trip) for trip in trips],
+            [record(self.stops[stop_id]) for stop_id in stop_ids],
+            [record(self.shapes[shape_id], ['shape_id', 'points'])
+             for shape_id in shape_ids],
+            [record(service, FeedIndex.SERVICE_FIELDS)
+             for service in self.services],
+            default_agency=record(self.default_agency),
+            stop_times=self.stop_times.subset(trips))
+
+    def select(self, route_globs=(), agency_globs=()):
+        """Return the routes that match the globs, as select_routes does."""
+        return select_routes(self.routes, self.agencies, self.default_agency,
+                             route_globs, agency_globs)
+
+    def agency(self, route):
+        return next((agency for agency in self.agencies
+                     if agency.agency_id == route.agency_id),
+                    self.default_agency)
+
+    def agency_routes(self, agency_id):
+        routes = list(self.routes_by_agency.get(agency_id, []))
+
+        # Handle routes without a specified agency.
+        if agency_id == self.default_agency.agency_id:
+            routes += self.routes_by_agency.get('', [])
+
+        return sorted(routes, key=lambda route: route.route_id)
+
+
+def select_routes(routes, agencies, default_agency, route_globs=(),
+                  agency_globs=()):
+    """Return the routes whose route_id or route_short_name matches one of
+    route_globs, and whose agency's agency_id or agency_name matches one of
+    agency_globs. Empty lists of globs match every route.
+    """
+    def matches(globs, *values):
+        return (not globs
+                or any(value is not None and fnmatchcase(value, glob)
+                       for glob in globs for value in values))
+    agencies_by_id = {agency.agency_id: agency for agency in agencies}
+    res = []
+    for route in routes:
+        agency = agencies_by_id.get(route.agency_id, default_agency)
+        if (matches(route_globs, route.route_id, route.route_short_name)
+                and matches(agency_globs, agency.agency_id,
+                            agency.agency_name)):
+            res.append(route)
+    return res
+
+
+StopTime = namedtuple('StopTime',
+                      ['stop_id', 'arrival_secs', 'departure_secs', 'timepoint'])
+
+
+class TripStopTimes(object):
+    """Memoized stop patterns and timepoints of trips, keyed by trip_id, so
+    that each trip's stop times are queried from the feed once per render.
+
+    If max_trips is set, only that many of the most recently fetched trips
+    are kept.
+    """
+
+    def __init__(self, max_trips=None):
+        self.hits = 0
+        self.misses = 0
+        self.max_trips = max_trips
+        self._trips = OrderedDict() if max_trips is not None else {}
+
+    def pattern(self, trip):
+        """Return the stop_ids of every stop the trip visits, in order."""
+        return self._get(trip)[0]
+
+    def timepoints(self, trip):
+        """Return (stop_id, seconds) tuples for the trip's timepoints."""
+        return self._get(trip)[1]
+
+    def stop_sequence(self, trip):
+        """Return the stop_ids of every stop the trip visits, as pattern
+        does, for a single pass over every trip. Subclasses that can do so
+        without fetching the trip's stop times do.
+        """
+        return self.pattern(trip)
+
+    def subset(self, trips):
+        """Return a cache holding only the given trips."""
+        res = TripStopTimes()
+        res._trips = {trip.trip_id: self._get(trip) for trip in trips}
+        return res
+
+    def patterns(self, trips):
+        """Group trips by their sequence of timepoint stop_ids, in order of
+        first appearance.
+        """
+        res = OrderedDict()
+        for trip in trips:
+            pattern = tuple(stop_id for stop_id, time in self.timepoints(trip))
+            res.setdefault(pattern, []).append(trip)
+        return res
+
+    def _fetch(self, trip):
+        """Return the trip's stop times from the feed as StopTimes, in
+        order.
+        """
+        # Assume GetStopTimes() returns stops in order (see trip.GetPattern).
+        return [StopTime(st.stop.stop_id, st.arrival_secs, st.departure_secs,
+                         st.timepoint)
+                for st in trip.GetStopTimes()]
+
+    def close(self):
+        """Release any files the stop times are read from."""
+        pass
+
+    def _get(self, trip):
+        try:
+            res = self._trips[trip.trip_id]
+        except KeyError:
+            self.misses += 1
+            stop_times = self._fetch(trip)
+            res = self._trips[trip.trip_id] = (
+                tuple(st.stop_id for st in stop_times),
+                tuple((st.stop_id, st.departure_secs or st.arrival_secs)
+                      for st in timepoint_stop_times(stop_times)))
+            if self.max_trips is not None and len(self._trips) > self.max_trips:
+                self._trips.popitem(last=False)
+        else:
+            self.hits += 1
+        return res
+
+
 class RouteSchedule(object):
 
     _DAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
 
-    def __init__(self, gtfs, route, services):
-        self.agency = next((agency for agency in gtfs.GetAgencyList()
-                            if agency.agency_id == route.agency_id),
-                           gtfs.GetDefaultAgency())
+    def __init__(self, index, route, services):
+        self.agency = index.agency(route)
         self.route = route
-        all_trips = [trip for trip in gtfs.GetTripList()
-                     if trip.route_id == route.route_id]
-        self.stops = set(sum((list(trip.GetPattern()) for trip in all_trips), []))
-        self.timepoints = set(sum((timepoint_stops(trip) for trip in all_trips), []))
-        self.shapes = [gtfs.GetShape(shape_id)
-                       for shape_id in set(trip.shape_id for trip in all_trips
-                                           if trip.shape_id)]
-
-        # Create a schedule for every day of the week.
-        periods = []
+        all_trips = index.trips_by_route.get(route.route_id, [])
+        self.stops = [index.stops[stop_id] for stop_id in sorted(set(
+            stop_id for trip in all_trips
+            for stop_id in index.stop_times.pattern(trip)))]
+        self.timepoints = [index.stops[stop_id] for stop_id in sorted(set(
+            stop_id for trip in all_trips
+            for stop_id, time in index.stop_times.timepoints(trip)))]
+        self.shapes = [index.shapes[shape_id] for shape_id in sorted(set(
+            trip.shape_id for trip in all_trips if trip.shape_id))]
+
+        # Group the days of the week that run the same trips, comparing trips
+        # by content so that copies of a trip under another service_id match.
+        days = OrderedDict()
         for i in range(7):
-            service_ids = [service.service_id for service in services
-                           if service.day_of_week[i] == 1
-                              or service.day_of_week == [0]*7]
+            service_ids = set(service.service_id for service in services
+                              if service.day_of_week[i] == 1
+                                 or service.day_of_week == [0]*7)
             trips = [trip for trip in all_trips if trip.service_id in service_ids]
             if len(trips) > 0:
-                periods.append(ServicePeriod('', trips))
+                signature = tuple(sorted(
+                    (trip.trip_headsign, index.stop_times.pattern(trip),
+                     index.stop_times.timepoints(trip))
+                    for trip in trips))
+                days.setdefault(signature, (trips, []))[1].append(i)
 
-        # Consolidate similar schedules.
+        # Create a schedule for each distinct set of trips.
         self.service_periods = []
-        to_examine = range(len(periods))
-        while len(to_examine) > 0:
-            this = to_examine.pop(0)
-            similar = [other for other in to_examine
-                       if periods[this] == periods[other]]
-            for other in similar:
-                to_examine.remove(other)
-
-            period = periods[this]
-            day_of_week = [int(i == this or i in similar)
-                           for i in range(len(periods))]
-            period.rename(self._week_range(day_of_week))
-            self.service_periods.append(period)
+        for trips, weekdays in days.itervalues():
+            day_of_week = [int(i in weekdays) for i in range(7)]
+            self.service_periods.append(
+                ServicePeriod(index, self._week_range(day_of_week), trips))
 
     def _week_range(self, day_of_week):
         cont_ranges = []
@@ -80,16 +300,41 @@ class RouteSchedule(object):
             return ', '.join(name(*cont_range) for cont_range in cont_ranges)
 
 
+def trip_headsign(index, trip):
+    """Return the trip's headsign, or the name of its last stop."""
+    return (trip.trip_headsign
+            or index.stops[index.stop_times.stop_sequence(trip)[-1]].stop_name)
+
+
+def stop_routes(index):
+    """Return a dict of the stop_ids of the stops on routes' pages to lists
+    of (route, headsigns) pairs: the routes that stop there, and the sorted
+    headsigns of their trips that do.
+    """
+    res = defaultdict(list)
+    for route in index.routes:
+        headsigns = defaultdict(set)
+        for trip in index.trips_by_route.get(route.route_id, []):
+            stop_ids = index.stop_times.stop_sequence(trip)
+            if len(stop_ids) == 0:
+                continue
+            headsign = trip_headsign(index, trip)
+            for stop_id in stop_ids:
+                headsigns[stop_id].add(headsign)
+        for stop_id, route_headsigns in headsigns.iteritems():
+            res[stop_id].append((route, sorted(route_headsigns)))
+    return res
+
+
 class ServicePeriod(object):
 
-    def __init__(self, name, trips):
+    def __init__(self, index, name, trips):
         self.rename(name)
         directions = []
-        for trip_list in self._separate(trips):
-            headsigns = set(trip.trip_headsign or trip.GetPattern()[-1].stop_name
-                            for trip in trip_list)
+        for trip_list in self._separate(index, trips):
+            headsigns = set(trip_headsign(index, trip) for trip in trip_list)
             direction = '/'.join(sorted(headsigns))
-            timetable = Timetable(trip_list)
+            timetable = Timetable(index, trip_list)
             directions.append((direction, timetable))
         self.directions = sorted(directions, key=lambda (d, t): d)
 
@@ -97,118 +342,307 @@ class ServicePeriod(object):
         self.name = name
         self.slug = re.sub(r'[^a-zA-Z]', '', name)
 
-    def _separate(self, trips):
+    def _separate(self, index, trips):
         """Separate trips into up to two distinct directions. Rationale: Some
         feeds misuse the direction_id flag.
         """
         if len(trips) == 0:
             return []
-        iter_trips = iter(trips)
-        first_trip = next(iter_trips)
+
+        # Cluster each distinct stop pattern once.
+        patterns = index.stop_times.patterns(trips)
+        iter_patterns = iter(patterns)
+        first_pattern = next(iter_patterns)
         directions = [
-            (timepoint_stops(first_trip), [first_trip])
+            (list(first_pattern), [first_pattern])
             ]
-        for trip in iter_trips:
-            trip_sequence = timepoint_stops(trip)
-            direction_sequences = [unite(common_sequence, trip_sequence)
-                                   for common_sequence, trips in directions]
+        for pattern in iter_patterns:
+            direction_sequences = [unite(common_sequence, pattern)
+                                   for common_sequence, members in directions]
             direction_add_lengths = [len(direction_sequences[idx])
                                      - len(common_sequence)
-                                     for idx, (common_sequence, trips)
+                                     for idx, (common_sequence, members)
                                      in enumerate(directions)]
             min_idx, min_add_length = min(enumerate(direction_add_lengths),
                                           key=lambda (i, v): v)
-            if min_add_length >= len(trip_sequence) - 1:
-                directions.append((trip_sequence, [trip]))
+            if min_add_length >= len(pattern) - 1:
+                directions.append((list(pattern), [pattern]))
             else:
-                min_sequence, min_trips = directions[min_idx]
+                min_sequence, min_members = directions[min_idx]
                 directions[min_idx] = (direction_sequences[min_idx],
-                                       min_trips + [trip])
-        return [trip_list for sequence, trip_list in directions]
+                                       min_members + [pattern])
+
+        # Map the trips back, keeping their order.
+        trip_direction = {trip: idx
+                          for idx, (sequence, members) in enumerate(directions)
+                          for pattern in members
+                          for trip in patterns[pattern]}
+        trip_lists = [[] for direction in directions]
+        for trip in trips:
+            trip_lists[trip_direction[trip]].append(trip)
+        return trip_lists
 
     def __eq__(self, other):
         return self.directions == other.directions
 
 
 class Timetable(object):
+    """The times of trips at a header of timepoints, stored row by row in
+    a single array of seconds, with negative codes for cells without one.
+    """
 
-    NO_SERVICE = object()
-    SKIP = object()
+    NO_SERVICE = -1
+    SKIP = -2
 
-    def __init__(self, trips):
-        stop_times = {trip: [st for st in timepoint_stop_times(trip)]
-                      for trip in trips}
-        timepoints = {trip: [st.stop for st in trip_stop_times]
-                      for trip, trip_stop_times in stop_times.iteritems()}
+    def __init__(self, index, trips):
+        patterns = index.stop_times.patterns(trips)
 
         # Find common timepoints for the header.
-        self.timepoints = unite(*timepoints.values())
-
-        # Populate rows.
-        self.rows = []
-        for trip in self._sort(trips):
-            row = []
-            timepoint = -1
-            for stop_time in stop_times[trip]:
-                slice_timepoint = (self.timepoints[timepoint + 1:]
-                    .index(stop_time.stop))
-                if timepoint == -1:
-                    row = [Timetable.NO_SERVICE]*slice_timepoint
-                else:
-                    row += [Timetable.SKIP]*slice_timepoint
-                row += [self._time(stop_time)]
-                timepoint += slice_timepoint + 1
-            row += [Timetable.NO_SERVICE]*(len(self.timepoints) - timepoint - 1)
-            self.rows.append(row)
-
-    def _sort(self, trips):
-        # Create a directed graph where each node is a trip.
-        graph = networkx.DiGraph()
-        node_trip = {n: trip for n, trip in enumerate(trips)}
-        trip_node = {trip: n for n, trip in enumerate(trips)}
-        for node in node_trip.keys():
-            graph.add_node(node)
-
-        # Add edges to represent relative orderings at common timepoints.
-        stop_times = {trip: [st for st in timepoint_stop_times(trip)]
-                      for trip in trips}
-        timepoints = {trip: [st.stop for st in trip_stop_times]
-                      for trip, trip_stop_times in stop_times.iteritems()}
-        for this_trip in trips:
-            this_node = trip_node[this_trip]
-            other_trips = list(trips)
-            for stop_time in stop_times[this_trip]:
-                for other_trip in (trip for trip in list(other_trips)
-                                   if stop_time.stop in timepoints[trip]):
-                    other_stop_time = next(st for st in stop_times[other_trip]
-                                           if st.stop == stop_time.stop)
-                    other_node = trip_node[other_trip]
-                    if (self._time(stop_time) < self._time(other_stop_time)
-                            and not networkx.has_path(graph, other_node, this_node)
-                            and not graph.has_edge(this_node, other_node)):
-                        graph.add_edge(this_node, other_node)
-                    other_trips.remove(other_trip)
-                if len(other_trips) == 0:
-                    break
+        header = unite(*patterns)
+        self.timepoints = [index.stops[stop_id] for stop_id in header]
 
-        # Sort the graph, recreate the list.
-        topo_sort = networkx.topological_sort(graph)
-        return [node_trip[node] for node in topo_sort]
+        # Place each trip's times in the header's columns, which are the
+        # same for every trip with a pattern.
+        cells = {}
+        spans = {}
+        for pattern, pattern_trips in patterns.iteritems():
+            columns = []
+            column = -1
+            for stop_id in pattern:
+                column = header.index(stop_id, column + 1)
+                columns.append(column)
+            for trip in pattern_trips:
+                cells[trip] = dict(zip(columns,
+                                       (time for stop_id, time
+                                        in index.stop_times.timepoints(trip))))
+                spans[trip] = (columns[0], columns[-1]) if columns else None
 
-    def _time(self, stop_time):
-        return stop_time.departure_secs or stop_time.arrival_secs
+        # Populate rows: SKIP between a trip's first and last timepoints,
+        # NO_SERVICE outside them.
+        self.height = len(trips)
+        self.width = width = len(self.timepoints)
+        self.grid = array('i', [Timetable.NO_SERVICE])*(self.height*width)
+        skips = array('i', [Timetable.SKIP])*width
+        for n, trip in enumerate(self._sort(trips, cells)):
+            if spans[trip] is None:
+                continue
+            first, last = spans[trip]
+            offset = n*width
+            self.grid[offset + first:offset + last + 1] = \
+                skips[:last - first + 1]
+            for column, time in cells[trip].iteritems():
+                self.grid[offset + column] = time
+
+    def _sort(self, trips, cells):
+        return [trips[n] for n in order_trips([cells[trip] for trip in trips])]
+
+    @property
+    def rows(self):
+        return [self.grid[n*self.width:(n + 1)*self.width].tolist()
+                for n in xrange(self.height)]
 
     def __eq__(self, other):
-        return self.timepoints == other.timepoints and self.rows == other.rows
+        # Compare the grids' bytes; comparing arrays goes item by item.
+        return (self.timepoints == other.timepoints
+                and buffer(self.grid) == buffer(other.grid))
+
+
+def render(index, date=datetime.today(), outdir=Path('.'), jobs=1,
+           incremental=False, cache_dir=None, simplify=0, services=None,
+           precompress=(), env=None, partial=False, timetables='html',
+           profiler=NULL_PROFILER):
+    """Render the bus book for the week beginning on date into outdir, using
+    up to jobs processes for the route pages. Return the routes that failed to
+    render. If services is given, it is the effective_services of date.
+
+    An incremental build keeps the pages of routes whose inputs have not
+    changed since the last incremental build into outdir. A partial build
+    writes the pages of only the routes in index into an existing outdir,
+    leaving its index page and other pages alone. Compiled templates
+    are cached in cache_dir, if given, and env is used instead of a new
+    template environment if it is given. Shapes are simplified to within
+    simplify metres. Timetables are written as HTML tables, or, if timetables
+    is 'json', as rows of minutes that route.js renders as they are scrolled
+    into view. Each output file is also written compressed in the formats in
+    precompress, if any. The phases of the build and the rendering
+    of each route are timed with profiler.
+    """
+    compressor = Compressor(precompress)
+    with profiler.phase('prepare'):
+        manifest = read_manifest(outdir) if incremental else None
+        if manifest is None and not partial:
+            clear_out(outdir)
+        else:
+            sync_static(outdir)
+        if env is None:
+            env = make_env(cache_dir)
+        if services is None:
+            services = effective_services(index, date)
+    with profiler.phase('data'):
+        # The pages of other routes still link to the data files of the
+        # last full build.
+        data = write_data(index, outdir, tolerance=simplify,
+                          remove_stale=not partial,
+                          stop_routes=None if partial else stop_routes(index))
+    if simplify > 0:
+        points, size, simple_points, simple_size = data.reduction()
+        print('Simplified shapes from %d to %d points, %d to %d bytes.'
+              % (points, simple_points, size, simple_size))
+    if not partial:
+        with profiler.phase('index page'):
+            render_index(env, index, outdir=outdir,
+                         search_file=data.search_file)
+        compressor.add(outdir/'index.html')
+    compressor.add_tree(outdir/'static')
+
+    routes = index.routes
+    if incremental:
+        with profiler.phase('digests'):
+            version = '%s-%s' % (renderer_version(), timetables)
+            digests = {str(route_path(index, route)):
+                           route_digest(index, route, services, version,
+                                        data.route_files(index, route))
+                       for route in index.routes}
+            if manifest is not None:
+                routes = [route for route in index.routes
+                          if not is_current(index, route, manifest, digests,
+                                            outdir=outdir)]
+        print('%d of %d routes changed.' % (len(routes), len(index.routes)))
+
+    failures = []
+    if jobs == 1:
+        with profiler.phase('routes'):
+            for route in routes:
+                try:
+                    render_route(env, index, services, route, data,
+                                 outdir=outdir, timetables=timetables,
+                                 profiler=profiler)
+                except Exception:
+                    failures.append(route)
+                    report_failure(route, traceback.format_exc())
+                compressor.add(outdir/route_path(index, route))
+    else:
+        # Hand each worker only its route's slice of the feed; the stop
+        # times are fetched here, since the Schedule cannot be shared. The
+        # slices are made as the workers take them, so that only a few are
+        # held at once.
+        service_records = [record(service, FeedIndex.SERVICE_FIELDS)
+                           for service in services]
+        route_jobs = ((index.materialize([route], all_stops=False),
+                       service_records,
+                       data.for_route(index, route), outdir, timetables)
+                      for route in routes)
+        with profiler.phase('routes'):
+            pool = multiprocessing.Pool(jobs, initializer=_init_worker,
+                                        initargs=(cache_dir, profiler.enabled))
+            try:
+                for route, error, timings in pool.imap_unordered(
+                        _render_slice, route_jobs):
+                    if error is not None:
+                        failures.append(route)
+                        report_failure(route, error)
+                    if timings is not None:
+                        profiler.merge(timings)
+                    compressor.add(outdir/route_path(index, route))
+            finally:
+                pool.close()
+                pool.join()
+
+    if incremental:
+        # Remove the pages of routes that left the feed, and have failed
+        # routes retried next time. A partial build keeps the digests of the
+        # routes it did not render.
+        if partial:
+            digests, new_digests = dict(manifest or {}), digests
+            digests.update(new_digests)
+        for path in set(manifest or []) - set(digests):
+            for suffix in [''] + SUFFIXES.values():
+                try:
+                    (outdir/(path + suffix)).unlink()
+                except OSError as err:
+                    if err.errno != errno.ENOENT:
+                        raise
+        for route in failures:
+            del digests[str(route_path(index, route))]
+        write_manifest(outdir, digests)
 
+        # Compress the pages kept from the last build, in case it was not
+        # compressed.
+        rendered = set(id(route) for route in routes)
+        for route in index.routes:
+            if id(route) not in rendered:
+                compressor.add(outdir/route_path(index, route))
+    if precompress:
+        with profiler.phase('compress'):
+            written, skipped = compressor.close()
+        print('Compressed %d files, %d unchanged.' % (written, skipped))
+    print('Stop times: %d trips fetched, %d cache hits.'
+          % (index.stop_times.misses, index.stop_times.hits))
+    return failures
 
-def render(gtfs, date=datetime.today(), outdir=Path('.')):
-    clear_out(outdir)
+
+def render_range(index, start, end, outdir=Path('.'), **kwargs):
+    """Render a bus book for each date from start to end into a directory of
+    outdir named for the date. Dates whose weeks run the same services share
+    one build, which is copied to the other dates, unless the builds are
+    partial. Other arguments are passed to render. Return the routes that
+    failed to render.
+    """
+    calendar = ServiceCalendar(index.services)
+    builds = {}
+    failures = []
+    date = start
+    while date <= end:
+        services = calendar.week(date)
+        key = service_key(services)
+        dated_dir = outdir/date.strftime('%Y-%m-%d')
+        if key in builds and not kwargs.get('partial'):
+            print('Copying %s to %s.' % (builds[key].name, dated_dir.name))
+            copy_out(builds[key], dated_dir)
+        else:
+            print('Rendering %s.' % dated_dir.name)
+            failures += [route for route in render(index, date=date,
+                                                   outdir=dated_dir,
+                                                   services=services, **kwargs)
+                         if route not in failures]
+            builds[key] = dated_dir
+        date += timedelta(days=1)
+    print('Rendered %d distinct services for %d dates.'
+          % (len(builds), (end - start).days + 1))
+    return failures
+
+
+def copy_out(source, path):
+    try:
+        rmtree(str(path))
+    except OSError as err:
+        if err.errno != errno.ENOENT:
+            raise
+    copytree(str(source), str(path))
+
+
+def is_current(index, route, manifest, digests, outdir=Path('.')):
+    path = str(route_path(index, route))
+    return manifest.get(path) == digests[path] and (outdir/path).exists()
+
+
+def make_env(cache_dir=None):
+    if cache_dir is None:
+        bytecode_cache = None
+    else:
+        templates_dir = cache_dir/'templates'
+        try:
+            templates_dir.mkdir(parents=True)
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+        bytecode_cache = jinja2.FileSystemBytecodeCache(str(templates_dir))
     env = jinja2.Environment(
         loader=jinja2.PackageLoader('busbook', 'templates'),
         autoescape=jinja2.select_autoescape(['html']),
         trim_blocks=True,
-        lstrip_blocks=True)
+        lstrip_blocks=True,
+        bytecode_cache=bytecode_cache)
 
     @jinja2.evalcontextfilter
     def make_breaks(eval_ctx, s):
@@ -221,23 +655,17 @@ def render(gtfs, date=datetime.today(), outdir=Path('.')):
 
     @jinja2.evalcontextfilter
     def format_time(eval_ctx, secs):
-        hours = secs // 3600 % 24
-        minutes = secs // 60 % 60
-        if hours == 0:
-            s = '12:%02d' % minutes
-        elif hours > 12:
-            s = '%d:%02d' % (hours - 12, minutes)
-        else:
-            s = '%d:%02d' % (hours, minutes)
-        if hours < 12:
-            res = jinja2.Markup('<span class="time-am">%s</span>' % s)
-        else:
-            res = jinja2.Markup('<span class="time-pm">%s</span>' % s)
+        res = jinja2.Markup(time_html(secs))
         if eval_ctx.autoescape:
             res = jinja2.Markup(res)
         return res
     env.filters['time'] = format_time
 
+    env.filters['tbody'] = lambda timetable: jinja2.Markup(
+        timetable_body(timetable))
+    env.filters['rows_json'] = lambda timetable: dumps(
+        timetable_rows(timetable))
+
     def route_css(route):
         if route.route_color and route.route_text_color:
             return ('--route-color: #%s; --route-text-color: #%s;'
@@ -248,10 +676,34 @@ def render(gtfs, date=datetime.today(), outdir=Path('.')):
             return ''
     env.filters['route_css'] = route_css
 
-    render_index(env, gtfs, outdir=outdir)
-    for route in gtfs.GetRouteList():
-        render_route(env, gtfs, effective_services(gtfs, date), route,
-                     outdir=outdir)
+    return env
+
+
+def report_failure(route, error):
+    print('ERROR: Failed to render %s %s:\n%s'
+          % (route.route_short_name, route.route_long_name, error))
+
+
+_worker_env = None
+_worker_profile = False
+
+
+def _init_worker(cache_dir, profile):
+    global _worker_env, _worker_profile
+    _worker_env = make_env(cache_dir)
+    _worker_profile = profile
+
+
+def _render_slice(job):
+    index, services, data, outdir, timetables = job
+    route = index.routes[0]
+    profiler = Profiler() if _worker_profile else NULL_PROFILER
+    try:
+        render_route(_worker_env, index, services, route, data,
+                     outdir=outdir, timetables=timetables, profiler=profiler)
+    except Exception:
+        return route, traceback.format_exc(), None
+    return route, None, profiler.routes if _worker_profile else None
 
 
 def clear_out(path):
@@ -263,39 +715,97 @@ def clear_out(path):
     copytree(str(STATIC_DIR), str(path/'static'))
 
 
-def effective_services(gtfs, date):
-    def parse(datestr):
-        return datetime.strptime(datestr, '%Y%m%d')
-    return [sp for sp in gtfs.GetServicePeriodList()
-            if sp.start_date is None
-               or (date >= parse(sp.start_date)
-                   and date <= parse(sp.end_date).replace(hour=23, minute=59))]
+def sync_static(path):
+    """Copy only the static files that changed."""
+    for source in STATIC_DIR.iterdir():
+        with source.open('rb') as fd:
+            write_out(path/'static'/source.name, fd.read(), mode='b')
 
 
-def render_index(env, gtfs, outdir=Path('.')):
-    def get_routes(agency_id):
-        all_routes = gtfs.GetRouteList()
-        routes = [route for route in all_routes
-                  if route.agency_id == agency_id]
+class ServiceCalendar(object):
+    """The dates that services run on, including the exceptions in
+    calendar_dates, with their dates parsed once so that many dates can be
+    looked up.
+    """
 
-        # Handle routes without a specified agency.
-        default_agency = gtfs.GetDefaultAgency()
-        if agency_id == default_agency.agency_id:
-            routes += [route for route in all_routes
-                       if route.agency_id == '']
+    ADDED = 1
+    REMOVED = 2
+
+    def __init__(self, services):
+        def parse(datestr):
+            return datetime.strptime(datestr, '%Y%m%d').date()
+        self.services = []
+        for service in services:
+            exceptions = {parse(datestr): exception[0]
+                          for datestr, exception
+                          in (service.date_exceptions or {}).iteritems()}
+            self.services.append(
+                (service,
+                 parse(service.start_date) if service.start_date else None,
+                 parse(service.end_date) if service.end_date else None,
+                 exceptions))
+
+    def week(self, date):
+        """Return copies of the services that run in the seven days beginning
+        on date, with their day_of_week set to the days they run that week.
+        """
+        if isinstance(date, datetime):
+            date = date.date()
+        days = [date + timedelta(days=n) for n in range(7)]
+        services = []
+        for service, start_date, end_date, exceptions in self.services:
+            day_of_week = [False]*7
+            for day in days:
+                exception = exceptions.get(day)
+                if exception is not None:
+                    runs = exception == ServiceCalendar.ADDED
+                else:
+                    runs = (start_date is not None and end_date is not None
+                            and start_date <= day <= end_date
+                            and bool(service.day_of_week[day.weekday()]))
+                day_of_week[day.weekday()] = runs
+            if any(day_of_week):
+                week_service = record(service, FeedIndex.SERVICE_FIELDS)
+                week_service.day_of_week = day_of_week
+                services.append(week_service)
+        return services
+
+
+def effective_services(index, date):
+    """Return the services of index that run in the week beginning on date,
+    as ServiceCalendar.week does.
+    """
+    return ServiceCalendar(index.services).week(date)
+
+
+def service_key(services):
+    """Return a key that is equal for lists of effective services that run
+    the same services on the same days of the week.
+    """
+    return tuple(sorted((service.service_id, tuple(service.day_of_week))
+                        for service in services))
 
-        return sorted(routes, key=lambda route: route.route_id)
 
-    write_out(
-        outdir/'index.html',
-        env.get_template('index.html').render(
-            gtfs=gtfs,
-            agencies=', '.join(agency.agency_name
-                               for agency in gtfs.GetAgencyList()),
-            get_routes=get_routes))
+def render_index(env, index, outdir=Path('.'), search_file=None):
+    stream_out(outdir/'index.html',
+               index_page(env, index, search_file=search_file))
 
 
-def render_route(env, gtfs, service_periods, route, outdir=Path('.')):
+def index_page(env, index, link_query='', search_file=None):
+    """Return a generator of the chunks of the index page, with link_query
+    appended to the links to route pages, and a stop search box if
+    search_file, the data file listing the search index's shards, is given.
+    """
+    return env.get_template('index.html').generate(
+        index=index,
+        agencies=', '.join(agency.agency_name for agency in index.agencies),
+        get_routes=index.agency_routes,
+        link_query=link_query,
+        search_file=search_file)
+
+
+def render_route(env, index, service_periods, route, data,
+                 outdir=Path('.'), timetables='html', profiler=NULL_PROFILER):
     if len(service_periods) == 0:
         print('WARNING: No service scheduled for %s %s.'
               % (route.route_short_name, route.route_long_name))
@@ -303,35 +813,131 @@ def render_route(env, gtfs, service_periods, route, outdir=Path('.')):
     else:
         print('Processing %s %s.'
               % (route.route_short_name, route.route_long_name))
+    reduction = data.for_route(index, route).reduction()
+    if reduction[0] != reduction[2]:
+        print('  Shapes: %d to %d points, %d to %d bytes.'
+              % (reduction[0], reduction[2], reduction[1], reduction[3]))
+
+    with profiler.route(route, 'schedule'):
+        schedule = RouteSchedule(index, route, services=service_periods)
+    with profiler.route(route, 'render'):
+        stream_out(outdir/route_path(index, route),
+                   route_page(env, schedule, data, timetables=timetables))
+
+
+def route_page(env, schedule, data, timetables='html'):
+    """Return a generator of the chunks of the page for schedule, with its
+    timetables in the format timetables ('html' or 'json').
+    """
+    return env.get_template('route.html').generate(
+        schedule=schedule,
+        stop_files=data.stop_shard_files(stop.stop_id
+                                         for stop in schedule.stops),
+        shape_files=data.shape_files, timetables=timetables)
+
+
+def route_path(index, route):
+    return Path('routes')/('%s-%s.html'
+                           % (index.agency(route).agency_id, route.route_id))
+
+
+def time_html(secs):
+    hours = secs // 3600 % 24
+    minutes = secs // 60 % 60
+    if hours == 0:
+        s = '12:%02d' % minutes
+    elif hours > 12:
+        s = '%d:%02d' % (hours - 12, minutes)
+    else:
+        s = '%d:%02d' % (hours, minutes)
+    if hours < 12:
+        return '<span class="time-am">%s</span>' % s
+    else:
+        return '<span class="time-pm">%s</span>' % s
 
-    schedule = RouteSchedule(gtfs, route, services=service_periods)
-    write_out(
-        outdir/'routes'/('%s-%s.html' % (schedule.agency.agency_id, route.route_id)),
-        env.get_template('route.html').render(
-            gtfs=gtfs,
-            schedule=schedule,
-            Timetable=Timetable))
 
+ROW_START = ' '*40 + '<tr>\n'
+ROW_END = ' '*40 + '</tr>'
+CELL_INDENT = ' '*48
+TIME_CELLS = ['%s<td>%s</td>\n' % (CELL_INDENT, time_html(minute*60))
+              for minute in xrange(24*60)]
+CODE_CELLS = {
+    Timetable.NO_SERVICE: '%s<td class="timetable-no"></td>\n' % CELL_INDENT,
+    Timetable.SKIP: '%s<td class="timetable-skip"></td>\n' % CELL_INDENT,
+    }
 
-def timepoint_stops(trip):
-    return [stop_time.stop for stop_time in timepoint_stop_times(trip)]
 
+def timetable_body(timetable):
+    """Return the rows of timetable's <tbody>, formatted as route.html
+    would lay them out, without the final newline.
 
-def timepoint_stop_times(trip):
+    This writes the cells directly, rather than through the template,
+    because they make up most of a route page.
+    """
+    grid = timetable.grid
+    rows = []
+    for offset in xrange(0, timetable.height*timetable.width,
+                         timetable.width or 1):
+        rows.append(ROW_START)
+        rows.extend(TIME_CELLS[secs // 60 % 1440] if secs >= 0
+                    else CODE_CELLS[secs]
+                    for secs in grid[offset:offset + timetable.width])
+        rows.append(ROW_END)
+        rows.append('\n')
+    return ''.join(rows[:-1])
+
+
+def timetable_rows(timetable):
+    """Return the rows of timetable in the compact form route.js reads.
+
+    A row is the column of the trip's first timepoint followed by its cells
+    up to its last one: None for a skipped timepoint, and for a time, the
+    minutes since the previous time in the row, or for the first time, since
+    the first time of the previous row. Rows without service are empty.
+    """
+    grid = timetable.grid
+    rows = []
+    previous = 0
+    for offset in xrange(0, timetable.height*timetable.width,
+                         timetable.width or 1):
+        cells = grid[offset:offset + timetable.width]
+        columns = [n for n, secs in enumerate(cells)
+                   if secs != Timetable.NO_SERVICE]
+        if not columns:
+            rows.append([])
+            continue
+        row = [columns[0]]
+        last = None
+        for secs in cells[columns[0]:columns[-1] + 1]:
+            if secs < 0:
+                row.append(None)
+                continue
+            minutes = secs // 60
+            if last is None:
+                row.append(minutes - previous)
+                previous = minutes
+            else:
+                row.append(minutes - last)
+            last = minutes
+        rows.append(row)
+    return rows
+
+
+def timepoint_stop_times(stop_times):
+    def on_minute(secs):
+        return secs is not None and secs % 60 == 0
     timepoint_flag = (
         lambda stop_times: all(st.timepoint is not None for st in stop_times),
         lambda stop_time: stop_time.timepoint == 1
         )
     human_times = (
-        lambda stop_times: any(st.departure_time[-2:] != '00' for st in stop_times),
-        lambda stop_time: ((stop_time.arrival_time is not None
-                            and stop_time.arrival_time[-2:] == '00')
-                           or (stop_time.departure_time is not None
-                               and stop_time.departure_time[-2:] == '00'))
+        lambda stop_times: any(st.departure_secs is not None
+                               and not on_minute(st.departure_secs)
+                               for st in stop_times),
+        lambda stop_time: (on_minute(stop_time.arrival_secs)
+                           or on_minute(stop_time.departure_secs))
         )
     strategies = [timepoint_flag, human_times]
-    # Assume GetStopTimes() returns stops in order (see trip.GetPattern).
-    stop_times = trip.GetStopTimes()
     for precondition, classifier in strategies:
         if precondition(stop_times):
             timepoints = [st for st in stop_times if classifier(st)]
@@ -341,44 +947,370 @@ def timepoint_stop_times(trip):
 
 
 def unite(*sequences):
-    # Create a directed graph where each node is an item in a sequence.
-    graph = networkx.DiGraph()
+    """Merge sequences into one sequence that contains each of them as a
+    subsequence, reusing common items where the orderings agree.
+
+    Each item occurrence is a node in a directed acyclic graph whose edges
+    record the orderings seen in the input. The graph keeps an incremental
+    topological order (Pearce and Kelly's algorithm), so checking whether an
+    edge would create a cycle and reordering the nodes after adding it only
+    ever visit the nodes between the edge's endpoints.
+    """
+    node_item = []
+    item_nodes = {}
+    succ = []
+    pred = []
+    order = []
+
+    def add_node(item):
+        node = len(node_item)
+        node_item.append(item)
+        item_nodes.setdefault(item, []).append(node)
+        succ.append(set())
+        pred.append(set())
+        order.append(node)
+        return node
+
+    def search(start, neighbors, within):
+        visited = set([start])
+        stack = [start]
+        while len(stack) > 0:
+            for node in neighbors[stack.pop()]:
+                if node not in visited and within(order[node]):
+                    visited.add(node)
+                    stack.append(node)
+        return visited
+
+    # Start with a node for every item, in order of first appearance.
+    for sequence in sequences:
+        for item in sequence:
+            if item not in item_nodes:
+                add_node(item)
 
     # Add edges to represent relative orderings at common items.
-    all_items = reduce(lambda s1, s2: s1.union(s2),
-                       (set(sequence) for sequence in sequences))
-    node_item = {n: item for n, item in enumerate(all_items)}
-    for node in node_item.keys():
-        graph.add_node(node)
-    next_node = len(all_items)
     for sequence in sequences:
         items = iter(sequence)
         try:
             first_item = next(items)
         except StopIteration:
-            break
-        last_node = min(node for node, item in node_item.iteritems()
-                        if item == first_item)
+            continue
+        last_node = item_nodes[first_item][0]
         for this_item in items:
-            try:
-                new_node = min(node for node, item in node_item.iteritems()
-                               if item == this_item
-                                  and not networkx.has_path(graph, node, last_node))
-            except ValueError: # No node found.
-                new_node = next_node
-                node_item[next_node] = this_item
-                next_node += 1
-            if not graph.has_edge(last_node, new_node):
-                graph.add_edge(last_node, new_node)
+            # Reuse the oldest node for this item that would not create a
+            # cycle; nodes ordered after the last node never do.
+            new_node = None
+            for node in item_nodes[this_item]:
+                if node == last_node:
+                    continue
+                if order[node] > order[last_node]:
+                    new_node, forward = node, None
+                    break
+                forward = search(node, succ,
+                                 lambda o: o <= order[last_node])
+                if last_node not in forward:
+                    new_node = node
+                    break
+            if new_node is None:
+                new_node, forward = add_node(this_item), None
+
+            if new_node not in succ[last_node]:
+                succ[last_node].add(new_node)
+                pred[new_node].add(last_node)
+                if order[new_node] < order[last_node]:
+                    # Move the nodes that reach the last node in front of
+                    # the nodes reachable from the new one.
+                    lower, upper = order[new_node], order[last_node]
+                    if forward is None:
+                        forward = search(new_node, succ, lambda o: o <= upper)
+                    backward = search(last_node, pred, lambda o: o >= lower)
+                    nodes = (sorted(backward, key=lambda n: order[n])
+                             + sorted(forward, key=lambda n: order[n]))
+                    for node, o in zip(nodes,
+                                       sorted(order[n] for n in nodes)):
+                        order[node] = o
             last_node = new_node
 
-    # Sort the graph, return the sorted list.
-    topo_sort = networkx.topological_sort(graph)
-    return [node_item[node] for node in topo_sort]
+    # Read off the topological order.
+    return [node_item[node]
+            for node in sorted(range(len(node_item)), key=lambda n: order[n])]
+
+
+def order_trips(trip_cells):
+    """Return the indices of trips, each given as a dict of timetable column
+    to time, in the order they should appear in the timetable: a trip comes
+    before another if it reaches a timepoint they share earlier.
+
+    The trips serving each column are sorted by their time there, and the
+    sorted lists are merged: a trip is placed once it is the earliest trip
+    left in every column it serves, with ties broken by the time at its
+    first timepoint and then by input order. Trips with equal times at a
+    column are not ordered by that column.
+
+    When every trip left waits on another one, some trip overtakes another
+    further along the route, and only the first timepoint two trips share
+    decides their order. The earliest trip left that no other reaches first
+    at their first shared timepoint is placed. If there is none, those
+    first timepoints order the trips in cycles. Then a set of trips that
+    wait on each other but on no others is placed, giving up the same
+    waits among them as the original graph sort: it took the waits in order
+    of the trip waited on, the column and the waiting trip, and gave up
+    each that would close a cycle.
+    """
+    # The departures of each column, and of each stopping pattern at each
+    # of its columns, in order of time.
+    departures = defaultdict(list)
+    patterns = set()
+    for n, cells in enumerate(trip_cells):
+        pattern = tuple(sorted(cells))
+        patterns.add(pattern)
+        for column, time in cells.iteritems():
+            departures[column].append((time, n))
+            departures[pattern, column].append((time, n))
+    for lane_departures in departures.itervalues():
+        lane_departures.sort()
+    columns = [lane for lane in departures if not isinstance(lane, tuple)]
+    heads = dict.fromkeys(departures, 0)
+    skips = {lane: range(len(lane_departures))
+             for lane, lane_departures in departures.iteritems()}
+    placed = [len(cells) == 0 for cells in trip_cells]
+
+    def unplaced(lane, i):
+        """Return the index of the first trip left at or after index i of
+        lane's departures, skipping placed trips as pointed by skips.
+        """
+        lane_departures = departures[lane]
+        skip = skips[lane]
+        passed = []
+        while i < len(lane_departures) and placed[lane_departures[i][1]]:
+            passed.append(i)
+            i = max(skip[i], i + 1)
+        for j in passed:
+            skip[j] = i
+        return i
+
+    def earliest(lane):
+        lane_departures = departures[lane]
+        i = heads[lane] = unplaced(lane, heads[lane])
+        return lane_departures[i] if i < len(lane_departures) else None
+
+    def tied(lane):
+        """Return the trips left that are tied for the earliest in lane."""
+        head = earliest(lane)
+        if head is None:
+            return []
+        lane_departures = departures[lane]
+        res = []
+        i = heads[lane]
+        while i < len(lane_departures) and lane_departures[i][0] == head[0]:
+            res.append(lane_departures[i][1])
+            i = unplaced(lane, i + 1)
+        return res
+
+    def waits(n):
+        return [column for column, time in trip_cells[n].iteritems()
+                if earliest(column)[0] < time]
+
+    def key(n):
+        return (trip_cells[n][min(trip_cells[n])], n)
+
+    def first_wait(n):
+        """Return a trip left that reaches the first timepoint it shares with
+        trip n before it, or None.
+        """
+        cells = trip_cells[n]
+        # Trips with the same stopping pattern share the same first
+        # timepoint with n.
+        for pattern in patterns:
+            column = next((column for column in pattern if column in cells),
+                          None)
+            if column is None:
+                continue
+            head = earliest((pattern, column))
+            if head is not None and head[0] < cells[column]:
+                return head[1]
+        return None
+
+    def all_waits(n):
+        """Return every trip left that reaches the first timepoint it shares
+        with trip n before it, with that timepoint.
+        """
+        cells = trip_cells[n]
+        res = []
+        for pattern in patterns:
+            column = next((column for column in pattern if column in cells),
+                          None)
+            if column is None:
+                continue
+            lane = pattern, column
+            lane_departures = departures[lane]
+            i = unplaced(lane, heads[lane])
+            while (i < len(lane_departures)
+                   and lane_departures[i][0] < cells[column]):
+                res.append((lane_departures[i][1], column))
+                i = unplaced(lane, i + 1)
+        return res
+
+    def closed_component(n):
+        """Return the waits of a set of trips left that wait on each other
+        but on no others, among those that trip n waits on, directly or
+        not, as a dict of each trip to the (trip, column) pairs it waits on.
+        """
+        waits_on = {}
+        stack = [n]
+        while len(stack) > 0:
+            m = stack.pop()
+            if m not in waits_on:
+                waits_on[m] = all_waits(m)
+                stack.extend(other for other, column in waits_on[m])
+
+        # Tarjan's algorithm finishes a component that waits on no other
+        # one first. Until then, every trip it has seen is on its stack.
+        numbers = {}
+        lowlinks = {}
+        stack = []
+        work = [(n, iter(waits_on[n]))]
+        numbers[n] = lowlinks[n] = 0
+        stack.append(n)
+        while len(work) > 0:
+            m, edges = work[-1]
+            for other, column in edges:
+                if other not in numbers:
+                    numbers[other] = lowlinks[other] = len(numbers)
+                    stack.append(other)
+                    work.append((other, iter(waits_on[other])))
+                    break
+                lowlinks[m] = min(lowlinks[m], numbers[other])
+            else:
+                work.pop()
+                if lowlinks[m] == numbers[m]:
+                    component = set(stack[stack.index(m):])
+                    return {trip: [(other, column)
+                                   for other, column in waits_on[trip]
+                                   if other in component]
+                            for trip in component}
+                parent = work[-1][0]
+                lowlinks[parent] = min(lowlinks[parent], lowlinks[m])
+
+    def component_order(waits_on):
+        """Return the trips of waits_on in an order that keeps the waits
+        the original graph sort kept.
+        """
+        after = defaultdict(set)
+
+        def reaches(start, end):
+            seen = set([start])
+            stack = [start]
+            while len(stack) > 0:
+                m = stack.pop()
+                if m == end:
+                    return True
+                for other in after[m] - seen:
+                    seen.add(other)
+                    stack.append(other)
+            return False
+
+        edges = sorted((other, column, trip)
+                       for trip, trip_waits in waits_on.iteritems()
+                       for other, column in trip_waits)
+        for first, column, second in edges:
+            if not reaches(second, first):
+                after[first].add(second)
+        waiting = dict.fromkeys(waits_on, 0)
+        for first in after:
+            for second in after[first]:
+                waiting[second] += 1
+        ready = [key(m) for m, count in waiting.iteritems() if count == 0]
+        heapq.heapify(ready)
+        res = []
+        while len(ready) > 0:
+            time, m = heapq.heappop(ready)
+            res.append(m)
+            for other in after[m]:
+                waiting[other] -= 1
+                if waiting[other] == 0:
+                    heapq.heappush(ready, key(other))
+        return res
 
+    def unblocked():
+        """Return the trips to place next when none is ready."""
+        # A trip that no other reaches first at their first shared timepoint
+        # is among the earliest at its own first timepoint.
+        candidates = sorted(set(m for column in columns for m in tied(column)
+                                if min(trip_cells[m]) == column),
+                            key=key)
+        for m in candidates:
+            if first_wait(m) is None:
+                return [m]
+        # No trip outside such a set of trips comes between two of them, so
+        # they are placed together.
+        return component_order(closed_component(candidates[0]))
 
-def write_out(path, contents):
-    path.parent.mkdir(exist_ok=True)
-    with path.resolve().open('wt') as fd:
+    queued = set(n for n in range(len(trip_cells))
+                 if not placed[n] and len(waits(n)) == 0)
+    ready = [key(n) for n in queued]
+    heapq.heapify(ready)
+    order = []
+    forced = []
+    count = placed.count(False)
+    while len(order) < count:
+        if len(forced) > 0:
+            n = forced.pop()
+        elif len(ready) > 0:
+            time, n = heapq.heappop(ready)
+            queued.remove(n)
+            if placed[n]:
+                continue
+        else:
+            forced = unblocked()[::-1]
+            continue
+        placed[n] = True
+        order.append(n)
+
+        # Queue the trips that are now the earliest at n's columns.
+        for column in trip_cells[n]:
+            for m in tied(column):
+                if m not in queued and len(waits(m)) == 0:
+                    queued.add(m)
+                    heapq.heappush(ready, key(m))
+    return order + [n for n, cells in enumerate(trip_cells) if len(cells) == 0]
+
+
+def write_out(path, contents, mode='t'):
+    """Write contents to path, unless it already holds them, so that
+    unchanged files keep their modification times. Return whether the file
+    was written.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        with path.open('r' + mode) as fd:
+            if fd.read() == contents:
+                return False
+    except IOError as err:
+        if err.errno != errno.ENOENT:
+            raise
+    with path.resolve().open('w' + mode) as fd:
         fd.write(contents)
+    return True
+
+
+def stream_out(path, chunks):
+    """Like write_out, but write the text in chunks as it is generated, so
+    that the whole file is never held in memory.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path = path.resolve()
+    tmp_path = path.with_name('.%s.tmp' % path.name)
+    try:
+        with io.open(str(tmp_path), 'w', encoding='utf-8',
+                     buffering=1 << 16) as fd:
+            for chunk in chunks:
+                fd.write(chunk)
+        if path.exists() and filecmp.cmp(str(tmp_path), str(path),
+                                         shallow=False):
+            return False
+        os.rename(str(tmp_path), str(path))
+        return True
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
 
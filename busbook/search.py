@@ -0,0 +1,55 @@
+"""A prefix-searchable index of stops and the routes that serve them, for
+the stop search on the index page.
+
+Stops are found by the words of their names and of their stop_ids, which
+are the index's keys. The index is sorted by key and split into shards of
+SHARD_SIZE entries, and the page is given the first key of each shard, so
+that it loads only the shards that hold the keys beginning with a word that
+has been typed. search.js reads the shards.
+"""
+import re
+
+
+SHARD_SIZE = 256
+WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def text(value):
+    """Return value, which may be UTF-8 bytes, as unicode."""
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    return value or u''
+
+
+def search_keys(stop):
+    """Return the lowercase words of the stop's name and stop_id."""
+    return sorted(set(WORD.findall(text(stop.stop_name).lower())
+                      + WORD.findall(text(stop.stop_id).lower())))
+
+
+def route_key(index, route):
+    """Return the name that the index page gives route, as in its page's
+    file name.
+    """
+    return '%s-%s' % (index.agency(route).agency_id, route.route_id)
+
+
+def search_shards(index, stop_routes, shard_size=SHARD_SIZE):
+    """Return the search index of the stops in stop_routes, which maps
+    stop_ids to lists of (route, headsigns) pairs, as a list of shards of
+    up to shard_size entries.
+
+    A shard is a list of entries in order of key. An entry is a key, and the
+    id and name of a stop with that key, with the routes that serve it and
+    the headsigns of their trips that stop there.
+    """
+    entries = []
+    for stop_id, routes in stop_routes.iteritems():
+        stop = index.stops[stop_id]
+        routes = [[route_key(index, route), headsigns]
+                  for route, headsigns in routes]
+        for key in search_keys(stop):
+            entries.append([key, stop_id, stop.stop_name, routes])
+    entries.sort(key=lambda entry: (entry[0], text(entry[1])))
+    return [entries[n:n + shard_size]
+            for n in xrange(0, len(entries), shard_size)]
@@ -0,0 +1,244 @@
+"""A local web server that renders the pages of a bus book when they are
+requested, for previews and for dates that have not been built.
+"""
+import mimetypes
+import shutil
+import tempfile
+import threading
+import traceback
+import urllib
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from collections import OrderedDict
+from datetime import datetime
+from SocketServer import ThreadingMixIn
+
+from pathlib2 import Path
+
+from busbook.data import write_data
+from busbook.render import (RouteSchedule, ServiceCalendar, clear_out,
+                            index_page, make_env, route_page, route_path,
+                            service_key, stop_routes)
+
+
+class LRUCache(object):
+    """The max_entries most recently used values of a computation. A value
+    that several threads ask for at once is computed only once, by the first
+    of them, while the others wait for it. Those are counted as waits, not as
+    hits or misses.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self._values = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        """Return the value of key, calling compute() for it if it is not
+        cached.
+        """
+        with self._lock:
+            if key in self._values:
+                self.hits += 1
+                value = self._values[key] = self._values.pop(key)
+                return value
+            pending = self._pending.get(key)
+            if pending is None:
+                self.misses += 1
+                pending = self._pending[key] = _Pending()
+                owner = True
+            else:
+                self.waits += 1
+                owner = False
+        if not owner:
+            return pending.wait()
+
+        try:
+            value = compute()
+        except Exception as err:
+            with self._lock:
+                del self._pending[key]
+            pending.fail(err)
+            raise
+        with self._lock:
+            del self._pending[key]
+            self._values[key] = value
+            if len(self._values) > self.max_entries:
+                self._values.popitem(last=False)
+        pending.finish(value)
+        return value
+
+    def __len__(self):
+        return len(self._values)
+
+
+class _Pending(object):
+    """A value that another thread is computing."""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._value = None
+        self._error = None
+
+    def finish(self, value):
+        self._value = value
+        self._done.set()
+
+    def fail(self, error):
+        self._error = error
+        self._done.set()
+
+    def wait(self):
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+
+class LazyBook(object):
+    """The pages of the bus book of index, rendered when they are first
+    requested. The pages of up to max_pages pairs of routes and the services
+    they run are kept.
+
+    The static and data files the pages link to are written to outdir.
+    """
+
+    def __init__(self, index, outdir, cache_dir=None, simplify=0,
+                 timetables='html', max_pages=128):
+        self.index = index
+        self.outdir = outdir
+        self.timetables = timetables
+        self.env = make_env(cache_dir)
+        clear_out(outdir)
+        self.data = write_data(index, outdir, tolerance=simplify,
+                               stop_routes=stop_routes(index))
+        self.route_data = {route.route_id: self.data.for_route(index, route)
+                           for route in index.routes}
+        self.calendar = ServiceCalendar(index.services)
+        self.routes = {str(route_path(index, route)): route
+                       for route in index.routes}
+        self.route_services = {
+            route.route_id: set(
+                trip.service_id
+                for trip in index.trips_by_route.get(route.route_id, []))
+            for route in index.routes}
+        self.pages = LRUCache(max_pages)
+        # The index's cache of stop times is not safe to share between
+        # threads, so everything that reads it is done here or under this
+        # lock.
+        self._schedule_lock = threading.Lock()
+
+    def index_page(self, link_query=''):
+        return u''.join(index_page(
+            self.env, self.index, link_query=link_query,
+            search_file=self.data.search_file)).encode('utf-8')
+
+    def route_page(self, path, date):
+        """Return the page at path, relative to the root of the book, for the
+        week beginning on date, or None if there is no such route.
+        """
+        route = self.routes.get(path)
+        if route is None:
+            return None
+        service_ids = self.route_services[route.route_id]
+        services = [service for service in self.calendar.week(date)
+                    if service.service_id in service_ids]
+        return self.pages.get((route.route_id, service_key(services)),
+                              lambda: self._render(route, services))
+
+    def _render(self, route, services):
+        print('Processing %s %s.'
+              % (route.route_short_name, route.route_long_name))
+        with self._schedule_lock:
+            schedule = RouteSchedule(self.index, route, services=services)
+        page = u''.join(route_page(self.env, schedule,
+                                   self.route_data[route.route_id],
+                                   timetables=self.timetables))
+        return page.encode('utf-8')
+
+
+class BookRequestHandler(BaseHTTPRequestHandler):
+    """Serves the pages of the server's LazyBook, for the date in the date
+    query parameter (default: today), and its static files.
+    """
+
+    def do_GET(self):
+        url = urlparse.urlsplit(self.path)
+        path = urllib.unquote(url.path).lstrip('/')
+        book = self.server.book
+        datestr = urlparse.parse_qs(url.query).get('date', [None])[0]
+        try:
+            date = (datetime.today() if datestr is None
+                    else datetime.strptime(datestr, '%Y-%m-%d'))
+        except ValueError:
+            self.send_error(400, "Expected a date like '2019-01-02'")
+            return
+
+        try:
+            if path in ('', 'index.html'):
+                self.respond(book.index_page(
+                    '?' + urllib.urlencode({'date': datestr})
+                    if datestr is not None else ''), 'text/html')
+            elif path.startswith('routes/'):
+                page = book.route_page(path, date)
+                if page is None:
+                    self.send_error(404)
+                else:
+                    self.respond(page, 'text/html')
+            elif path.startswith('static/'):
+                self.send_static(path)
+            else:
+                self.send_error(404)
+        except Exception:
+            traceback.print_exc()
+            self.send_error(500)
+
+    def send_static(self, path):
+        root = self.server.book.outdir.resolve()
+        file_path = (root/path).resolve()
+        if root not in file_path.parents or not file_path.is_file():
+            self.send_error(404)
+            return
+        content_type = mimetypes.guess_type(str(file_path))[0]
+        self.respond(file_path.read_bytes(),
+                     content_type or 'application/octet-stream')
+
+    def respond(self, contents, content_type):
+        self.send_response(200)
+        if content_type.startswith('text/') or content_type.endswith('script'):
+            content_type += '; charset=utf-8'
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(contents)))
+        self.end_headers()
+        self.wfile.write(contents)
+
+
+class BookServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, book):
+        HTTPServer.__init__(self, address, BookRequestHandler)
+        self.book = book
+
+
+def serve(index, host='127.0.0.1', port=8000, **kwargs):
+    """Serve the bus book of index until interrupted. Other arguments are
+    passed to LazyBook.
+    """
+    outdir = Path(tempfile.mkdtemp(prefix='busbook-'))
+    try:
+        server = BookServer((host, port), LazyBook(index, outdir, **kwargs))
+        print('Serving on http://%s:%d/' % server.server_address[:2])
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+    finally:
+        shutil.rmtree(str(outdir))
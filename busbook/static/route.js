@@ -1,3 +1,33 @@
+/* Look up the route's stops in the shards of the shared stop table. */
+function LookupStop(stop_id) {
+        const [lat, lon, name] = StopTable[stop_id];
+        return { stop_id: stop_id, stop_lat: lat, stop_lon: lon, stop_name: name };
+}
+Stops = StopIds.map(LookupStop);
+Timepoints = TimepointIds.map(LookupStop);
+
+/* Decode the route's shapes, which are encoded polylines. */
+function DecodePolyline(polyline) {
+        const points = [];
+        let lat = 0, lon = 0, i = 0;
+        function next() {
+                let shift = 0, value = 0, byte;
+                do {
+                        byte = polyline.charCodeAt(i++) - 63;
+                        value |= (byte & 0x1f) << shift;
+                        shift += 5;
+                } while (byte >= 0x20);
+                return value & 1 ? ~(value >> 1) : value >> 1;
+        }
+        while (i < polyline.length) {
+                lat += next();
+                lon += next();
+                points.push([lat/1e5, lon/1e5]);
+        }
+        return points;
+}
+Shapes = Shapes.map(DecodePolyline);
+
 /* Read route colors. */
 BodyStyle = getComputedStyle(document.body)
 RouteColor = BodyStyle.getPropertyValue("--route-color");
@@ -8,6 +38,119 @@ RouteTabs = new Tabs(document.getElementsByTagName("section"));
 Header = document.getElementsByTagName("header")[0];
 Header.appendChild(RouteTabs.navigation);
 
+/* Render timetables that were written as rows of minutes (see
+   timetable_rows in render.py), only the rows that are on screen. */
+const NO_SERVICE = -1, SKIP = -2;
+function DecodeRows(rows, width) {
+        const grid = new Int32Array(rows.length*width).fill(NO_SERVICE);
+        let previous = 0;
+        rows.forEach(function (row, n) {
+                let last = null;
+                for (let i = 1; i < row.length; i++) {
+                        const cell = n*width + row[0] + i - 1;
+                        if (row[i] === null) {
+                                grid[cell] = SKIP;
+                        } else if (last === null) {
+                                last = previous = previous + row[i];
+                                grid[cell] = last;
+                        } else {
+                                last += row[i];
+                                grid[cell] = last;
+                        }
+                }
+        });
+        return grid;
+}
+function TimeHtml(minutes) {
+        const hours = Math.floor(minutes/60) % 24, mins = minutes % 60;
+        const hour = hours === 0 ? 12 : hours > 12 ? hours - 12 : hours;
+        return '<span class="time-' + (hours < 12 ? "am" : "pm") + '">'
+                + hour + ":" + (mins < 10 ? "0" : "") + mins + "</span>";
+}
+const CodeCells = { [NO_SERVICE]: '<td class="timetable-no"></td>',
+                    [SKIP]: '<td class="timetable-skip"></td>' };
+function LazyTimetable(tbody) {
+        const width = tbody.parentNode.tHead.rows[0].cells.length,
+              rows = JSON.parse(tbody.getAttribute("data-rows"));
+        tbody.removeAttribute("data-rows");
+        this.tbody = tbody;
+        this.width = width;
+        this.height = rows.length;
+        this.grid = DecodeRows(rows, width);
+        this.rowHeight = null;
+        this.start = this.end = -1;
+}
+LazyTimetable.OVERSCAN = 20;
+LazyTimetable.prototype.rowHtml = function (n) {
+        const cells = ["<tr>"];
+        for (let i = n*this.width; i < (n + 1)*this.width; i++) {
+                const minutes = this.grid[i];
+                cells.push(minutes >= 0 ? "<td>" + TimeHtml(minutes) + "</td>"
+                                        : CodeCells[minutes]);
+        }
+        cells.push("</tr>");
+        return cells.join("");
+};
+LazyTimetable.prototype.spacerHtml = function (rows) {
+        return '<tr class="timetable-spacer"><td colspan="' + this.width
+                + '" style="height: ' + rows*this.rowHeight + 'px"></td></tr>';
+};
+LazyTimetable.prototype.update = function () {
+        /* Tables in hidden tabs wait until their tab is shown. */
+        if (this.tbody.offsetParent === null)
+                return;
+        let start, end;
+        if (this.rowHeight === null) {
+                start = 0;
+                end = Math.min(this.height, 2*LazyTimetable.OVERSCAN);
+        } else {
+                const top = this.tbody.getBoundingClientRect().top;
+                start = Math.max(0, Math.floor(-top/this.rowHeight)
+                                    - LazyTimetable.OVERSCAN);
+                end = Math.min(this.height,
+                               Math.ceil((window.innerHeight - top)
+                                         / this.rowHeight)
+                               + LazyTimetable.OVERSCAN);
+                start = Math.min(start, end);
+        }
+        if (start === this.start && end === this.end)
+                return;
+        const html = [];
+        if (start > 0)
+                html.push(this.spacerHtml(start));
+        for (let n = start; n < end; n++)
+                html.push(this.rowHtml(n));
+        if (this.rowHeight !== null && end < this.height)
+                html.push(this.spacerHtml(this.height - end));
+        this.tbody.innerHTML = html.join("");
+        this.start = start;
+        this.end = end;
+        if (this.rowHeight === null && end > 0) {
+                /* Measure the rendered rows, then lay out the rest. */
+                this.rowHeight = this.tbody.getBoundingClientRect().height/end;
+                this.start = this.end = -1;
+                this.update();
+        }
+};
+Timetables = [...document.querySelectorAll("tbody[data-rows]")]
+        .map(tbody => new LazyTimetable(tbody));
+if (Timetables.length > 0) {
+        let pending = false;
+        const UpdateTimetables = function () {
+                if (pending)
+                        return;
+                pending = true;
+                requestAnimationFrame(function () {
+                        pending = false;
+                        Timetables.forEach(timetable => timetable.update());
+                });
+        };
+        window.addEventListener("scroll", UpdateTimetables, { passive: true });
+        window.addEventListener("resize", UpdateTimetables);
+        RouteTabs.navigation.addEventListener("click", UpdateTimetables);
+        Timetables.forEach(timetable => timetable.update());
+}
+
 /* Create map and base layers. */
 const OsmLayer = new L.TileLayer(
         "https://{s}.tile.openstreetmap.se/hydda/full/{z}/{x}/{y}.png",
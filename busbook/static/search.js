@@ -0,0 +1,125 @@
+/* Find stops by the words of their names and ids, and list the routes
+   that serve them. The search index is sorted by key and split into shards
+   (see search.py); only the shards that hold the keys beginning with one of
+   the words typed are loaded. */
+function Search(form) {
+        const MAX_RESULTS = 20, MAX_SHARDS = 4;
+        const input = form.querySelector("input"),
+              results = form.querySelector("ul");
+        const routes = {};
+        [...document.querySelectorAll("li[data-route]")].forEach(
+                item => routes[item.getAttribute("data-route")] = item);
+        let firstKeys = [], shardFiles = [];
+        const shards = {}, requested = {};
+
+        function words(text) {
+                return text.toLowerCase().match(/[\p{L}\p{N}_]+/gu) || [];
+        }
+        /* Return the range of shards that may hold keys beginning with
+           word: those that begin with such a key, and the one before. */
+        function shardRange(word) {
+                let low = 0, high = firstKeys.length;
+                while (low < high) {
+                        const mid = (low + high) >> 1;
+                        if (firstKeys[mid] < word)
+                                low = mid + 1;
+                        else
+                                high = mid;
+                }
+                let end = low;
+                while (end < firstKeys.length && firstKeys[end].startsWith(word))
+                        end++;
+                return [Math.max(0, low - 1), end];
+        }
+        function message(text) {
+                const item = document.createElement("li");
+                item.setAttribute("class", "stop-search-message");
+                item.textContent = text;
+                results.appendChild(item);
+        }
+        function stopItem([key, stop_id, name, stopRoutes]) {
+                const item = document.createElement("li"),
+                      stopName = document.createElement("span"),
+                      stopId = document.createElement("span"),
+                      routeList = document.createElement("ul");
+                stopName.setAttribute("class", "stop-name");
+                stopName.textContent = name;
+                stopId.setAttribute("class", "stop-id");
+                stopId.textContent = "#" + stop_id;
+                item.append(stopName, " ", stopId, routeList);
+                stopRoutes.forEach(function ([route, headsigns]) {
+                        if (!(route in routes))
+                                return;
+                        const routeItem = routes[route].cloneNode(true),
+                              headsignText = document.createElement("span");
+                        headsignText.setAttribute("class", "stop-headsigns");
+                        headsignText.textContent = "to " + headsigns.join(", ");
+                        routeItem.appendChild(headsignText);
+                        routeList.appendChild(routeItem);
+                });
+                return item;
+        }
+        function update() {
+                const query = words(input.value);
+                results.textContent = "";
+                if (query.length === 0 || firstKeys.length === 0)
+                        return;
+
+                /* Look up the word that needs the fewest shards. */
+                const [word, [start, end]] = query
+                        .map(word => [word, shardRange(word)])
+                        .reduce((a, b) => b[1][1] - b[1][0] < a[1][1] - a[1][0]
+                                          ? b : a);
+                if (end - start > MAX_SHARDS) {
+                        message("Keep typing to find a stop.");
+                        return;
+                }
+                const srcs = shardFiles.slice(start, end)
+                        .map(file => "static/data/" + file);
+                const missing = srcs.filter(src => !(src in shards));
+                if (missing.length > 0) {
+                        /* addShard searches again when a shard loads. */
+                        missing.filter(src => !requested[src]).forEach(
+                                function (src) {
+                                        requested[src] = true;
+                                        const script = document.createElement("script");
+                                        script.src = src;
+                                        document.body.appendChild(script);
+                                });
+                        return;
+                }
+
+                const stops = new Map();
+                srcs.forEach(src => shards[src].forEach(function (entry) {
+                        if (entry[0].startsWith(word))
+                                stops.set(entry[1], entry);
+                }));
+                const matches = [...stops.values()].filter(function (entry) {
+                        const keys = words(entry[2] + " " + entry[1]);
+                        return query.every(
+                                word => keys.some(key => key.startsWith(word)));
+                });
+                matches.sort((a, b) => a[2].localeCompare(b[2]));
+                matches.slice(0, MAX_RESULTS).forEach(
+                        entry => results.appendChild(stopItem(entry)));
+                if (matches.length === 0)
+                        message("No stops found.");
+                else if (matches.length > MAX_RESULTS)
+                        message("and " + (matches.length - MAX_RESULTS)
+                                + " more stops");
+        }
+
+        this.setIndex = function (keys, files) {
+                firstKeys = keys;
+                shardFiles = files;
+                form.hidden = false;
+                update();
+        };
+        this.addShard = function (entries) {
+                shards[document.currentScript.getAttribute("src")] = entries;
+                update();
+        };
+        input.addEventListener("input", update);
+        form.addEventListener("submit", event => event.preventDefault());
+}
+StopSearch = new Search(document.getElementById("stop-search"));
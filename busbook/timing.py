@@ -0,0 +1,117 @@
+"""Wall time of the phases of a build and of each route, and the peak
+memory of the process after each, for the --profile option.
+
+The peak resident set size can only grow, so each phase also records how
+much it raised the peak; a phase that raised it by nothing used no more
+memory than some phase before it.
+"""
+import json
+import resource
+import time
+from contextlib import contextmanager
+
+
+def max_rss():
+    """Return the peak resident set size of this process so far, in KB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Profiler(object):
+    """Records the phases of a build in order, and the steps of rendering
+    each route, keyed by route_id.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.phases = []
+        self.routes = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        start_rss = max_rss()
+        try:
+            yield
+        finally:
+            end_rss = max_rss()
+            self.phases.append({'phase': name,
+                                'seconds': time.time() - start,
+                                'max_rss_so_far_kb': end_rss,
+                                'max_rss_increase_kb': end_rss - start_rss})
+
+    @contextmanager
+    def route(self, route, step):
+        start = time.time()
+        try:
+            yield
+        finally:
+            entry = self.routes.setdefault(route.route_id, {
+                'route_id': route.route_id,
+                'name': u'%s %s' % (route.route_short_name or u'',
+                                    route.route_long_name or u''),
+                'seconds': 0.0,
+                })
+            elapsed = time.time() - start
+            entry[step] = entry.get(step, 0.0) + elapsed
+            entry['seconds'] += elapsed
+            entry['max_rss_so_far_kb'] = max_rss()
+
+    def merge(self, routes):
+        """Add the route entries recorded by another Profiler, such as one in
+        a worker process.
+        """
+        self.routes.update(routes)
+
+    def slowest(self, count=20):
+        return sorted(self.routes.itervalues(),
+                      key=lambda entry: entry['seconds'], reverse=True)[:count]
+
+    def write(self, path):
+        with open(path, 'w') as fd:
+            json.dump({'phases': self.phases,
+                       'routes': self.slowest(len(self.routes))},
+                      fd, indent=2, separators=(',', ': '), sort_keys=True)
+
+    def summary(self):
+        lines = ['%-24s %10s %16s %12s'
+                 % ('Phase', 'Time', 'Peak RSS so far', 'Raised by')]
+        for entry in self.phases:
+            lines.append('%-24s %8.2f s %13.1f MB %9.1f MB'
+                         % (entry['phase'], entry['seconds'],
+                            entry['max_rss_so_far_kb']/1024.0,
+                            entry['max_rss_increase_kb']/1024.0))
+        lines.append('')
+        lines.append('%-24s %10s %10s %10s'
+                     % ('Slowest routes', 'Total', 'Schedule', 'Render'))
+        for entry in self.slowest():
+            lines.append(u'%-24s %8.2f s %8.2f s %8.2f s'
+                         % (entry['name'][:24], entry['seconds'],
+                            entry.get('schedule', 0.0),
+                            entry.get('render', 0.0)))
+        return u'\n'.join(lines)
+
+
+class _NullContext(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class NullProfiler(object):
+    """A Profiler that records nothing, for builds without --profile."""
+
+    enabled = False
+    _context = _NullContext()
+
+    def phase(self, name):
+        return self._context
+
+    def route(self, route, step):
+        return self._context
+
+
+NULL_PROFILER = NullProfiler()
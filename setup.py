@@ -124,7 +124,7 @@ setup(
     #
     #   py_modules=["my_module"],
     #
-    packages=find_packages(),  # Required
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),  # Required
 
     # This field lists other packages that your project depends on to run.
     # Any package you put here will be installed by pip when your project is
@@ -134,7 +134,6 @@ setup(
     # https://packaging.python.org/en/latest/requirements.html
     install_requires=[
         'Jinja2',
-        'networkx',
         'pathlib2',
         'transitfeed'
     ],  # Optional
@@ -148,6 +147,9 @@ setup(
     # Similar to `install_requires` above, these must be valid existing
     # projects.
     extras_require={  # Optional
+        'test': ['hypothesis', 'networkx'],
+        'geometry': ['numpy'],
+        'brotli': ['brotli'],
     },
 
     # If there are data files included in your packages that need to be
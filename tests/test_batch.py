@@ -0,0 +1,96 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+from StringIO import StringIO
+
+from busbook import cli
+from busbook.batch import BatchError, read_batch, run_batch
+
+from test_render import make_schedule
+
+
+def build(entry):
+    if entry.feed.endswith('bad.zip'):
+        raise ValueError('bad feed')
+    return {'status': 'ok'}
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_manifest(self, entries):
+        path = os.path.join(self.tmpdir, 'batch.json')
+        with open(path, 'w') as fd:
+            json.dump(entries, fd)
+        return path
+
+    def test_read_batch(self):
+        entries = read_batch(self.write_manifest([
+            {'feed': 'a.zip', 'output': 'out/a', 'date': '2020-01-06'},
+            {'feed': 'b.zip', 'output': 'out/b',
+             'date_range': '2020-01-06:2020-01-08'}]))
+        self.assertEqual(entries[0].feed, os.path.join(self.tmpdir, 'a.zip'))
+        self.assertEqual(entries[0].date, datetime(2020, 1, 6))
+        self.assertEqual(entries[1].date_range,
+                         (datetime(2020, 1, 6), datetime(2020, 1, 8)))
+
+    def test_bad_manifest(self):
+        for entries in [{'feed': 'a.zip'}, [{'feed': 'a.zip'}],
+                        [{'feed': 'a.zip', 'output': 'a', 'date': 'soon'}],
+                        [{'feed': 'a.zip', 'output': 'a',
+                          'date_range': '2020-01-06'}],
+                        [{'feed': 'a.zip', 'output': 'a',
+                          'date_range': '2020-01-08:2020-01-06'}],
+                        [{'feed': 'a.zip', 'output': 'a',
+                          'date': '2020-01-06',
+                          'date_range': '2020-01-06:2020-01-08'}]]:
+            self.assertRaises(BatchError, read_batch,
+                              self.write_manifest(entries))
+
+    def test_run_batch(self):
+        for name, size in [('small.zip', 1), ('large.zip', 100),
+                           ('bad.zip', 10)]:
+            with open(os.path.join(self.tmpdir, name), 'wb') as fd:
+                fd.write('x'*size)
+        entries = read_batch(self.write_manifest([
+            {'feed': name, 'output': name}
+            for name in ['small.zip', 'bad.zip', 'large.zip']]))
+        results = run_batch(entries, build)
+        self.assertEqual([os.path.basename(result['feed'])
+                          for result in results],
+                         ['large.zip', 'bad.zip', 'small.zip'])
+        self.assertEqual([result['status'] for result in results],
+                         ['ok', 'error', 'ok'])
+        self.assertIn('bad feed', results[1]['error'])
+
+    def test_batch_main(self):
+        make_schedule().WriteGoogleTransitFeed(
+            os.path.join(self.tmpdir, 'feed.zip'))
+        path = self.write_manifest([
+            {'feed': 'feed.zip', 'output': 'out', 'date': '2020-01-06'}])
+        report = os.path.join(self.tmpdir, 'report.json')
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            cli.batch_main([path, '--reader', 'fast', '--no-cache',
+                            '--report', report])
+        finally:
+            sys.stdout = stdout
+        self.assertTrue(os.path.exists(
+            os.path.join(self.tmpdir, 'out', 'routes', 'A-R1.html')))
+        with open(report) as fd:
+            result, = json.load(fd)['feeds']
+        self.assertEqual(result['status'], 'ok')
+        self.assertEqual(result['routes'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from io import BytesIO
+from StringIO import StringIO
+
+from pathlib2 import Path
+
+from busbook.cache import (code_version, evict, feed_digest, read_snapshot,
+                           snapshot_path, write_snapshot)
+from busbook.render import FeedIndex
+
+from test_render import make_schedule
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(str(self.cache_dir))
+
+    def test_digest(self):
+        fd = BytesIO(b'feed')
+        self.assertEqual(feed_digest(fd), feed_digest(BytesIO(b'feed')))
+        self.assertNotEqual(feed_digest(fd), feed_digest(BytesIO(b'other')))
+        self.assertEqual(fd.tell(), 0)
+
+    def test_round_trip(self):
+        self.assertIsNone(read_snapshot(self.cache_dir, 'abc'))
+        index = FeedIndex.from_schedule(make_schedule()).materialize()
+        write_snapshot(self.cache_dir, 'abc', index)
+        cached = read_snapshot(self.cache_dir, 'abc')
+        self.assertEqual([route.route_id for route in cached.routes], ['R1'])
+        trip = cached.trips_by_route['R1'][0]
+        self.assertEqual(cached.stop_times.timepoints(trip),
+                         index.stop_times.timepoints(trip))
+        self.assertEqual(cached.stop_times.misses, 0)
+
+    def test_bad_snapshot(self):
+        index = FeedIndex.from_schedule(make_schedule()).materialize()
+        write_snapshot(self.cache_dir, 'abc', index)
+        path = snapshot_path(self.cache_dir, 'abc')
+        contents = path.read_bytes()
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            for bad in [contents[:len(contents)//2], b'', b'not a pickle']:
+                path.write_bytes(bad)
+                self.assertIsNone(read_snapshot(self.cache_dir, 'abc'))
+                self.assertFalse(path.exists())
+        finally:
+            sys.stdout = stdout
+
+    def test_code_version(self):
+        self.assertIn(code_version(),
+                      snapshot_path(self.cache_dir, 'abc').name)
+
+    def test_evict(self):
+        for n, digest in enumerate(['old', 'new']):
+            write_snapshot(self.cache_dir, digest, 'x'*1000)
+            os.utime(str(snapshot_path(self.cache_dir, digest)), (n, n))
+        evict(self.cache_dir, 1500)
+        self.assertIsNone(read_snapshot(self.cache_dir, 'old'))
+        self.assertIsNotNone(read_snapshot(self.cache_dir, 'new'))
+
+
+if __name__ == '__main__':
+    unittest.main()
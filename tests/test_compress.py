@@ -0,0 +1,99 @@
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+from StringIO import StringIO
+
+from pathlib2 import Path
+
+from busbook import compress
+from busbook.compress import Compressor, compress_file
+from busbook.data import DATA_DIR
+from busbook.render import FeedIndex, render
+
+from test_render import make_schedule
+
+
+class TestCompress(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmpdir))
+
+    def test_compress_file(self):
+        path = str(self.tmpdir/'page.html')
+        with open(path, 'wb') as fd:
+            fd.write('<p>Hello</p>'*100)
+        self.assertEqual(compress_file(path, ('gzip',)), 1)
+        with gzip.open(path + '.gz', 'rb') as fd:
+            self.assertEqual(fd.read(), '<p>Hello</p>'*100)
+
+        # The sibling is newer than the file.
+        self.assertEqual(compress_file(path, ('gzip',)), 0)
+        stat = os.stat(path + '.gz')
+        os.utime(path, (stat.st_atime, stat.st_mtime + 1))
+        self.assertEqual(compress_file(path, ('gzip',)), 1)
+
+    def test_same_mtime(self):
+        path = str(self.tmpdir/'page.html')
+        with open(path, 'wb') as fd:
+            fd.write('<p>Hello</p>')
+        compress_file(path, ('gzip',))
+        os.utime(path, (1000000000, 1000000000))
+        os.utime(path + '.gz', (1000000000, 1000000000))
+        self.assertEqual(compress_file(path, ('gzip',)), 0)
+
+        # The file is rewritten within the same tick of the clock.
+        with open(path, 'wb') as fd:
+            fd.write('<p>Goodbye</p>')
+        os.utime(path, (1000000000, 1000000000))
+        self.assertEqual(compress_file(path, ('gzip',)), 1)
+        with gzip.open(path + '.gz', 'rb') as fd:
+            self.assertEqual(fd.read(), '<p>Goodbye</p>')
+
+    def test_missing_file(self):
+        self.assertEqual(compress_file(str(self.tmpdir/'none.html'),
+                                       ('gzip',)), 0)
+
+    @unittest.skipIf(compress.brotli is None, 'brotli is not installed')
+    def test_brotli(self):
+        path = str(self.tmpdir/'page.html')
+        with open(path, 'wb') as fd:
+            fd.write('<p>Hello</p>'*100)
+        compress_file(path, ('brotli',))
+        with open(path + '.br', 'rb') as fd:
+            self.assertEqual(compress.brotli.decompress(fd.read()),
+                             '<p>Hello</p>'*100)
+
+    def test_only_text(self):
+        (self.tmpdir/'image.png').write_bytes('PNG')
+        compressor = Compressor(('gzip',))
+        compressor.add_tree(self.tmpdir)
+        self.assertEqual(compressor.close(), (0, 0))
+
+    def test_render(self):
+        outdir = self.tmpdir/'out'
+        index = FeedIndex.from_schedule(make_schedule())
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            for n in range(2):
+                render(index, date=datetime(2020, 1, 6), outdir=outdir,
+                       incremental=True, precompress=('gzip',))
+        finally:
+            output, sys.stdout = sys.stdout.getvalue(), stdout
+        for path in [outdir/'index.html', outdir/'routes'/'A-R1.html',
+                     outdir/'static'/'route.js']:
+            self.assertTrue(Path('%s.gz' % path).exists())
+        self.assertTrue(any(path.suffix == '.gz'
+                            for path in (outdir/DATA_DIR).iterdir()))
+        # Nothing changed in the second build.
+        self.assertIn('Compressed 0 files', output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import json
+import shutil
+import tempfile
+import unittest
+
+import transitfeed
+from pathlib2 import Path
+
+from busbook.data import DATA_DIR, stop_shards, write_data
+from busbook.geometry import encode
+from busbook.render import FeedIndex, Record
+
+from test_render import make_schedule
+
+
+class TestData(unittest.TestCase):
+
+    def setUp(self):
+        self.outdir = Path(tempfile.mkdtemp())
+        gtfs = make_schedule()
+        gtfs.AddShapeObject(self.make_shape('S1'))
+        gtfs.AddShapeObject(self.make_shape('S2'))
+        self.index = FeedIndex.from_schedule(gtfs)
+
+    def tearDown(self):
+        shutil.rmtree(str(self.outdir))
+
+    def make_shape(self, shape_id):
+        shape = transitfeed.Shape(shape_id)
+        shape.AddPoint(34.0, -118.0)
+        shape.AddPoint(34.03, -118.0)
+        return shape
+
+    def test_write_data(self):
+        data = write_data(self.index, self.outdir)
+        names = sorted(path.name for path in (self.outdir/DATA_DIR).iterdir())
+        # The two shapes have the same points, so they share a file.
+        shape_name = data.shape_files['S1']
+        self.assertEqual(data.shape_files['S2'], shape_name)
+        stop_files = sorted(set(data.stop_files.itervalues()))
+        self.assertEqual(names, sorted(stop_files + [shape_name]))
+        self.assertIn('"Stop 2"',
+                      (self.outdir/DATA_DIR/data.stop_files['2']).read_bytes())
+        self.assertEqual((self.outdir/DATA_DIR/shape_name).read_bytes(),
+                         'Shapes.push(%s);\n'
+                         % json.dumps(encode([(34.0, -118.0),
+                                              (34.03, -118.0)])))
+
+    def test_simplify(self):
+        shape = transitfeed.Shape('S3')
+        for n in range(10):
+            shape.AddPoint(34.0 + n*0.001, -118.0)
+        self.index.shapes['S3'] = shape
+        data = write_data(self.index, self.outdir, tolerance=1.0)
+        self.assertEqual(data.shape_stats['S3'][0], 10)
+        self.assertEqual(data.shape_stats['S3'][2], 2)
+        self.assertEqual(data.reduction()[:3:2], (14, 6))
+
+    def test_stop_shards(self):
+        for n in range(1000):
+            self.index.stops['x%d' % n] = Record(
+                stop_id='x%d' % n, stop_name='Stop', stop_lat=34.0,
+                stop_lon=-118.0)
+        shards = stop_shards(self.index, shard_size=16)
+        self.assertEqual(sum(shards, []), sorted(self.index.stops))
+        self.assertGreater(len(shards), 1)
+        # Removing a stop changes only the shard that held it.
+        del self.index.stops['x500']
+        new_shards = stop_shards(self.index, shard_size=16)
+        changed = [shard for shard in shards if shard not in new_shards]
+        self.assertEqual(len(changed), 1)
+        self.assertIn('x500', changed[0])
+
+    def test_route_files(self):
+        for n in range(1000):
+            self.index.stops['x%d' % n] = Record(
+                stop_id='x%d' % n, stop_name='Stop', stop_lat=34.0,
+                stop_lon=-118.0)
+        data = write_data(self.index, self.outdir)
+        route = self.index.routes[0]
+        stop_files = set(data.stop_files[stop_id] for stop_id in '0123')
+        self.assertEqual(data.route_files(self.index, route),
+                         sorted(stop_files))
+        self.assertLess(len(stop_files), len(set(data.stop_files.values())))
+
+    def test_stale_files(self):
+        old_stops_file = write_data(self.index, self.outdir).stop_files['0']
+        self.index.stops['0'] = Record(stop_id='0', stop_name='Renamed',
+                                       stop_lat=34.0, stop_lon=-118.0)
+        stops_file = write_data(self.index, self.outdir).stop_files['0']
+        self.assertNotEqual(stops_file, old_stops_file)
+        self.assertFalse((self.outdir/DATA_DIR/old_stops_file).exists())
+        self.assertTrue((self.outdir/DATA_DIR/stops_file).exists())
+
+
+if __name__ == '__main__':
+    unittest.main()
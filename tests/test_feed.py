@@ -0,0 +1,94 @@
+import pickle
+import shutil
+import tempfile
+import unittest
+from zipfile import ZipFile
+
+from busbook import feed
+from busbook.data import stop_shards
+from busbook.render import FeedIndex, RouteSchedule
+
+from test_render import make_schedule
+
+
+class TestFeed(unittest.TestCase):
+
+    def setUp(self):
+        self.gtfs = make_schedule()
+        self.tmp = tempfile.mkdtemp()
+        self.path = '%s/feed.zip' % self.tmp
+        self.gtfs.WriteGoogleTransitFeed(self.path)
+        self.expected = FeedIndex.from_schedule(self.gtfs)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def assertSameStopTimes(self, index):
+        trips = sorted(index.trips_by_route['R1'],
+                       key=lambda trip: trip.trip_id)
+        expected = sorted(self.expected.trips_by_route['R1'],
+                          key=lambda trip: trip.trip_id)
+        self.assertEqual([trip.trip_id for trip in trips],
+                         [trip.trip_id for trip in expected])
+        for trip, other in zip(trips, expected):
+            self.assertEqual(index.stop_times.pattern(trip),
+                             self.expected.stop_times.pattern(other))
+            self.assertEqual(index.stop_times.timepoints(trip),
+                             self.expected.stop_times.timepoints(other))
+
+    def test_load(self):
+        index = feed.load(ZipFile(self.path))
+        self.assertEqual([route.route_id for route in index.routes], ['R1'])
+        self.assertEqual(index.default_agency.agency_id, 'A')
+        self.assertEqual(index.stops['2'].stop_lat, 34.02)
+        self.assertSameStopTimes(index)
+        self.assertEqual([trip.trip_id for trip in index.trips_by_route['R1']],
+                         [trip.trip_id
+                          for trip in self.expected.trips_by_route['R1']])
+
+        schedule = RouteSchedule(index, index.routes[0],
+                                 services=index.services)
+        self.assertEqual(sorted(period.name
+                                for period in schedule.service_periods),
+                         ['Mon - Fri', 'Sat - Sun'])
+
+    def test_select(self):
+        index = feed.load(ZipFile(self.path), route_globs=['R1'])
+        self.assertEqual([route.route_id for route in index.routes], ['R1'])
+        self.assertSameStopTimes(index)
+
+        index = feed.load(ZipFile(self.path), agency_globs=['B'])
+        self.assertEqual(index.routes, [])
+        self.assertEqual(index.trips_by_route, {})
+        # Every stop is kept, so the stop shards match those of a full load.
+        self.assertEqual(stop_shards(index), stop_shards(self.expected))
+
+    def test_unordered_stop_times(self):
+        with ZipFile(self.path) as zipf:
+            tables = {name: zipf.read(name) for name in zipf.namelist()}
+        header, rows = tables['stop_times.txt'].split('\n', 1)
+        tables['stop_times.txt'] = '\n'.join(
+            [header] + sorted(rows.splitlines(), reverse=True)) + '\n'
+        path = '%s/unordered.zip' % self.tmp
+        with ZipFile(path, 'w') as zipf:
+            for name, contents in tables.items():
+                zipf.writestr(name, contents)
+        self.assertSameStopTimes(feed.load(ZipFile(path)))
+
+    def test_partition(self):
+        # Spill every few rows, so that each route's file holds several runs.
+        index = feed.load(ZipFile(self.path), max_memory=feed.ROW_BYTES*5)
+        directory = index.stop_times.directory
+        self.assertEqual(index.stop_times.partitions['R1'][1], 5)
+        self.assertSameStopTimes(index)
+        index.stop_times.close()
+        self.assertFalse(directory.exists())
+
+    def test_pickle(self):
+        index = pickle.loads(pickle.dumps(feed.load(ZipFile(self.path)),
+                                          pickle.HIGHEST_PROTOCOL))
+        self.assertSameStopTimes(index)
+
+
+if __name__ == '__main__':
+    unittest.main()
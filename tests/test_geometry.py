@@ -0,0 +1,61 @@
+import unittest
+
+from busbook import geometry
+from busbook.geometry import decode, encode, simplify
+
+
+class TestPolyline(unittest.TestCase):
+
+    POINTS = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+    POLYLINE = '_p~iF~ps|U_ulLnnqC_mqNvxq`@'
+
+    def test_encode(self):
+        self.assertEqual(encode(self.POINTS), self.POLYLINE)
+
+    def test_decode(self):
+        self.assertEqual(decode(self.POLYLINE), self.POINTS)
+
+
+class TestSimplify(unittest.TestCase):
+
+    # About 111 m apart, with a 5 m kink in the middle and a 50 m one at the
+    # end.
+    POINTS = [(34.0, -118.0), (34.001, -118.0), (34.002, -118.00005),
+              (34.003, -118.0), (34.004, -118.0), (34.005, -118.0005),
+              (34.006, -118.0)]
+
+    def test_collinear(self):
+        points = [(34.0 + n*0.001, -118.0) for n in range(10)]
+        self.assertEqual(simplify(points, 1.0), [points[0], points[-1]])
+
+    def test_tolerance(self):
+        self.assertEqual(simplify(self.POINTS, 0), self.POINTS)
+        self.assertEqual(simplify(self.POINTS, 10.0),
+                         [self.POINTS[0], self.POINTS[4], self.POINTS[5],
+                          self.POINTS[6]])
+        self.assertEqual(simplify(self.POINTS, 1.0),
+                         [self.POINTS[0], self.POINTS[1], self.POINTS[2],
+                          self.POINTS[3], self.POINTS[4], self.POINTS[5],
+                          self.POINTS[6]])
+        self.assertEqual(simplify(self.POINTS, 100.0),
+                         [self.POINTS[0], self.POINTS[-1]])
+
+    def test_loop(self):
+        points = [(34.0, -118.0), (34.001, -118.0), (34.001, -118.001),
+                  (34.0, -118.001), (34.0, -118.0)]
+        self.assertEqual(simplify(points, 10.0), points)
+
+    @unittest.skipIf(geometry.numpy is None, 'NumPy is not installed')
+    def test_python_fallback(self):
+        points = [(34.0 + n*0.0001, -118.0 + ((n*7) % 11)*0.00001)
+                  for n in range(500)]
+        expected = simplify(points, 0.5)
+        numpy, geometry.numpy = geometry.numpy, None
+        try:
+            self.assertEqual(simplify(points, 0.5), expected)
+        finally:
+            geometry.numpy = numpy
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,368 @@
+import pickle
+import shutil
+import sys
+import tempfile
+import unittest
+from array import array
+from datetime import datetime
+from StringIO import StringIO
+
+import transitfeed
+from pathlib2 import Path
+
+from busbook.render import (FeedIndex, RouteSchedule, ServiceCalendar,
+                            Timetable, make_env, render, render_range,
+                            service_key, stream_out, timetable_body,
+                            timetable_rows)
+
+
+def make_schedule():
+    """Return a feed with one route running two trips each way on weekdays
+    and one each way on weekends.
+    """
+    gtfs = transitfeed.Schedule()
+    gtfs.AddAgency('Agency', 'http://example.com', 'America/Los_Angeles',
+                   agency_id='A')
+    weekday = transitfeed.ServicePeriod('WKDY')
+    weekday.SetWeekdayService(True)
+    weekday.SetStartDate('20190101')
+    weekday.SetEndDate('20291231')
+    gtfs.AddServicePeriodObject(weekday)
+    weekend = transitfeed.ServicePeriod('WKND')
+    weekend.SetWeekendService(True)
+    weekend.SetStartDate('20190101')
+    weekend.SetEndDate('20291231')
+    gtfs.AddServicePeriodObject(weekend)
+
+    stops = [gtfs.AddStop(34.0 + i*0.01, -118.0, 'Stop %d' % i, stop_id=str(i))
+             for i in range(4)]
+    route = gtfs.AddRoute('1', 'Main St', 'Bus', route_id='R1')
+    route.agency_id = 'A'
+    for n, (service, start, pattern) in enumerate([
+            (weekday, 8, stops),
+            (weekday, 9, stops),
+            (weekday, 8, stops[::-1]),
+            (weekday, 9, stops[::-1]),
+            (weekend, 10, stops),
+            (weekend, 10, stops[::-1])]):
+        trip = route.AddTrip(gtfs, trip_id='T%d' % n)
+        trip.service_id = service.service_id
+        for i, stop in enumerate(pattern):
+            time = '%02d:%02d:00' % (start, i*10)
+            trip.AddStopTime(stop, arrival_time=time, departure_time=time)
+    return gtfs
+
+
+class TestRouteSchedule(unittest.TestCase):
+
+    def setUp(self):
+        self.gtfs = make_schedule()
+        self.index = FeedIndex.from_schedule(self.gtfs)
+        self.schedule = RouteSchedule(self.index, self.gtfs.GetRoute('R1'),
+                                      services=self.gtfs.GetServicePeriodList())
+
+    def test_periods(self):
+        self.assertEqual(sorted(period.name
+                                for period in self.schedule.service_periods),
+                         ['Mon - Fri', 'Sat - Sun'])
+
+    def test_weekend_only(self):
+        schedule = RouteSchedule(self.index, self.gtfs.GetRoute('R1'),
+                                 services=[self.gtfs.GetServicePeriod('WKND')])
+        self.assertEqual([period.name for period in schedule.service_periods],
+                         ['Sat - Sun'])
+
+    def test_timetable(self):
+        period = next(period for period in self.schedule.service_periods
+                      if period.name == 'Mon - Fri')
+        self.assertEqual([direction for direction, timetable
+                          in period.directions],
+                         ['Stop 0', 'Stop 3'])
+        direction, timetable = period.directions[1]
+        self.assertEqual([stop.stop_id for stop in timetable.timepoints],
+                         ['0', '1', '2', '3'])
+        self.assertEqual(timetable.rows,
+                         [[8*3600, 8*3600 + 600, 8*3600 + 1200, 8*3600 + 1800],
+                          [9*3600, 9*3600 + 600, 9*3600 + 1200, 9*3600 + 1800]])
+
+    def test_materialize(self):
+        route = self.gtfs.GetRoute('R1')
+        self.index.stops['4'] = self.gtfs.AddStop(34.0, -118.1, 'Unserved',
+                                                  stop_id='4')
+        index = pickle.loads(pickle.dumps(self.index.materialize([route])))
+        schedule = RouteSchedule(index, index.routes[0],
+                                 services=self.gtfs.GetServicePeriodList())
+        self.assertEqual(schedule.agency.agency_id, 'A')
+        self.assertEqual([stop.stop_id for stop in schedule.stops],
+                         ['0', '1', '2', '3'])
+        self.assertEqual(sorted(index.stops), ['0', '1', '2', '3', '4'])
+        trimmed = self.index.materialize([route], all_stops=False)
+        self.assertEqual(sorted(trimmed.stops), ['0', '1', '2', '3'])
+        for period, other in zip(schedule.service_periods,
+                                 self.schedule.service_periods):
+            self.assertEqual(period.name, other.name)
+            for (direction, timetable), (other_direction, other_timetable) \
+                    in zip(period.directions, other.directions):
+                self.assertEqual(direction, other_direction)
+                self.assertEqual(timetable.rows, other_timetable.rows)
+
+    def test_stop_times_fetched_once(self):
+        self.assertEqual(self.index.stop_times.misses, 6)
+        self.assertGreater(self.index.stop_times.hits, 0)
+
+    def test_partial_trips(self):
+        route = self.gtfs.GetRoute('R1')
+        stops = [self.gtfs.GetStop(str(i)) for i in range(4)]
+        for trip_id, pattern in [('T6', stops[1:3]),
+                                 ('T7', [stops[0]] + stops[2:])]:
+            trip = route.AddTrip(self.gtfs, trip_id=trip_id)
+            trip.service_id = 'WKDY'
+            for i, stop in enumerate(pattern):
+                time = '12:%02d:00' % (i*10)
+                trip.AddStopTime(stop, arrival_time=time, departure_time=time)
+        index = FeedIndex.from_schedule(self.gtfs)
+        trips = [self.gtfs.GetTrip(trip_id) for trip_id in ('T0', 'T6', 'T7')]
+        timetable = Timetable(index, trips)
+        self.assertEqual(timetable.rows[1:],
+                         [[Timetable.NO_SERVICE, 12*3600, 12*3600 + 600,
+                           Timetable.NO_SERVICE],
+                          [12*3600, Timetable.SKIP, 12*3600 + 600,
+                           12*3600 + 1200]])
+        self.assertEqual(timetable, Timetable(index, trips))
+        self.assertFalse(timetable == Timetable(index, trips[:2]))
+
+
+class TestTimetableBody(unittest.TestCase):
+
+    TEMPLATE = """\
+{% for row in timetable.rows %}
+                                        <tr>
+{% for time in row %}
+{% if time == Timetable.NO_SERVICE %}
+                                                <td class="timetable-no"></td>
+{% elif time == Timetable.SKIP %}
+                                                <td class="timetable-skip"></td>
+{% else %}
+                                                <td>{{ time|time }}</td>
+{% endif %}
+{% endfor %}
+                                        </tr>
+{% endfor %}
+"""
+
+    def test_same_as_template(self):
+        gtfs = make_schedule()
+        trips = [gtfs.GetTrip('T0'), gtfs.GetTrip('T1')]
+        timetable = Timetable(FeedIndex.from_schedule(gtfs), trips)
+        # Both codes and every minute of two days, in rows of 4 columns.
+        cells = ([Timetable.NO_SERVICE, Timetable.SKIP]*2
+                 + range(0, 2*24*3600, 60))
+        timetable.grid = array('i', cells)
+        timetable.height = len(cells) // 4
+        self.assertEqual(timetable.width, 4)
+        expected = make_env().from_string(self.TEMPLATE).render(
+            timetable=timetable, Timetable=Timetable)
+        self.assertEqual(timetable_body(timetable) + u'\n', expected)
+
+
+class TestTimetableRows(unittest.TestCase):
+
+    def test_rows(self):
+        gtfs = make_schedule()
+        timetable = Timetable(FeedIndex.from_schedule(gtfs),
+                              [gtfs.GetTrip('T0'), gtfs.GetTrip('T1')])
+        NO, SKIP = Timetable.NO_SERVICE, Timetable.SKIP
+        timetable.grid = array('i', [
+            8*3600, 8*3600 + 600, SKIP, 8*3600 + 1230,
+            NO, 7*3600, 7*3600 + 60, NO,
+            NO, NO, NO, NO,
+            25*3600, SKIP, SKIP, 25*3600 + 59])
+        timetable.height = 4
+        self.assertEqual(timetable_rows(timetable),
+                         [[0, 480, 10, None, 10],
+                          [1, -60, 1],
+                          [],
+                          [0, 1080, None, None, 0]])
+
+    def test_json_page(self):
+        outdir = Path(tempfile.mkdtemp())
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            render(FeedIndex.from_schedule(make_schedule()),
+                   date=datetime(2020, 1, 6), outdir=outdir,
+                   timetables='json')
+            page = (outdir/'routes'/'A-R1.html').read_text()
+        finally:
+            sys.stdout = stdout
+            shutil.rmtree(str(outdir))
+        self.assertIn(u'<tbody data-rows="[[0,480,10,10,10],[0,60,10,10,10]]">'
+                      u'</tbody>', page)
+        self.assertNotIn(u'<td', page)
+
+
+class TestStreamOut(unittest.TestCase):
+
+    def setUp(self):
+        self.outdir = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(str(self.outdir))
+
+    def test_stream_out(self):
+        path = self.outdir/'page.html'
+        self.assertTrue(stream_out(path, iter([u'a', u'\u00e9'])))
+        self.assertEqual(path.read_text(encoding='utf-8'), u'a\u00e9')
+        self.assertFalse(stream_out(path, iter([u'a\u00e9'])))
+        self.assertTrue(stream_out(path, iter([u'b'])))
+        self.assertEqual(path.read_text(), u'b')
+        self.assertEqual([child.name for child in self.outdir.iterdir()],
+                         ['page.html'])
+
+    def test_bytecode_cache(self):
+        make_env(self.outdir).get_template('route.html')
+        self.assertEqual(len(list((self.outdir/'templates').iterdir())), 1)
+
+
+class TestIncremental(unittest.TestCase):
+
+    def setUp(self):
+        self.gtfs = make_schedule()
+        self.outdir = Path(tempfile.mkdtemp())
+        self.page = self.outdir/'routes'/'A-R1.html'
+
+    def tearDown(self):
+        shutil.rmtree(str(self.outdir))
+
+    def render(self, partial=False):
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            render(FeedIndex.from_schedule(self.gtfs), date=datetime(2020, 1, 6),
+                   outdir=self.outdir, incremental=True, partial=partial)
+        finally:
+            sys.stdout = stdout
+
+    def test_unchanged(self):
+        self.render()
+        self.page.write_text(u'stale')
+        self.render()
+        self.assertEqual(self.page.read_text(), u'stale')
+
+    def test_changed(self):
+        self.render()
+        self.page.write_text(u'stale')
+        self.gtfs.GetRoute('R1').route_long_name = 'Broadway'
+        self.render()
+        self.assertIn(u'Broadway', self.page.read_text())
+
+    def test_removed(self):
+        self.render()
+        (self.outdir/'routes'/'A-R2.html').write_text(u'gone')
+        with (self.outdir/'manifest.json').open('rb') as fd:
+            manifest = fd.read()
+        with (self.outdir/'manifest.json').open('wb') as fd:
+            fd.write(manifest.replace('{', '{"routes/A-R2.html": "0",', 1))
+        self.render()
+        self.assertFalse((self.outdir/'routes'/'A-R2.html').exists())
+        self.assertTrue(self.page.exists())
+
+    def test_partial(self):
+        self.render()
+        (self.outdir/'index.html').write_text(u'kept')
+        (self.outdir/'routes'/'A-R2.html').write_text(u'kept')
+        self.gtfs.GetRoute('R1').route_long_name = 'Broadway'
+        self.render(partial=True)
+        self.assertEqual((self.outdir/'index.html').read_text(), u'kept')
+        self.assertEqual((self.outdir/'routes'/'A-R2.html').read_text(),
+                         u'kept')
+        self.assertIn(u'Broadway', self.page.read_text())
+
+
+class TestSelectRoutes(unittest.TestCase):
+
+    def setUp(self):
+        self.gtfs = make_schedule()
+        self.gtfs.AddAgency('Other', 'http://example.org',
+                            'America/Los_Angeles', agency_id='B')
+        route = self.gtfs.AddRoute('10X', 'Express', 'Bus', route_id='R10')
+        route.agency_id = 'B'
+        self.index = FeedIndex.from_schedule(self.gtfs)
+
+    def select(self, route_globs=(), agency_globs=()):
+        return sorted(route.route_id for route
+                      in self.index.select(route_globs, agency_globs))
+
+    def test_all(self):
+        self.assertEqual(self.select(), ['R1', 'R10'])
+
+    def test_routes(self):
+        self.assertEqual(self.select(['R1']), ['R1'])
+        self.assertEqual(self.select(['R1*']), ['R1', 'R10'])
+        self.assertEqual(self.select(['10*']), ['R10'])
+        self.assertEqual(self.select(['1', 'R10']), ['R1', 'R10'])
+        self.assertEqual(self.select(['r1']), [])
+
+    def test_agencies(self):
+        self.assertEqual(self.select(agency_globs=['B']), ['R10'])
+        self.assertEqual(self.select(agency_globs=['Agen*']), ['R1'])
+        self.assertEqual(self.select(['R1*'], ['A']), ['R1'])
+
+
+class TestServiceCalendar(unittest.TestCase):
+
+    def setUp(self):
+        self.gtfs = make_schedule()
+        # Monday, January 6, 2020 is a holiday that runs weekend service.
+        self.gtfs.GetServicePeriod('WKDY').SetDateHasService('20200106', False)
+        self.gtfs.GetServicePeriod('WKND').SetDateHasService('20200106', True)
+        self.index = FeedIndex.from_schedule(self.gtfs)
+        self.calendar = ServiceCalendar(self.index.services)
+
+    def days(self, date):
+        return {service.service_id: service.day_of_week
+                for service in self.calendar.week(date)}
+
+    def test_week(self):
+        self.assertEqual(self.days(datetime(2020, 1, 13)),
+                         {'WKDY': [True]*5 + [False]*2,
+                          'WKND': [False]*5 + [True]*2})
+
+    def test_exceptions(self):
+        self.assertEqual(self.days(datetime(2020, 1, 6)),
+                         {'WKDY': [False] + [True]*4 + [False]*2,
+                          'WKND': [True] + [False]*4 + [True]*2})
+        schedule = RouteSchedule(self.index, self.gtfs.GetRoute('R1'),
+                                 services=self.calendar.week(datetime(2020, 1, 6)))
+        self.assertEqual(sorted(period.name
+                                for period in schedule.service_periods),
+                         ['Mon, Sat - Sun', 'Tue - Fri'])
+
+    def test_end_date(self):
+        self.assertEqual(self.days(datetime(2029, 12, 29)),
+                         {'WKDY': [True, False, False, False, False, False,
+                                   False],
+                          'WKND': [False]*5 + [True]*2})
+        self.assertEqual(self.days(datetime(2030, 1, 1)), {})
+
+    def test_render_range(self):
+        outdir = Path(tempfile.mkdtemp())
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            render_range(self.index, datetime(2020, 1, 1),
+                         datetime(2020, 1, 10), outdir=outdir)
+        finally:
+            sys.stdout = stdout
+            dates = sorted(path.name for path in outdir.iterdir())
+            pages = [(outdir/date/'routes'/'A-R1.html').read_bytes()
+                     for date in dates]
+            shutil.rmtree(str(outdir))
+        self.assertEqual(len(dates), 10)
+        # Weeks that include the holiday run weekend service on Monday.
+        self.assertEqual(len(set(pages[:6])), 1)
+        self.assertEqual(len(set(pages[6:])), 1)
+        self.assertNotEqual(pages[0], pages[6])
+        self.assertNotEqual(service_key(self.calendar.week(datetime(2020, 1, 6))),
+                            service_key(self.calendar.week(datetime(2020, 1, 7))))
+
+
+if __name__ == '__main__':
+    unittest.main()
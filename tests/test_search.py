@@ -0,0 +1,71 @@
+import json
+import re
+import shutil
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+from StringIO import StringIO
+
+from pathlib2 import Path
+
+from busbook.data import DATA_DIR
+from busbook.render import FeedIndex, Record, render, stop_routes
+from busbook.search import search_keys, search_shards
+
+from test_render import make_schedule
+
+
+class TestSearch(unittest.TestCase):
+
+    def setUp(self):
+        self.gtfs = make_schedule()
+        self.index = FeedIndex.from_schedule(self.gtfs)
+
+    def test_search_keys(self):
+        stop = Record(stop_id='R1-S9', stop_name=u'Main St & 5th Ave')
+        self.assertEqual(search_keys(stop),
+                         ['5th', 'ave', 'main', 'r1', 's9', 'st'])
+        self.assertEqual(search_keys(Record(stop_id='1',
+                                            stop_name='\xc3\x89toile')),
+                         ['1', u'\xe9toile'])
+
+    def test_stop_routes(self):
+        routes = stop_routes(self.index)
+        self.assertEqual(sorted(routes), ['0', '1', '2', '3'])
+        [(route, headsigns)] = routes['1']
+        self.assertEqual(route.route_id, 'R1')
+        self.assertEqual(headsigns, ['Stop 0', 'Stop 3'])
+
+    def test_search_shards(self):
+        shards = search_shards(self.index, stop_routes(self.index),
+                               shard_size=3)
+        entries = [entry for shard in shards for entry in shard]
+        self.assertEqual([len(shard) for shard in shards], [3, 3, 2])
+        # Each stop is found by its id and the words of its name.
+        self.assertEqual([(key, stop_id) for key, stop_id, name, routes
+                          in entries],
+                         [('0', '0'), ('1', '1'), ('2', '2'), ('3', '3'),
+                          ('stop', '0'), ('stop', '1'), ('stop', '2'),
+                          ('stop', '3')])
+        self.assertEqual(entries[1][2:],
+                         ['Stop 1', [['A-R1', ['Stop 0', 'Stop 3']]]])
+
+    def test_index_page(self):
+        outdir = Path(tempfile.mkdtemp())
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            render(self.index, date=datetime(2020, 1, 6), outdir=outdir)
+            page = (outdir/'index.html').read_text()
+            search_file = re.search(r'static/data/(search-\w+\.js)',
+                                    page).group(1)
+            script = (outdir/DATA_DIR/search_file).read_bytes()
+            shard_files = json.loads(script[script.index('], ') + 3:-3])
+            for name in shard_files:
+                self.assertTrue((outdir/DATA_DIR/name).exists())
+        finally:
+            sys.stdout = stdout
+            shutil.rmtree(str(outdir))
+        self.assertIn(u'data-route="A-R1"', page)
+        self.assertTrue(script.startswith('StopSearch.setIndex(["0"],'))
+        self.assertEqual(len(shard_files), 1)
@@ -1,6 +1,64 @@
+import random
 import unittest
 
-from busbook.render import unite
+import networkx
+from hypothesis import given, settings
+from hypothesis.strategies import integers, lists
+
+from benchmarks.order_trips import graph_order, trip_graph
+from busbook.render import order_trips, unite
+
+
+def graph_unite(*sequences):
+    """The original networkx implementation of unite(), kept as a reference."""
+    graph = networkx.DiGraph()
+    all_items = reduce(lambda s1, s2: s1.union(s2),
+                       (set(sequence) for sequence in sequences))
+    node_item = {n: item for n, item in enumerate(all_items)}
+    for node in node_item.keys():
+        graph.add_node(node)
+    next_node = len(all_items)
+    for sequence in sequences:
+        items = iter(sequence)
+        try:
+            first_item = next(items)
+        except StopIteration:
+            break
+        last_node = min(node for node, item in node_item.iteritems()
+                        if item == first_item)
+        for this_item in items:
+            try:
+                new_node = min(node for node, item in node_item.iteritems()
+                               if item == this_item
+                                  and not networkx.has_path(graph, node, last_node))
+            except ValueError: # No node found.
+                new_node = next_node
+                node_item[next_node] = this_item
+                next_node += 1
+            if not graph.has_edge(last_node, new_node):
+                graph.add_edge(last_node, new_node)
+            last_node = new_node
+    topo_sort = networkx.topological_sort(graph)
+    return [node_item[node] for node in topo_sort]
+
+
+def is_subsequence(sub, sequence):
+    items = iter(sequence)
+    return all(any(item == other for other in items) for item in sub)
+
+
+def first_order(trip_cells):
+    """Return the graph of the order of each two trips at their first shared
+    timepoint.
+    """
+    graph = networkx.DiGraph()
+    graph.add_nodes_from(range(len(trip_cells)))
+    for a, cells in enumerate(trip_cells):
+        for b, other in enumerate(trip_cells):
+            shared = [c for c in cells if c in other]
+            if len(shared) > 0 and cells[min(shared)] < other[min(shared)]:
+                graph.add_edge(a, b)
+    return graph
 
 
 class TestUnite(unittest.TestCase):
@@ -33,6 +91,158 @@ class TestUnite(unittest.TestCase):
         self.assertEqual(unite([1, 2, 3, 2, 1, 2, 3], [2, 2, 2, 3]),
                          [1, 2, 3, 2, 1, 2, 3])
 
+    def test_reorder(self):
+        self.assertEqual(unite([1, 2], [3, 4], [4, 1]),
+                         [3, 4, 1, 2])
+
+    @settings(max_examples=500)
+    @given(lists(lists(integers(0, 11), min_size=1, max_size=10),
+                 min_size=1, max_size=6))
+    def test_random(self, sequences):
+        expected = graph_unite(*sequences)
+        res = unite(*sequences)
+        self.assertEqual(len(res), len(expected))
+        self.assertEqual(sorted(res), sorted(expected))
+        for sequence in sequences:
+            self.assertTrue(is_subsequence(sequence, res))
+
+
+class TestOrderTrips(unittest.TestCase):
+
+    def test_simple(self):
+        self.assertEqual(order_trips([{0: 200, 1: 300},
+                                      {0: 100, 1: 200},
+                                      {0: 300, 1: 400}]),
+                         [1, 0, 2])
+
+    def test_late_start(self):
+        self.assertEqual(order_trips([{0: 100, 1: 200, 2: 300},
+                                      {0: 300, 1: 400, 2: 500},
+                                      {1: 250, 2: 350}]),
+                         [0, 2, 1])
+
+    def test_skip(self):
+        self.assertEqual(order_trips([{0: 100, 2: 300},
+                                      {0: 200, 2: 400},
+                                      {1: 100, 2: 350}]),
+                         [0, 2, 1])
+
+    def test_overtake(self):
+        # The first shared timepoint decides.
+        self.assertEqual(order_trips([{0: 100, 1: 200, 2: 900},
+                                      {0: 150, 1: 250, 2: 350}]),
+                         [0, 1])
+
+    def test_overtake_late_start(self):
+        # Trip 1 reaches timepoint 3 before trip 3, though trip 0 overtakes
+        # it and trip 3 follows trip 0.
+        self.assertEqual(order_trips([{0: 120, 1: 270, 2: 420, 4: 720},
+                                      {0: 120, 1: 720, 2: 1320, 3: 1920},
+                                      {0: 300, 1: 450},
+                                      {3: 2100, 4: 2700}]),
+                         [0, 1, 2, 3])
+
+    def test_tie(self):
+        self.assertEqual(order_trips([{0: 100}, {0: 100}, {0: 50}]),
+                         [2, 0, 1])
+
+    def test_disjoint(self):
+        self.assertEqual(order_trips([{0: 500, 1: 600},
+                                      {2: 300, 3: 400},
+                                      {2: 900, 3: 1000}]),
+                         [1, 0, 2])
+
+    def test_random(self):
+        rand = random.Random(0)
+        for _ in range(200):
+            columns = rand.randint(1, 8)
+            offsets = [0]
+            for _ in range(columns - 1):
+                offsets.append(offsets[-1] + rand.randint(1, 10)*60)
+            bases = []
+            trip_cells = []
+            for _ in range(rand.randint(1, 30)):
+                begin = rand.randrange(columns)
+                end = rand.randint(begin, columns - 1)
+                base = rand.randint(0, 100)*60
+                bases.append(base)
+                trip_cells.append({c: base + offsets[c]
+                                   for c in range(begin, end + 1)
+                                   if c in (begin, end) or rand.random() > 0.3})
+            order = order_trips(trip_cells)
+            self.assertEqual(sorted(order), range(len(trip_cells)))
+            position = {n: i for i, n in enumerate(order)}
+            for a, cells in enumerate(trip_cells):
+                for b, other in enumerate(trip_cells):
+                    if (bases[a] < bases[b]
+                            and any(c in other for c in cells)):
+                        self.assertLess(position[a], position[b],
+                                        trip_cells)
+
+    def test_random_overtake(self):
+        rand = random.Random(0)
+        for _ in range(500):
+            columns = rand.randint(1, 8)
+            trip_cells = []
+            for _ in range(rand.randint(1, 20)):
+                begin = rand.randrange(columns)
+                end = rand.randint(begin, columns - 1)
+                time = rand.randint(0, 60)*60
+                cells = {}
+                for c in range(begin, end + 1):
+                    if c in (begin, end) or rand.random() > 0.3:
+                        cells[c] = time
+                    time += rand.randint(1, 10)*60
+                trip_cells.append(cells)
+            order = order_trips(trip_cells)
+            self.assertEqual(sorted(order), range(len(trip_cells)))
+
+            first = first_order(trip_cells)
+            if networkx.is_directed_acyclic_graph(first):
+                for expected in (order, graph_order(trip_cells)):
+                    position = {n: i for i, n in enumerate(expected)}
+                    for a, b in first.edges():
+                        self.assertLess(position[a], position[b], trip_cells)
+
+    def test_overtake_cycle(self):
+        # Trips 1, 2 and 3 order each other in a cycle at their first shared
+        # timepoints; the original sort gave up trip 3 before trip 1.
+        trip_cells = [{0: 120}, {2: 720, 3: 1020}, {0: 60, 2: 840, 4: 1860},
+                      {0: 120, 3: 780}, {3: 1080}, {5: 180},
+                      {3: 960, 5: 1500}, {4: 720}, {4: 1200, 5: 1740},
+                      {3: 660, 4: 960}]
+        order = order_trips(trip_cells)
+        self.assertLess(order.index(1), order.index(2))
+        self.assertLess(order.index(2), order.index(3))
+
+    def test_random_cycle(self):
+        # Dense, overtaking trips, whose first shared timepoints often order
+        # them in cycles; the waits the original sort kept are kept.
+        rand = random.Random(0)
+        cycles = 0
+        for _ in range(300):
+            columns = rand.randint(2, 8)
+            trip_cells = []
+            for _ in range(rand.randint(3, 25)):
+                begin = rand.randrange(columns)
+                end = rand.randint(begin, columns - 1)
+                time = rand.randint(0, 20)*60
+                cells = {}
+                for c in range(begin, end + 1):
+                    if c in (begin, end) or rand.random() > 0.3:
+                        cells[c] = time
+                    time += rand.randint(1, 10)*60
+                trip_cells.append(cells)
+            graph = trip_graph(trip_cells)
+            order = order_trips(trip_cells)
+            self.assertEqual(sorted(order), range(len(trip_cells)))
+            position = {n: i for i, n in enumerate(order)}
+            for a, b in graph.edges():
+                self.assertLess(position[a], position[b], trip_cells)
+            if not networkx.is_directed_acyclic_graph(first_order(trip_cells)):
+                cycles += 1
+        self.assertGreater(cycles, 50)
+
 
 if __name__ == '__main__':
     unittest.main()
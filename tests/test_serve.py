@@ -0,0 +1,120 @@
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import urllib2
+from datetime import datetime
+from StringIO import StringIO
+
+from pathlib2 import Path
+
+from busbook.render import FeedIndex, render
+from busbook.serve import BookServer, LazyBook, LRUCache
+
+from test_render import make_schedule
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_evict(self):
+        cache = LRUCache(2)
+        cache.get('a', lambda: 1)
+        cache.get('b', lambda: 2)
+        cache.get('a', lambda: None)
+        cache.get('c', lambda: 3)
+        self.assertEqual(cache.get('a', lambda: None), 1)
+        self.assertEqual(cache.get('b', lambda: None), None)
+        self.assertEqual(len(cache), 2)
+
+    def test_shared_computation(self):
+        cache = LRUCache(2)
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return 'page'
+
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(cache.get('a', compute)))
+            for n in range(4)]
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        while cache.waits < 3:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, ['page']*4)
+        self.assertEqual((cache.misses, cache.hits, cache.waits), (1, 0, 3))
+
+    def test_error(self):
+        cache = LRUCache(2)
+
+        def compute():
+            raise ValueError
+        self.assertRaises(ValueError, cache.get, 'a', compute)
+        self.assertEqual(cache.get('a', lambda: 1), 1)
+
+
+class TestServe(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = Path(tempfile.mkdtemp())
+        self.index = FeedIndex.from_schedule(make_schedule()).materialize()
+        self.book = LazyBook(self.index, self.tmpdir/'serve')
+        self.stdout, sys.stdout = sys.stdout, StringIO()
+        self.stderr, sys.stderr = sys.stderr, StringIO()
+
+    def tearDown(self):
+        sys.stdout, sys.stderr = self.stdout, self.stderr
+        shutil.rmtree(str(self.tmpdir))
+
+    def test_same_as_render(self):
+        outdir = self.tmpdir/'out'
+        render(self.index, date=datetime(2020, 1, 6), outdir=outdir)
+        page = self.book.route_page('routes/A-R1.html', datetime(2020, 1, 6))
+        self.assertEqual(page, (outdir/'routes'/'A-R1.html').read_bytes())
+        self.assertIsNone(self.book.route_page('routes/A-R2.html',
+                                               datetime(2020, 1, 6)))
+
+    def test_service_key(self):
+        for day in range(6, 13):
+            self.book.route_page('routes/A-R1.html', datetime(2020, 1, day))
+        self.assertEqual((self.book.pages.misses, self.book.pages.hits), (1, 6))
+
+    def test_server(self):
+        server = BookServer(('127.0.0.1', 0), self.book)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        url = 'http://127.0.0.1:%d/' % server.server_address[1]
+        try:
+            index = urllib2.urlopen(url + '?date=2020-01-06').read()
+            self.assertIn('routes/A-R1.html?date=2020-01-06', index)
+            page = urllib2.urlopen(url + 'routes/A-R1.html?date=2020-01-06')
+            self.assertEqual(page.info()['Content-Type'],
+                             'text/html; charset=utf-8')
+            self.assertIn('Main St', page.read())
+            self.assertIn('Tabs', urllib2.urlopen(url + 'static/common.js').read())
+            for path, code in [('routes/A-R2.html', 404),
+                               ('static/../../setup.py', 404),
+                               ('routes/A-R1.html?date=tomorrow', 400)]:
+                with self.assertRaises(urllib2.HTTPError) as context:
+                    urllib2.urlopen(url + path)
+                self.assertEqual(context.exception.code, code)
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import json
+import shutil
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+from StringIO import StringIO
+
+from pathlib2 import Path
+
+from busbook.render import FeedIndex, Record, render
+from busbook.timing import NULL_PROFILER, Profiler
+
+from test_render import make_schedule
+
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmpdir))
+
+    def test_slowest(self):
+        profiler = Profiler()
+        profiler.merge({'A': {'route_id': 'A', 'seconds': 1.0},
+                        'B': {'route_id': 'B', 'seconds': 3.0},
+                        'C': {'route_id': 'C', 'seconds': 2.0}})
+        self.assertEqual([entry['route_id']
+                          for entry in profiler.slowest(2)], ['B', 'C'])
+
+    def test_route_steps(self):
+        profiler = Profiler()
+        route = Record(route_id='R1', route_short_name='1',
+                       route_long_name='Main St')
+        with profiler.route(route, 'schedule'):
+            pass
+        with profiler.route(route, 'render'):
+            pass
+        entry = profiler.routes['R1']
+        self.assertEqual(entry['name'], '1 Main St')
+        self.assertAlmostEqual(entry['seconds'],
+                               entry['schedule'] + entry['render'])
+
+    def test_render(self):
+        profiler = Profiler()
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            render(FeedIndex.from_schedule(make_schedule()),
+                   date=datetime(2020, 1, 6), outdir=self.tmpdir/'out',
+                   profiler=profiler)
+        finally:
+            sys.stdout = stdout
+        self.assertEqual([entry['phase'] for entry in profiler.phases],
+                         ['prepare', 'data', 'index page', 'routes'])
+        self.assertEqual(profiler.routes.keys(), ['R1'])
+        for entry in profiler.phases:
+            self.assertGreaterEqual(entry['max_rss_so_far_kb'],
+                                    entry['max_rss_increase_kb'])
+            self.assertGreaterEqual(entry['max_rss_increase_kb'], 0)
+
+        path = str(self.tmpdir/'profile.json')
+        profiler.write(path)
+        with open(path) as fd:
+            report = json.load(fd)
+        self.assertEqual([entry['route_id'] for entry in report['routes']],
+                         ['R1'])
+
+    def test_summary(self):
+        profiler = Profiler()
+        route = Record(route_id='R1', route_short_name=u'1',
+                       route_long_name=u'Caf\xe9 St')
+        with profiler.phase('routes'):
+            with profiler.route(route, 'render'):
+                pass
+        self.assertIn(u'1 Caf\xe9 St', profiler.summary())
+        self.assertIn('Raised by', profiler.summary())
+
+    def test_null_profiler(self):
+        with NULL_PROFILER.phase('load'):
+            with NULL_PROFILER.route(None, 'render'):
+                pass
+        self.assertFalse(NULL_PROFILER.enabled)
+
+
+if __name__ == '__main__':
+    unittest.main()